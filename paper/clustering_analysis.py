@@ -16,7 +16,8 @@ from sklearn.cluster import SpectralClustering
 
 from scipy.spatial.distance import pdist, squareform
 from scipy.stats import pearsonr
-from scipy.sparse import csgraph
+from scipy.sparse import csgraph, csr_matrix, issparse
+from scipy.sparse.linalg import eigsh
 from scipy.linalg import eigvalsh
 
 import polyphase as phase
@@ -110,14 +111,108 @@ def perform_MDS(M):
     
     return emb,explained_variance
 
+def get_knn_graph(M, n_neighbors=10, memory_budget=2**28):
+    """Sparse k-nearest neighbour graph of a metric
+    
+    Input:
+    ======
+        M             :  Metric as a matrix of shape (n_samples, n_samples) (a numpy array, memory map or 
+                         `polyphase.CondensedDistanceMatrix` whose rows are read a block at a time) or a sparse 
+                         matrix of distances to (at least) the neighbours, entries that are not stored are not edges
+        n_neighbors   :  Number of nearest neighbours kept per sample (excluding itself)
+        memory_budget :  (int) Approximate number of bytes used by a block of rows (default, 256 MB)
+        
+    Output:
+    =======
+        G  :  Distances to the nearest neighbours as a sparse matrix of shape (n_samples, n_samples) 
+              with n_neighbors entries per row
+    """
+    n_samples = M.shape[0]
+    # a row of distances and the integer temporaries of reading (e.g. CondensedDistanceMatrix.rows) and 
+    # partitioning it take about 8 arrays of n_samples 8 byte items
+    chunksize = int(max(1, memory_budget//(64*n_samples)))
+    if issparse(M):
+        M = csr_matrix(M)
+    rows, cols, dists = [], [], []
+    for start in range(0, n_samples, chunksize):
+        stop = min(start+chunksize, n_samples)
+        if issparse(M):
+            # stored entries are edges (explicit zeros are identical samples), missing ones are not
+            sub = M[start:stop]
+            block = np.full((stop-start, n_samples), np.inf)
+            block[np.repeat(np.arange(stop-start), np.diff(sub.indptr)), sub.indices] = sub.data
+        else:
+            block = np.array(M[start:stop], dtype=float)
+        block[np.arange(stop-start), np.arange(start, stop)] = np.inf
+        ids = np.argpartition(block, n_neighbors-1, axis=1)[:,:n_neighbors]
+        rows.append(np.repeat(np.arange(start, stop), n_neighbors))
+        cols.append(ids.ravel())
+        dists.append(np.take_along_axis(block, ids, axis=1).ravel())
+    rows, cols, dists = np.concatenate(rows), np.concatenate(cols), np.concatenate(dists)
+    finite = np.isfinite(dists)
+    
+    return csr_matrix((dists[finite], (rows[finite], cols[finite])), shape=(n_samples, n_samples))
+
+def get_knn_affinity(G, delta=None):
+    """Symmetric sparse Gaussian similarity of a k-nearest neighbour graph (see `get_knn_graph`)
+    
+    G     : Distances to the nearest neighbours as a sparse matrix of shape (n_samples, n_samples)
+    delta : Width of the Gaussian (default, None i.e. standard deviation of the neighbour distances)
+    
+    returns a sparse matrix of shape (n_samples, n_samples)
+    """
+    G = csr_matrix(G)
+    if delta is None:
+        delta = G.data.std()
+    X = G.copy()
+    X.data = np.exp(- X.data ** 2 / (2. * delta ** 2))
+    
+    return X.maximum(X.T).tocsr()
+
+def perform_spectral_embedding(X, G, n_components=3):
+    """Laplacian eigenmap of a sparse affinity using a sparse eigen solver
+    
+    Input:
+    ======
+         X    :  Affinity as a sparse matrix of shape (n_samples, n_samples) (see `get_knn_affinity`)
+         G    :  Distances to the nearest neighbours as a sparse matrix used for the explained variance
+    Output:
+    =======
+        emb  :  Embedding as an array of shape (n_samples, n_components)
+        explained_variance : Output from the function `_get_explained_variance_sparse` below
+    """
+    L = csgraph.laplacian(csr_matrix(X), normed=True)
+    # largest eigen values of I-L are the smallest of L, the first one being the trivial mode
+    n_samples = L.shape[0]
+    _, vecs = eigsh(-L, k=n_components+1, sigma=1.0, which='LM', 
+                    v0=np.ones(n_samples)/np.sqrt(n_samples))
+    emb = vecs[:,-2::-1][:,:n_components]
+    explained_variance = _get_explained_variance_sparse(G, emb)
+    
+    return emb, explained_variance
+
+def _get_explained_variance_sparse(G, emb):
+    """Explained variance (see `_get_explained_variance`) using only the pairs of nearest neighbours
+    stored in a sparse metric G
+    """
+    G = G.tocoo()
+    explained_variance = []
+    for dim in [1,2,3]:
+        Dy = np.linalg.norm(emb[G.row,:dim]-emb[G.col,:dim], axis=1)
+        explained_variance.append(pearsonr(G.data, Dy)[0])
+    
+    return explained_variance
+
 # 5. Perform clustering
-def cluster_embedding(X, emb, n_clusters=4):
+def cluster_embedding(X, emb, n_clusters=4, n_neighbors=None):
     """Given a low dimensional embedding, cluster them and return labels,
     eigen values of graph Laplacian
     
-    X : affinity matrix of images
+    X : affinity matrix of images (dense or sparse)
     emb : embedding (array of shape (num_points, dimension))
     n_clusters : Number of clusters expected
+    n_neighbors : Number of nearest neighbours used for a sparse affinity of the embedding
+                  (default, None i.e. a dense affinity of all pairs)
     
     returns:
         higdim_labels : Labels for the clustering performed on images addinity matrix
@@ -130,9 +225,13 @@ def cluster_embedding(X, emb, n_clusters=4):
     
     highdim_labels = clustering.fit_predict(X)
     
-    D = squareform(pdist(emb, 'euclidean'))
     delta = 0.01
-    A = np.exp(- D ** 2 / (2. * delta ** 2))
+    if n_neighbors is None:
+        D = squareform(pdist(emb, 'euclidean'))
+        A = np.exp(- D ** 2 / (2. * delta ** 2))
+    else:
+        from sklearn.neighbors import kneighbors_graph
+        A = get_knn_affinity(kneighbors_graph(emb, n_neighbors, mode='distance'), delta=delta)
     lowdim_labels = clustering.fit_predict(A)
     
     return highdim_labels, lowdim_labels
@@ -141,7 +240,16 @@ class Pipeline:
     """A pipeline class used for cluster analysis
     Inputs:
     =======
-        M.  :  Metric as a matrix of shape (n_samples, n_samples)
+        M.          :  Metric as a matrix of shape (n_samples, n_samples) or a sparse matrix of 
+                       distances to the neighbours or a `polyphase.DiagramIndex` of the phase diagrams 
+                       (affinity='knn' only)
+        affinity    :  (str) Similarity measure used for clustering
+                       1. 'dense' -- Gaussian similarity of all pairs (default)
+                       2. 'knn' -- sparse Gaussian similarity of the n_neighbors nearest neighbours only, 
+                                   with the spectral embedding computed using sparse eigen solvers
+        n_neighbors :  Number of nearest neighbours used by affinity='knn' (default, 10)
+        memory_budget : (int) Approximate number of bytes used by a block of rows of M when computing the 
+                        nearest neighbours (default, 256 MB, see `get_knn_graph`)
         
     Methods:
     ========
@@ -152,26 +260,50 @@ class Pipeline:
     
     Attributes:
     ===========
-        X.                  : Gaussian similarity measure computed
+        X.                  : Gaussian similarity measure computed (a sparse matrix if affinity='knn')
+        G                   : Distances to the nearest neighbours as a sparse matrix (affinity='knn' only)
         emb.                :  Embedding obtained when calling `.compute` method
         explained_variance  : Explained variance of the method used in `.compute`
         highdim_labels      : Labels of spectral clustering method with metric on the original data space
         lowdim_labels       : Labels of spectral clustering method with metric on the embedding Euclidean data space
     
     """
-    def __init__(self,M):
+    def __init__(self,M, affinity='dense', n_neighbors=10, memory_budget=2**28):
         self.M = M
-        delta = M.std()
-        self.X = np.exp(- M ** 2 / (2. * delta ** 2))
+        self.affinity = affinity
+        self.n_neighbors = n_neighbors
+        self.memory_budget = memory_budget
+        if affinity=='dense':
+            delta = M.std()
+            self.X = np.exp(- M ** 2 / (2. * delta ** 2))
+        elif affinity=='knn':
+            if isinstance(M, phase.DiagramIndex):
+                self.G = M.kneighbors_graph(n_neighbors=n_neighbors)
+            else:
+                self.G = get_knn_graph(M, n_neighbors=n_neighbors, memory_budget=memory_budget)
+            self.X = get_knn_affinity(self.G)
+        else:
+            raise KeyError('Affinity {} is not available, use dense or knn'.format(affinity))
         
     def compute(self, drmethod='isomap', n_clusters=4):
-        if drmethod=='isomap':
+        """
+        drmethod : (str) dimensionality reduction method: 'isomap', 'mds' (dense affinity only) or 
+                   'spectral' (Laplacian eigenmap of the affinity, always used with affinity='knn')
+        """
+        if self.affinity=='knn' or drmethod=='spectral':
+            if self.affinity=='dense':
+                self.G = get_knn_graph(self.M, n_neighbors=self.n_neighbors, 
+                                       memory_budget=self.memory_budget)
+            self.emb, self.explained_variance = perform_spectral_embedding(csr_matrix(self.X), self.G)
+        elif drmethod=='isomap':
             self.emb, self.explained_variance = perform_isomap(self.M)
         elif drmethod=='mds':
             self.emb, self.explained_variance = perform_MDS(self.M)
-            
+        
+        n_neighbors = self.n_neighbors if self.affinity=='knn' else None
         self.highdim_labels, self.lowdim_labels = cluster_embedding(self.X, self.emb,
-                                                                        n_clusters=n_clusters)
+                                                                        n_clusters=n_clusters, 
+                                                                        n_neighbors=n_neighbors)
         
         return
     
@@ -1,9 +1,59 @@
 from .utils import *
 from .utils import _utri2mat
-from .visuals import *
-from .visuals import _set_axislabels_mpltern
-from .parallel import *
-from .tests import TestAngles, TestEpiGraph, TestPhaseSplits, CentralDifference
-from .core import PHASE
-from ._phase import makegridnd, is_boundary_point
-from .lsa import LSA
\ No newline at end of file
+import importlib
+
+# Public names are imported from their modules on the first access so that `import polyphase` does not
+# pull in matplotlib, mpltern, ray, pandas or autograd, e.g. for workers that only need `makegridnd`
+_lazy_imports = {
+    'plot_energy_landscape' : '.visuals',
+    'plain_phase_diagram' : '.visuals',
+    'TernaryPlot' : '.visuals',
+    'QuaternaryPlot' : '.visuals',
+    '_set_axislabels_mpltern' : '.visuals',
+    'get_distance_matrix' : '.parallel',
+    'CondensedDistanceMatrix' : '.parallel',
+    'TestAngles' : '.tests',
+    'TestEpiGraph' : '.tests',
+    'TestPhaseSplits' : '.tests',
+    'CentralDifference' : '.tests',
+    'TestSimplices' : '.tests',
+    'TestSampledSplits' : '.tests',
+    'get_epigraph_violations' : '.tests',
+    'PHASE' : '.core',
+    'makegridnd' : '._phase',
+    'makegridsample' : '._phase',
+    'is_boundary_point' : '._phase',
+    'LowerHull' : '._phase',
+    'LSA' : '.lsa',
+    'Spinodal' : '.spinodal',
+    'certify_miscibility' : '.spinodal',
+    'rasterize' : '.raster',
+    'rasterize_labels' : '.raster',
+    'rasterize_simplices' : '.raster',
+    'to_rgb' : '.raster',
+    'write_png' : '.raster',
+    'get_label_stack' : '.metrics',
+    'hamming_distance' : '.metrics',
+    'area_distance' : '.metrics',
+    'sliced_wasserstein_distance' : '.metrics',
+    'DiagramIndex' : '.metrics',
+}
+
+# `from polyphase import *` exports the eagerly imported names of utils and the lazily imported ones
+__all__ = [name for name in dir(utils) if not name.startswith('_')] + [name for name in _lazy_imports if not name.startswith('_')]
+
+_submodules = ['_phase', 'core', 'lsa', 'metrics', 'parallel', 'raster', 'spinodal', 'tests', 'visuals']
+
+def __getattr__(name):
+    if name in _lazy_imports:
+        value = getattr(importlib.import_module(_lazy_imports[name], __name__), name)
+    elif name in _submodules:
+        value = importlib.import_module('.'+name, __name__)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    globals()[name] = value
+
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_imports) | set(_submodules))
@@ -1,7 +1,6 @@
 import pdb
 import numpy as np
 import time
-import pandas as pd
 import os
 from collections import Counter
     
@@ -12,10 +11,10 @@ from scipy.sparse.csgraph import connected_components
 from numpy.linalg import norm
 
 import warnings
-from itertools import combinations
-from math import pi
+from itertools import combinations, product
+from math import pi, factorial, comb
 from collections import defaultdict 
-import ray
+from .utils import batch_energy, lazy_remote
 
 MIN_POINT_PRECISION = 1e-8
             
@@ -32,6 +31,66 @@ def makegridnd(meshsize, dimension):
 
     return plane_mesh
 
+def makegridsample(num_points, dimension, method='sobol', seed=None):
+    """
+    Given a point budget and a dimension, draws quasi-random compositions on the simplex.
+    
+    Points are drawn from a low-discrepancy sequence (method='sobol' or 'halton') in the 
+    (dimension-1) unit hypercube and mapped to the simplex using sorted spacings. 
+    Returns an array of shape (dimension, num_points) similar to `makegridnd`
+    """
+    from scipy.stats import qmc
+    
+    if method=='sobol':
+        sampler = qmc.Sobol(d=dimension-1, scramble=True, seed=seed)
+    elif method=='halton':
+        sampler = qmc.Halton(d=dimension-1, scramble=True, seed=seed)
+    else:
+        raise KeyError('Sampling method {} is not available, use sobol or halton'.format(method))
+    
+    with warnings.catch_warnings():
+        # sobol sequences are balanced only for powers of two
+        warnings.simplefilter('ignore')
+        u = sampler.random(num_points)
+    u = np.sort(u, axis=1)
+    u = np.hstack((np.zeros((num_points,1)), u, np.ones((num_points,1))))
+    spacings = np.diff(u, axis=1)
+    plane_mesh = MIN_POINT_PRECISION + (1-dimension*MIN_POINT_PRECISION)*spacings
+    
+    return plane_mesh.T
+
+def get_sample_spacing(grid):
+    """
+    Reference length of quasi-random compositions (array of shape (dimension, num_points)) used for thresholding.
+    
+    Returns the largest distance of a point to its (dimension-1)-th nearest neighbor, i.e. the size of the 
+    largest gap between the samples that a simplex of neighboring points can span. Unlike a lattice, the 
+    edges of simplices of sampled points are not all of the same length, so that the threshold needs to 
+    be relative to the actual gaps between the samples.
+    """
+    from scipy.spatial import cKDTree
+    
+    k = grid.shape[0]-1
+    distances, _ = cKDTree(grid.T).query(grid.T, k=k+1)
+    
+    return np.max(distances[:,k])
+
+def _makegrid(meshsize, dimension, **kwargs):
+    """ Generate a grid and its reference length based on the sampling requested in kwargs """
+    sampling = kwargs.get('sampling', None)
+    if sampling is None:
+        grid = makegridnd(meshsize, dimension)
+        spacing = euclidean(grid[:,0],grid[:,1])
+    else:
+        num_samples = kwargs.get('num_samples', None)
+        if num_samples is None:
+            num_samples = comb(meshsize+dimension-2, dimension-1)
+        grid = makegridsample(num_samples, dimension, method=sampling, 
+                              seed=kwargs.get('sampling_seed', None))
+        spacing = get_sample_spacing(grid)
+        
+    return grid, spacing
+
 def label_simplex(grid, simplex, thresh):
     """ given a simplex, labels it to be a n-phase region by computing number of connected components """
     coords = [grid[:,x] for x in simplex]
@@ -43,6 +102,46 @@ def label_simplex(grid, simplex, thresh):
 
     return n_components
 
+def get_simplex_mst_weights(grid, simplices):
+    """ 
+    Sorted edge lengths of the minimum spanning tree of each simplex (Prim's algorithm on all simplices at once)
+    
+    For any threshold, the number of connected components computed by `label_simplex` is the number of 
+    vertices of a simplex minus the number of its spanning tree edges shorter than the threshold.
+    
+    returns an array of shape (num_simplices, num_vertices-1)
+    """
+    simplices = np.asarray(simplices)
+    coords = np.transpose(grid[:,simplices], (1,2,0))
+    dist = np.linalg.norm(coords[:,:,np.newaxis,:]-coords[:,np.newaxis,:,:], axis=-1)
+    num_simplices, num_vertices = simplices.shape
+    rows = np.arange(num_simplices)
+    in_tree = np.zeros((num_simplices, num_vertices), dtype=bool)
+    in_tree[:,0] = True
+    reach = dist[:,0,:].copy()
+    weights = np.zeros((num_simplices, num_vertices-1))
+    for i in range(num_vertices-1):
+        candidates = np.where(in_tree, np.inf, reach)
+        nearest = np.argmin(candidates, axis=1)
+        weights[:,i] = candidates[rows, nearest]
+        in_tree[rows, nearest] = True
+        reach = np.minimum(reach, dist[rows, nearest, :])
+        
+    return np.sort(weights, axis=1)
+
+def label_simplices(mst_weights, thresh):
+    """ 
+    Number of connected components of simplices from their spanning tree edge lengths (see `get_simplex_mst_weights`)
+    
+    thresh : a float or an array of thresholds
+    
+    returns an integer array of shape (num_simplices,) or (num_thresholds, num_simplices)
+    """
+    thresh = np.asarray(thresh, dtype=float)
+    num_vertices = mst_weights.shape[1]+1
+    
+    return num_vertices - np.sum(mst_weights<thresh[...,np.newaxis,np.newaxis], axis=-1)
+
 def is_purecomp_hull(grid, simplex):
     """ 
     return True if a simplex connects only the pure components
@@ -120,6 +219,47 @@ def is_nzero_comp(n,point, zero_value = MIN_POINT_PRECISION):
     
     return n_out>=n
 
+def lift_label_planes(grid, lift_grid, simplices, equations, chunksize=2**22):
+    """ Lifting the labels from simplices to points using the facet planes
+    
+    Each point is located in the simplex whose facet plane is the highest at its composition 
+    (lower convex hull is the maximum of its facet planes) and is accepted only if its 
+    barycentric coordinates lie with in the simplex. Works for any dimension.
+    
+    returns index of simplex for each point in lift_grid (-1 if none) and coplanar flags of simplices
+    """
+    coplanar = np.isclose(equations[:,-2], 0.0, atol=1e-10)
+    nz = np.where(coplanar, -1.0, equations[:,-2])
+    normals = equations[:,:-2]/nz.reshape(-1,1)
+    offsets = equations[:,-1]/nz
+    
+    verts = np.transpose(grid[:-1,:][:,simplices], (1,2,0))
+    T = np.transpose(verts[:,:-1,:]-verts[:,-1:,:], (0,2,1))
+    Tinv = np.linalg.pinv(T)
+    
+    points = lift_grid[:-1,:].T
+    owner = -1*np.ones(points.shape[0], dtype=int)
+    valid = np.where(np.logical_and(~coplanar, nz<0))[0]
+    if len(valid)==0:
+        return owner, coplanar
+    step = max(1, chunksize//len(valid))
+    for start in range(0, points.shape[0], step):
+        p = points[start:start+step]
+        heights = -(p@normals[valid].T + offsets[valid])
+        # coplanar simplices share the highest plane, any of them can contain the point
+        rows, cols = np.nonzero(heights>=np.max(heights, axis=1, keepdims=True)-1e-10)
+        candidates = valid[cols]
+        b = np.einsum('nij,nj->ni', Tinv[candidates], p[rows]-verts[candidates,-1,:])
+        b = np.hstack((b, 1-b.sum(axis=1).reshape(-1,1)))
+        inside = (b>-1e-8).all(axis=1)
+        owner[start+rows[inside]] = candidates[inside]
+    
+    return owner, coplanar
+
+def _get_lower_equations(hull, upper_hull):
+    """ Facet equations of the lower hull simplices in the same order as simplices """
+    return hull.equations[~np.asarray(upper_hull, dtype=bool)]
+
 def point_at_inifinity_convexhull(points):
     inf_ind = np.shape(points)[0]
     base_points = points[:,:-1].mean(axis=0)
@@ -139,7 +279,489 @@ def negative_znorm_convexhull(points):
     
     return lower_hull, hull, ~zlower
 
+class LowerHull:
+    """Compact representation of a lower convex hull
+    
+    Stores only the simplices of the lower hull and their facet equations, 
+    mimicking the attributes of `scipy.spatial.ConvexHull` used in the package.
+    
+    Attributes:
+    -----------
+        simplices   :  vertex indices of the lower hull facets (array of shape (n_simplices, dim))
+        equations   :  facet equations [normal, offset] as in ConvexHull (array of shape (n_simplices, dim+1))
+        normals     :  unit normals of the facets (array of shape (n_simplices, dim))
+    """
+    def __init__(self, simplices, equations):
+        self.simplices = np.asarray(simplices, dtype=int)
+        self.equations = np.asarray(equations, dtype=float)
+        
+    @property
+    def normals(self):
+        return self.equations[:,:-1]
+    
+    @classmethod
+    def from_convexhull(cls, hull, upper_hull):
+        """ Keep only the lower hull facets of a `scipy.spatial.ConvexHull` given its upper hull flags """
+        lower = ~np.asarray(upper_hull, dtype=bool)
+        
+        return cls(hull.simplices[lower], hull.equations[lower])
+
+def get_subsimplex_cells(grid, divisions):
+    """
+    Index of the composition sub-simplex each point belongs to.
+    
+    The simplex is divided into `divisions` parts along each composition, a point x 
+    is assigned to the cell floor(divisions*x). For a ternary system this is the
+    usual subdivision into divisions^2 sub-triangles.
+    """
+    return np.clip(np.floor(divisions*grid.T).astype(int), 0, divisions-1)
+
+def local_lower_hull(points, ids):
+    """ Lower convex hull of a subset `ids` of points, returns simplices in global indices and their equations """
+    dim = points.shape[1]
+    if len(ids)<=dim:
+        return np.zeros((0,dim), dtype=int), np.zeros((0,dim+1))
+    try:
+        hull = ConvexHull(points[ids,:])
+    except Exception:
+        # patch is flat or does not have enough points
+        return np.zeros((0,dim), dtype=int), np.zeros((0,dim+1))
+    # facets facing downwards in the energy, vertical facets do not have a well-defined height
+    lower = hull.equations[:,-2]<-1e-10
+    
+    return ids[hull.simplices[lower]], hull.equations[lower]
+
+def _simplex_volumes(grid, simplices):
+    """ Projected volume of simplices in the first dim-1 compositions """
+    verts = np.transpose(grid[:-1,:][:,simplices], (1,2,0))
+    T = verts[:,:-1,:]-verts[:,-1:,:]
+    
+    return np.abs(np.linalg.det(T))/factorial(T.shape[1])
+
+def _nondegenerate(grid, simplices, rtol=1e-10):
+    """ Mask of the simplices whose projected volume is not zero (relative to the largest one) """
+    volumes = _simplex_volumes(grid, simplices)
+    
+    return volumes>rtol*np.max(volumes, initial=0)
+
+def _get_row_keys(rows):
+    """ Integer key of each row of non-negative integers, equal rows get equal keys """
+    base = int(np.max(rows, initial=0))+1
+    if base**rows.shape[1]>=2**63:
+        return np.unique(rows, axis=0, return_inverse=True)[1].reshape(-1)
+    keys = np.zeros(len(rows), dtype=np.int64)
+    for j in range(rows.shape[1]):
+        keys = base*keys + rows[:,j]
+        
+    return keys
+
+def get_ridges(simplices):
+    """
+    Ridges (facets of the simplices) of a set of simplices
+    
+    returns ridges shared by two simplices as pairs of simplex indices and the vertex opposite to the 
+    ridge in each of them (arrays of shape (n_shared, 2)), along with the ridges that belong to a 
+    single simplex (array of shape (n_boundary, dim-1)) and whether any ridge is shared by more than two 
+    """
+    dim = simplices.shape[1]
+    ridges = np.sort(np.vstack([np.delete(simplices, i, axis=1) for i in range(dim)]), axis=1)
+    facets = np.tile(np.arange(len(simplices)), dim)
+    opposite = np.hstack([simplices[:,i] for i in range(dim)])
+    _, ridge_ids, counts = np.unique(_get_row_keys(ridges), return_inverse=True, return_counts=True)
+    ridge_ids = ridge_ids.reshape(-1)
+    shared = np.where(counts[ridge_ids]==2)[0]
+    shared = shared[np.argsort(ridge_ids[shared], kind='stable')].reshape(-1,2)
+    boundary = ridges[counts[ridge_ids]==1]
+    
+    return facets[shared], opposite[shared], boundary, (counts>2).any()
+
+def _ridge_violations(points, equations, pairs, opposite, tol):
+    """ Whether the vertex opposite to a shared ridge lies below the plane of the other simplex """
+    f, g = pairs[:,0], pairs[:,1]
+    v_f, v_g = points[opposite[:,0]], points[opposite[:,1]]
+    # equations have a negative height component for lower facets, points above give negative values
+    res_f = np.einsum('ij,ij->i', equations[f,:-1], v_g) + equations[f,-1]
+    res_g = np.einsum('ij,ij->i', equations[g,:-1], v_f) + equations[g,-1]
+    
+    return np.logical_or(res_f>tol, res_g>tol)
+
+def _is_locally_convex(points, simplices, equations, tol):
+    """
+    Whether a set of lower hull facets is a locally convex surface
+    
+    Every ridge needs to be shared by at most two facets and the vertex opposite to a shared 
+    ridge in one facet needs to lie on or above the plane of the other facet.
+    """
+    pairs, opposite, _, is_nonmanifold = get_ridges(simplices)
+    if is_nonmanifold:
+        return False
+    
+    return ~_ridge_violations(points, equations, pairs, opposite, tol).any()
+
+def _get_domain(grid):
+    """ Volume of the composition space and the equations of its (distinct) facets """
+    domain = ConvexHull(grid[:-1,:].T)
+    
+    return domain.volume, np.unique(np.round(domain.equations, 10), axis=0)
+
+def _on_domain_boundary(grid, domain_equations, ridges):
+    """ Whether each ridge (array of shape (n_ridges, dim-1)) lies on a facet of the composition space """
+    verts = np.transpose(grid[:-1,:][:,ridges], (1,2,0))
+    on_facet = np.abs(verts@domain_equations[:,:-1].T + domain_equations[:,-1])<1e-10
+    
+    return on_facet.all(axis=1).any(axis=1)
+
+def _get_ridge_defects(grid, simplices, domain_equations):
+    """ Mask of the simplices with a ridge shared by more than two simplices or a ridge of a single 
+    simplex that does not lie on the boundary of the composition space """
+    dim = simplices.shape[1]
+    ridges = np.sort(np.vstack([np.delete(simplices, i, axis=1) for i in range(dim)]), axis=1)
+    _, ridge_ids, counts = np.unique(_get_row_keys(ridges), return_inverse=True, return_counts=True)
+    counts = counts[ridge_ids.reshape(-1)]
+    defective = counts>2
+    single = np.where(counts==1)[0]
+    defective[single] = ~_on_domain_boundary(grid, domain_equations, ridges[single])
+    
+    return defective.reshape(dim, -1).any(axis=0)
+
+def _get_containing_simplices(grid, simplices, lift_grid):
+    """ 
+    Pairs of indices of points in lift_grid and of the simplices containing them (barycentric coordinates) 
+    
+    Simplices are binned into a uniform grid of buckets overlapping their bounding boxes and each point is 
+    only checked against the simplices in its bucket.
+    """
+    verts = np.transpose(grid[:-1,:][:,simplices], (1,2,0))
+    points = lift_grid[:-1,:].T
+    if len(simplices)==0 or len(points)==0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    ndim = verts.shape[2]
+    lo, hi = verts.min(axis=1), verts.max(axis=1)
+    origin, width = lo.min(axis=0), np.maximum(hi.max(axis=0)-lo.min(axis=0), 1e-12)
+    num_buckets = max(1, int(np.ceil(len(simplices)**(1/ndim)/2)))
+    to_bucket = lambda x : np.clip(np.floor(num_buckets*(x-origin)/width).astype(int), 0, num_buckets-1)
+    lo, hi = to_bucket(lo-1e-8), to_bucket(hi+1e-8)
+    spans = hi-lo+1
+    counts = np.prod(spans, axis=1)
+    owner = np.repeat(np.arange(len(simplices)), counts)
+    k = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts)-counts, counts)
+    bucket = np.zeros(len(k), dtype=int)
+    for j in range(ndim):
+        bucket = num_buckets*bucket + lo[owner,j] + k%spans[owner,j]
+        k = k//spans[owner,j]
+    order = np.argsort(bucket, kind='stable')
+    bucket, owner = bucket[order], owner[order]
+    
+    point_bucket = np.ravel_multi_index(to_bucket(points).T, (num_buckets,)*ndim)
+    start, stop = np.searchsorted(bucket, point_bucket, 'left'), np.searchsorted(bucket, point_bucket, 'right')
+    rows = np.repeat(np.arange(len(points)), stop-start)
+    cols = owner[np.arange(len(rows)) - np.repeat(np.cumsum(stop-start)-(stop-start), stop-start) + start[rows]]
+    
+    T = np.transpose(verts[cols,:-1,:]-verts[cols,-1:,:], (0,2,1))
+    b = np.linalg.solve(T, (points[rows]-verts[cols,-1,:])[:,:,None])[:,:,0]
+    inside = np.logical_and((b>-1e-8).all(axis=1), b.sum(axis=1)<1+1e-8)
+    
+    return rows[inside], cols[inside]
+
+def get_plane_equations(points, simplices):
+    """ Equations (as in ConvexHull) of the non-vertical planes passing through vertices of simplices 
+    
+    Simplices with a zero projected volume (vertical) do not have such a plane and get nan equations
+    """
+    verts = points[simplices]
+    A = np.concatenate((verts[:,:,:-1], np.ones(verts.shape[:2]+(1,))), axis=2)
+    grid = np.vstack((points[:,:-1].T, 1-points[:,:-1].sum(axis=1)))
+    valid = _nondegenerate(grid, simplices)
+    c = np.full((len(simplices), A.shape[2]), np.nan)
+    c[valid] = np.linalg.solve(A[valid], verts[valid][:,:,-1:])[:,:,0]
+    equations = np.hstack((c[:,:-1], -1*np.ones((len(c),1)), c[:,-1:]))
+    
+    return equations/norm(equations[:,:-1], axis=1).reshape(-1,1)
+
+def decomposed_lower_hull(points, grid, divisions=4, overlap=0.25, local_hulls=None, verbose=False):
+    """
+    Compute the lower convex hull by stitching local lower hulls of composition sub-simplices
+    
+    parameters:
+    -----------
+        points      :  points of the energy landscape (array of shape (n_points, dim))
+        grid        :  compositions of the points (array of shape (dim, n_points))
+        divisions   :  number of divisions of each composition used to form sub-simplices
+        overlap     :  overlap of neighbouring sub-simplices in the units of a sub-simplex width
+        local_hulls :  (callable) function that maps points and a list of point index arrays to a list of
+                       local hulls as returned by `local_lower_hull` (default, serial evaluation)
+    
+    Each sub-simplex (patch) is padded by `overlap` and its lower hull is computed. A local facet is kept 
+    if its centroid lies in the patch. Only the vertices of the local lower hulls (candidates) can be on the 
+    global lower hull, the other points lie above the facets of a patch. The kept facets are verified to be 
+    the global lower hull by checking that they form a closed surface over the composition space, that the 
+    surface is convex across each ridge and that the candidates lie above the facets they project into. 
+    Facets failing these checks are found at the seams of the patches where the local hulls disagree, they 
+    are replaced by the lower hull of the candidates around them (see `continue_lower_hull`). If the repair 
+    fails (e.g. a three phase facet spanning several patches), the global lower hull is recomputed using only 
+    the candidates.
+    
+    Energies are perturbed by a tiny amount (fixed per point) so that coplanar points are triangulated 
+    the same way in all the patches they belong to.
+    
+    returns simplices, `LowerHull` instance and a boolean flag whether the stitching was successful
+    """
+    scale = max(1.0, np.max(np.abs(points[:,-1])))
+    rng = np.random.default_rng(0)
+    points = points.copy()
+    points[:,-1] += 1e-9*scale*rng.random(len(points))
+    if local_hulls is None:
+        local_hulls = lambda patches: [local_lower_hull(points, ids) for ids in patches]
+    else:
+        patch_hulls = local_hulls
+        local_hulls = lambda patches: patch_hulls(points, patches)
+        
+    dim = points.shape[1]
+    # every cell of the subdivision that intersects the simplex gets a patch
+    unique_cells = np.asarray(list(product(range(divisions), repeat=dim)))
+    unique_cells = unique_cells[np.logical_and(unique_cells.sum(axis=1)>divisions-dim, 
+                                               unique_cells.sum(axis=1)<=divisions)]
+    scaled = divisions*grid.T
+    patches = []
+    for c in unique_cells:
+        inpatch = np.logical_and(scaled>=c-overlap, scaled<=c+1+overlap).all(axis=1)
+        patches.append(np.where(inpatch)[0])
+        
+    hulls = local_hulls(patches)
+    
+    kept_simplices, kept_equations = [np.zeros((0,dim), dtype=int)], [np.zeros((0,dim+1))]
+    for c, (simplices, equations) in zip(unique_cells, hulls):
+        if len(simplices)==0:
+            continue
+        # keep facets owned by this patch
+        centroids = grid[:,simplices].mean(axis=2)
+        owned = (get_subsimplex_cells(centroids, divisions)==c).all(axis=1)
+        kept_simplices.append(simplices[owned])
+        kept_equations.append(equations[owned])
+    simplices, equations = np.vstack(kept_simplices), np.vstack(kept_equations)
+    
+    # only the vertices of the local lower hulls can be on the global one, other points of a patch lie 
+    # above its facets and facets of a patch do not extend beyond it
+    candidates = np.unique(np.hstack([h[0].reshape(-1) for h in hulls]))
+    total, domain_equations = _get_domain(grid)
+    tol = 1e-12*scale
+    defects = _get_ridge_defects(grid, simplices, domain_equations)
+    pairs, opposite, _, _ = get_ridges(simplices)
+    defects[pairs[_ridge_violations(points, equations, pairs, opposite, tol)].reshape(-1)] = True
+    # candidates that are not vertices of the kept facets need to lie above the facets they project into
+    extra = np.setdiff1d(candidates, simplices)
+    rows, cols = _get_containing_simplices(grid, simplices, grid[:,extra])
+    residuals = np.einsum('ij,ij->i', equations[cols,:-1], points[extra[rows]]) + equations[cols,-1]
+    defects[cols[residuals>tol]] = True
+    covered = np.sum(_simplex_volumes(grid, simplices))
+    is_stitched = np.isclose(covered, total, rtol=1e-6) and not defects.any()
+    if verbose:
+        print('Stitched facets cover {:.2f}% of the composition space'.format(100*covered/total))
+    
+    if not is_stitched and defects.any():
+        # seams where the patches disagree are replaced by the lower hull of the candidates around them
+        if verbose:
+            print('Repairing {}/{} facets at the seams of the patches'.format(np.sum(defects), len(simplices)))
+        # candidates in the region or not in any facet (gaps between the patches)
+        located = np.zeros(len(extra), dtype=bool)
+        located[rows] = True
+        get_inner = lambda region : np.union1d(extra[~located], extra[rows[region[cols]]])
+        # the repair is cheaper than recomputing from the candidates unless most of the facets are replaced
+        out = _repair_lower_hull(points, grid, simplices, equations, defects, pairs, get_inner, tol, 
+                                 max_region=0.5, verbose=verbose)
+        if out is not None:
+            simplices, equations = out[:2]
+            is_stitched = True
+            
+    if not is_stitched:
+        simplices, equations = local_lower_hull(points, candidates)
+        if verbose:
+            print('Recomputed the lower hull using {}/{} candidate points'.format(len(candidates),len(points)))
+            
+    return simplices, LowerHull(simplices, equations), is_stitched
+
+def _repair_lower_hull(points, grid, simplices, equations, region, pairs, get_inner, tol, 
+                       max_growth=3, max_region=0.25, verbose=False):
+    """
+    Replace a region of a lower hull triangulation by the lower hull of the points in it
+    
+    parameters:
+    -----------
+        points          :  points of the energy landscape (array of shape (n_points, dim))
+        grid            :  compositions of the points (array of shape (dim, n_points))
+        simplices       :  simplices of the triangulation and their plane `equations`
+        region          :  boolean mask of the simplices to replace
+        pairs           :  pairs of simplices sharing a ridge (see `get_ridges`)
+        get_inner       :  (callable) maps a region mask to the indices of the points in the region 
+                           other than the vertices of its simplices
+        tol             :  tolerance of the local convexity
+        max_growth      :  number of times the region is grown by its neighbours
+        max_region      :  fraction of the simplices above which the region is not repaired
+        
+    The local lower hull of the region and a ring of the simplices sharing a vertex with it reproduces 
+    the ring, unless the ring has changed as well or its simplices are coplanar with other points and 
+    triangulated differently, such ring simplices are absorbed into the region until it does. The 
+    result needs to cover the composition space, only its ridges on the boundary of the composition 
+    space may belong to a single simplex and it needs to be locally convex.
+    
+    returns simplices, equations, the replaced region, the inner points and the index of the new simplex 
+    of each inner point (among the new simplices) or None if the region could not be repaired
+    """
+    total, domain_equations = _get_domain(grid)
+    region = region.copy()
+    for growth in range(max_growth):
+        # add neighbours of the current region
+        touching = np.logical_or(region[pairs[:,0]], region[pairs[:,1]])
+        region[pairs[touching].reshape(-1)] = True
+        while True:
+            if np.mean(region)>max_region:
+                if verbose:
+                    print('Region of {}/{} simplices is too large to repair'.format(np.sum(region), len(simplices)))
+                return None
+            region_vertices = np.unique(simplices[region])
+            ring = np.where(~region & np.isin(simplices, region_vertices).any(axis=1))[0]
+            inner = get_inner(region)
+            ids = np.unique(np.hstack((inner, region_vertices, simplices[ring].reshape(-1))))
+            local_simplices, local_equations = local_lower_hull(points, ids)
+            keep = _nondegenerate(grid, local_simplices)
+            local_simplices, local_equations = local_simplices[keep], local_equations[keep]
+            local_keys = set(map(tuple, np.sort(local_simplices, axis=1)))
+            ring_keys = list(map(tuple, np.sort(simplices[ring], axis=1)))
+            reproduced = np.asarray([key in local_keys for key in ring_keys], dtype=bool)
+            if reproduced.all():
+                break
+            region[ring[~reproduced]] = True
+        ring_keys = set(ring_keys)
+        # simplices of the local hull beyond the ring have a vertex of the ring that is not in the region
+        within = np.isin(local_simplices, np.union1d(inner, simplices[region])).all(axis=1)
+        within[within] = [tuple(s) not in ring_keys for s in np.sort(local_simplices[within], axis=1)]
+        local_simplices, local_equations = local_simplices[within], local_equations[within]
+        
+        outside = np.where(~region)[0]
+        new_simplices = np.vstack((simplices[outside], local_simplices))
+        new_equations = np.vstack((equations[outside], local_equations))
+        # the repaired region covers the replaced simplices without opening new ridges or overlapping
+        new_pairs, new_opposite, new_boundary, is_nonmanifold = get_ridges(new_simplices)
+        if is_nonmanifold or not _on_domain_boundary(grid, domain_equations, new_boundary).all():
+            continue
+        if not np.isclose(np.sum(_simplex_volumes(grid, new_simplices)), total, rtol=1e-6):
+            continue
+        if _ridge_violations(points, new_equations, new_pairs, new_opposite, tol).any():
+            continue
+        local_point_simplex, _ = lift_label_planes(grid, grid[:,inner], local_simplices, local_equations)
+        if (local_point_simplex<0).any():
+            continue
+            
+        return new_simplices, new_equations, region, inner, local_point_simplex
+    
+    return None
+
+def continue_lower_hull(points, grid, simplices, point_simplex, max_growth=3, max_region=0.25, verbose=False):
+    """
+    Update a lower convex hull for a change in the energy of its points
+    
+    parameters:
+    -----------
+        points          :  new points of the energy landscape (array of shape (n_points, dim))
+        grid            :  compositions of the points (array of shape (dim, n_points))
+        simplices       :  non-vertical simplices of a previous lower hull that cover the composition space
+        point_simplex   :  index of the simplex each point lies in (array of shape (n_points, ))
+        max_growth      :  number of times a region around the non-convex simplices is grown to repair
+                           the hull before recomputing it entirely
+        max_region      :  fraction of the simplices above which the region to repair is not grown and 
+                           the hull is recomputed entirely (a local repair would not be cheaper)
+                           
+    The previous triangulation is the lower hull of the new points if it is locally convex across 
+    every ridge and each point lies above the simplex it is located in. Otherwise, the simplices that 
+    violate these conditions and their neighbours are replaced by the lower hull of points located in 
+    them and of the vertices of the simplices around them, provided the result is again a valid lower 
+    hull, i.e. it covers the composition space, only the ridges on its facets belong to a single 
+    simplex and it is locally convex.
+    
+    Simplices with a zero projected volume (vertical facets) are dropped, they do not change the lower 
+    hull and do not have a non-vertical plane.
+    
+    returns simplices, `LowerHull` instance, index of the simplex of each point and a dictonary with 
+    the number of repaired simplices and whether the lower hull was recomputed
+    """
+    tol = 1e-9*max(1.0, np.max(np.abs(points[:,-1])))
+    info = {'repaired' : 0, 'recomputed' : False}
+    total = ConvexHull(grid[:-1,:].T).volume
+    
+    def recompute():
+        info['recomputed'] = True
+        new_simplices, equations = local_lower_hull(points, np.arange(len(points)))
+        keep = _nondegenerate(grid, new_simplices)
+        new_simplices, equations = new_simplices[keep], equations[keep]
+        new_point_simplex, _ = lift_label_planes(grid, grid, new_simplices, equations)
+        if verbose:
+            print('Lower hull is recomputed')
+        
+        return new_simplices, LowerHull(new_simplices, equations), new_point_simplex, info
+    
+    if not np.isclose(np.sum(_simplex_volumes(grid, simplices)), total, rtol=1e-6):
+        return recompute()
+    keep = _nondegenerate(grid, simplices)
+    if not keep.all():
+        new_index = -1*np.ones(len(simplices), dtype=int)
+        new_index[keep] = np.arange(np.sum(keep))
+        simplices = simplices[keep]
+        point_simplex = np.where(point_simplex>=0, new_index[point_simplex], -1)
+        
+    equations = get_plane_equations(points, simplices)
+    pairs, opposite, _, _ = get_ridges(simplices)
+    bad = pairs[_ridge_violations(points, equations, pairs, opposite, tol)].reshape(-1)
+    located = point_simplex>=0
+    residuals = np.einsum('ij,ij->i', equations[point_simplex[located],:-1], points[located]) 
+    residuals += equations[point_simplex[located],-1]
+    bad = np.unique(np.hstack((bad, point_simplex[located][residuals>tol])))
+    if len(bad)==0:
+        return simplices, LowerHull(simplices, equations), point_simplex, info
+    
+    if verbose:
+        print('{}/{} simplices are not convex anymore'.format(len(bad), len(simplices)))
+    region = np.zeros(len(simplices), dtype=bool)
+    region[bad] = True
+    out = _repair_lower_hull(points, grid, simplices, equations, region, pairs, 
+                             lambda region : np.where(np.isin(point_simplex, np.where(region)[0]))[0], 
+                             tol, max_growth=max_growth, max_region=max_region, verbose=verbose)
+    if out is None:
+        return recompute()
+    new_simplices, new_equations, region, inner, local_point_simplex = out
+    
+    # re-index the simplices of points
+    new_index = -1*np.ones(len(simplices), dtype=int)
+    new_index[~region] = np.arange(np.sum(~region))
+    new_point_simplex = np.where(located, new_index[point_simplex], -1)
+    new_point_simplex[inner] = np.sum(~region) + local_point_simplex
+    info['repaired'] = int(np.sum(region))
+    if verbose:
+        print('Repaired {} simplices with {} new simplices'.format(np.sum(region), len(new_simplices)-np.sum(~region)))
+        
+    return new_simplices, LowerHull(new_simplices, new_equations), new_point_simplex, info
+
 """ Main comoutation function """
+def _labels_dataframe(lift_grid, owner, num_comps):
+    """ pandas.DataFrame of compositions and labels of the points given the simplex each point lies in (-1 if none) """
+    import pandas as pd
+    
+    phase = np.zeros(lift_grid.shape[1])
+    phase[owner>=0] = np.asarray(num_comps)[owner[owner>=0]]
+    output = np.vstack((lift_grid,phase.reshape(1,-1)))
+    index = ['Phi_'+str(i) for i in range(1, output.shape[0])]
+    index.append('label')
+    
+    return pd.DataFrame(data = output,index=index)
+
+def _lift_to_samples(grid, simplices, num_comps, hull, upper_hull):
+    """ Lift labels of the simplices onto the sampled points themselves using the planes of the lower hull
+    
+    returns simplex of each point (-1 if none), coplanar flags of the simplices and the labels dataframe
+    """
+    owner, coplanar = lift_label_planes(grid, grid, simplices, _get_lower_equations(hull, upper_hull))
+    
+    return owner, coplanar, _labels_dataframe(grid, owner, num_comps)
+
 def _serialcompute(f, dimension, meshsize,**kwargs):
     """
     Main python function to obtain a phase diagram for n-component polymer mixture system.   
@@ -148,20 +770,27 @@ def _serialcompute(f, dimension, meshsize,**kwargs):
     lower_hull_method = kwargs.get('lower_hull_method', None)
     flag_lift_label = kwargs.get('flag_lift_label',False)
     lift_grid_size = kwargs.get('lift_grid_size', meshsize)    
+    sampling = kwargs.get('sampling', None)
+    hull_decomposition = kwargs.get('hull_decomposition', None)
     since = time.time()
   
     outdict = defaultdict(list)
     
+    if (sampling is not None or hull_decomposition is not None) and lower_hull_method is None:
+        # sampled points do not lie on the boundary, so the upper hull cannot be refined using them
+        # local hulls of the sub-simplices are computed directly as lower hulls
+        lower_hull_method = 'point_at_infinity'
+    
     """ Perform a parallel computation of phase diagram """
     # 1. generate grid
-    grid = makegridnd(meshsize, dimension)
+    grid, spacing = _makegrid(meshsize, dimension, **kwargs)
     outdict['grid'] = grid
     
     lap = time.time()
     if verbose:
         print('{}-dimensional grid generated at {:.2f}s'.format(dimension,lap-since))
 
-    energy = np.asarray([f(x) for x in grid.T])
+    energy = batch_energy(f, grid.T)
 
     lap = time.time()
     if verbose:
@@ -184,7 +813,13 @@ def _serialcompute(f, dimension, meshsize,**kwargs):
         print('Energy is corrected at {:.2f}s'.format(lap-since))
     points = np.concatenate((grid[:-1,:].T,energy.reshape(-1,1)),axis=1) 
     
-    if lower_hull_method is None:    
+    if hull_decomposition is not None:
+        simplices, hull, is_stitched = decomposed_lower_hull(points, grid, divisions=hull_decomposition,
+                                                             overlap=kwargs.get('hull_overlap', 0.25),
+                                                             verbose=verbose)
+        upper_hull = np.zeros(len(simplices), dtype=bool)
+        outdict['is_stitched'] = is_stitched
+    elif lower_hull_method is None:    
         hull = ConvexHull(points)
         upper_hull = np.asarray([is_upper_hull(grid,simplex) for simplex in hull.simplices])
         simplices = hull.simplices[~upper_hull]
@@ -192,6 +827,10 @@ def _serialcompute(f, dimension, meshsize,**kwargs):
         simplices, hull,upper_hull = point_at_inifinity_convexhull(points)
     elif lower_hull_method=='negative_znorm':
         simplices, hull,upper_hull = negative_znorm_convexhull(points)
+        
+    if kwargs.get('slim_hull', False) and not isinstance(hull, LowerHull):
+        hull = LowerHull.from_convexhull(hull, upper_hull)
+        upper_hull = np.zeros(len(simplices), dtype=bool)
             
     outdict['upper_hull']=upper_hull
     outdict['hull'] = hull
@@ -205,7 +844,7 @@ def _serialcompute(f, dimension, meshsize,**kwargs):
         print('Total of {} simplices in the convex hull'.format(len(simplices)))
 
     thresh_scale = kwargs.get('thresh_scale',1.25)
-    thresh = thresh_scale*euclidean(grid[:,0],grid[:,1])
+    thresh = thresh_scale*spacing
     
     if verbose:
         print('Using {:.2E} as a threshold for Laplacian of a simplex'.format(thresh)) 
@@ -213,14 +852,27 @@ def _serialcompute(f, dimension, meshsize,**kwargs):
     outdict['thresh'] = thresh
     
     # 4. for each simplex in the hull compute number of connected components (parallel)
-    num_comps = [label_simplex(grid, simplex, thresh) for simplex in simplices]
+    mst_weights = get_simplex_mst_weights(grid, simplices)
+    num_comps = label_simplices(mst_weights, thresh).tolist()
     lap = time.time()
     if verbose:
         print('Simplices are labelled at {:.2f}s'.format(lap-since))
     outdict['num_comps'] = num_comps
+    outdict['mst_weights'] = mst_weights
     outdict['coplanar'] = None
+    outdict['lifted_simplex'] = None
     
-    if flag_lift_label:
+    if flag_lift_label and sampling is not None:
+        owner, coplanar, output = _lift_to_samples(grid, simplices, num_comps, hull, upper_hull)
+        outdict['coplanar'] = coplanar
+        outdict['lifted_simplex'] = owner
+        lap = time.time()
+        if verbose:
+            print('Labels are lifted at {:.2f}s'.format(lap-since))
+
+            print('Total {}/{} coplanar simplices'.format(np.sum(coplanar),len(simplices)))
+        
+    elif flag_lift_label:
         if lift_grid_size == meshsize:
             lift_grid = grid
         else:
@@ -236,15 +888,12 @@ def _serialcompute(f, dimension, meshsize,**kwargs):
 
             print('Total {}/{} coplanar simplices'.format(np.sum(coplanar),len(simplices)))
 
-        phase = np.zeros(lift_grid.shape[1])
-        for i,label in zip(inside,num_comps):
+        owner = -1*np.ones(lift_grid.shape[1], dtype=int)
+        for simplex_id, i in enumerate(inside):
             if not i[1]:
-                phase[i[0]] = label
-        phase = phase.reshape(1,-1)
-        output = np.vstack((lift_grid,phase))
-        index = ['Phi_'+str(i) for i in range(1, output.shape[0])]
-        index.append('label')
-        output = pd.DataFrame(data = output,index=index)
+                owner[i[0]] = simplex_id
+        outdict['lifted_simplex'] = owner
+        output = _labels_dataframe(lift_grid, owner, num_comps)
                 
     else:
         output = []
@@ -257,14 +906,55 @@ def _serialcompute(f, dimension, meshsize,**kwargs):
     
     return outdict
 
-@ray.remote
+def _miscible_compute(f, dimension, meshsize, **kwargs):
+    """
+    Phase diagram of a system that is certified not to phase separate (see `polyphase.certify_miscibility`)
+    
+    Skips the convex hull and labels every point of the grid as single phase. Boundary points are labelled 0 
+    as in `_serialcompute` when their energy would be padded (i.e. the default lower hull method in serial).
+    Returns the same dictonary as `_serialcompute` with no simplices.
+    """
+    import pandas as pd
+    since = time.time()
+    outdict = defaultdict(list)
+    grid, spacing = _makegrid(meshsize, dimension, **kwargs)
+    outdict['grid'] = grid
+    outdict['energy'] = batch_energy(f, grid.T)
+    outdict['hull'] = None
+    outdict['upper_hull'] = np.zeros(0, dtype=bool)
+    outdict['simplices'] = np.zeros((0,dimension), dtype=int)
+    outdict['thresh'] = kwargs.get('thresh_scale',1.25)*spacing
+    outdict['num_comps'] = []
+    outdict['mst_weights'] = np.zeros((0,dimension-1))
+    outdict['coplanar'] = np.zeros(0, dtype=bool)
+    outdict['lifted_simplex'] = None
+    
+    if kwargs.get('flag_lift_label',False):
+        phase = np.ones(grid.shape[1])
+        padded = all(kwargs.get(key, None) is None for key in ['lower_hull_method', 'sampling', 'hull_decomposition'])
+        if padded and not kwargs.get('use_parallel', False):
+            # boundary points lie on the upper hull after padding their energy thus are not labelled
+            phase[[is_boundary_point(x) for x in grid.T]] = 0
+        output = np.vstack((grid, phase.reshape(1,-1)))
+        index = ['Phi_'+str(i) for i in range(1, output.shape[0])]
+        index.append('label')
+        outdict['output'] = pd.DataFrame(data = output,index=index)
+    else:
+        outdict['output'] = []
+        
+    if kwargs.get('verbose', False):
+        print('System is certified to be miscible, computation took {:.2f}s'.format(time.time()-since))
+    
+    return outdict
+
+@lazy_remote
 def ray_is_boundary_point(point, zero_value = MIN_POINT_PRECISION):
     if np.isclose(point, MIN_POINT_PRECISION).any():
         return True
     else:
         return False
 
-@ray.remote
+@lazy_remote
 def ray_is_pure_component(point, zero_value = MIN_POINT_PRECISION):
     counts = Counter(point)
     if counts[MIN_POINT_PRECISION]>1:
@@ -272,19 +962,7 @@ def ray_is_pure_component(point, zero_value = MIN_POINT_PRECISION):
     else:
         return False
 
-@ray.remote
-def ray_label_simplex(grid, simplex, thresh):
-    """ given a simplex, labels it to be a n-phase region by computing number of connected components """
-    coords = [grid[:,x] for x in simplex]
-    dist = squareform(pdist(coords,'euclidean'))
-    adjacency = dist<thresh
-    adjacency =  adjacency.astype(int)  
-    graph = csr_matrix(adjacency)
-    n_components, labels = connected_components(csgraph=graph, directed=False, return_labels=True)
-
-    return n_components
-
-@ray.remote
+@lazy_remote
 def ray_is_upper_hull(grid, simplex):
     """ 
     return True if a simplex connects anything on the edge.
@@ -298,7 +976,12 @@ def ray_is_upper_hull(grid, simplex):
     else:
         return False
 
-@ray.remote    
+@lazy_remote
+def ray_local_lower_hull(points, ids):
+    """ Lower convex hull of a subset `ids` of points """
+    return local_lower_hull(points, ids)
+
+@lazy_remote
 def ray_lift_label(grid,lift_grid, simplex, label):
     """ Lifting the labels from simplices to points """
     try:
@@ -318,10 +1001,13 @@ def _parcompute(f, dimension, meshsize,**kwargs):
     """Compute phase diagram using parallel computaion
     parallel version of serialcompute
     """
+    import ray
     verbose = kwargs.get('verbose', False)
     flag_lift_label = kwargs.get('flag_lift_label',False)
     use_weighted_delaunay = kwargs.get('use_weighted_delaunay', False)
     lift_grid_size = kwargs.get('lift_grid_size', 200)
+    sampling = kwargs.get('sampling', None)
+    hull_decomposition = kwargs.get('hull_decomposition', None)
         
     # Initialize ray for parallel computation
     ray.init(ignore_reinit_error=True)
@@ -333,14 +1019,14 @@ def _parcompute(f, dimension, meshsize,**kwargs):
     
     """ Perform a parallel computation of phase diagram """
     # 1. generate grid
-    grid = makegridnd(meshsize, dimension)
+    grid, spacing = _makegrid(meshsize, dimension, **kwargs)
     outdict['grid'] = grid
     grid_ray = ray.put(grid)
     lap = time.time()
     if verbose:
         print('{}-dimensional grid generated at {:.2f}s'.format(dimension,lap-since))
        
-    energy = np.asarray([f(x) for x in grid.T])   
+    energy = batch_energy(f, grid.T)   
     
     lap = time.time()
     if verbose:
@@ -354,7 +1040,20 @@ def _parcompute(f, dimension, meshsize,**kwargs):
     
     # 3. Compute convex hull
     points = np.concatenate((grid[:-1,:].T,energy.reshape(-1,1)),axis=1) 
-    simplices, hull,upper_hull = point_at_inifinity_convexhull(points)
+    if hull_decomposition is not None:
+        def local_hulls(points, patches):
+            points_ray = ray.put(points)
+            return ray.get([ray_local_lower_hull.remote(points_ray, ids) for ids in patches])
+        simplices, hull, is_stitched = decomposed_lower_hull(points, grid, divisions=hull_decomposition,
+                                                             overlap=kwargs.get('hull_overlap', 0.25),
+                                                             local_hulls=local_hulls, verbose=verbose)
+        upper_hull = np.zeros(len(simplices), dtype=bool)
+        outdict['is_stitched'] = is_stitched
+    else:
+        simplices, hull,upper_hull = point_at_inifinity_convexhull(points)
+    if kwargs.get('slim_hull', False) and not isinstance(hull, LowerHull):
+        hull = LowerHull.from_convexhull(hull, upper_hull)
+        upper_hull = np.zeros(len(simplices), dtype=bool)
     outdict['upper_hull']=upper_hull
     outdict['hull'] = hull    
     outdict['simplices'] = simplices
@@ -372,7 +1071,7 @@ def _parcompute(f, dimension, meshsize,**kwargs):
 
 
     thresh_scale = kwargs.get('thresh_scale',1.25)
-    thresh = thresh_scale*euclidean(grid[:,0],grid[:,1])
+    thresh = thresh_scale*spacing
     
     if verbose:
         print('Using {:.2E} as a threshold for Laplacian of a simplex'.format(thresh)) 
@@ -383,17 +1082,27 @@ def _parcompute(f, dimension, meshsize,**kwargs):
     if verbose:
         print('Simplices are refined at {:.2f}s'.format(lap-since))
     # 4. for each simplex in the hull compute number of connected components (parallel)
-    num_comps_ray = [ray_label_simplex.remote(grid_ray, simplex, thresh) for simplex in simplices]
-    num_comps = ray.get(num_comps_ray) 
+    mst_weights = get_simplex_mst_weights(grid, simplices)
+    num_comps = label_simplices(mst_weights, thresh).tolist()
     lap = time.time()
     if verbose:
         print('Simplices are labelled at {:.2f}s'.format(lap-since))
         
     outdict['num_comps'] = num_comps
-    
-    del num_comps_ray
+    outdict['mst_weights'] = mst_weights
     outdict['coplanar'] = None
-    if flag_lift_label:
+    outdict['lifted_simplex'] = None
+    if flag_lift_label and sampling is not None:
+        owner, coplanar, output = _lift_to_samples(grid, simplices, num_comps, hull, upper_hull)
+        outdict['coplanar'] = coplanar
+        outdict['lifted_simplex'] = owner
+        lap = time.time()
+        if verbose:
+            print('Labels are lifted at {:.2f}s'.format(lap-since))
+
+            print('Total {}/{} coplanar simplices'.format(np.sum(coplanar),len(simplices)))
+        
+    elif flag_lift_label:
         
         # 5. lift the labels from simplices to points (parallel)
         if lift_grid_size == meshsize:
@@ -416,15 +1125,12 @@ def _parcompute(f, dimension, meshsize,**kwargs):
 
             print('Total {}/{} coplanar simplices'.format(Counter(coplanar)[0],len(simplices)))
 
-        phase = np.zeros(lift_grid.shape[1])
-        for i,label in zip(inside,num_comps):
+        owner = -1*np.ones(lift_grid.shape[1], dtype=int)
+        for simplex_id, i in enumerate(inside):
             if i[1]==1:
-                phase[i[0]] = label
-        phase = phase.reshape(1,-1)
-        output = np.vstack((lift_grid,phase))
-        index = ['Phi_'+str(i) for i in range(1, output.shape[0])]
-        index.append('label')
-        output = pd.DataFrame(data = output,index=index)
+                owner[i[0]] = simplex_id
+        outdict['lifted_simplex'] = owner
+        output = _labels_dataframe(lift_grid, owner, num_comps)
         
         del lift_grid_ray, inside_ray, inside
         
@@ -1,17 +1,16 @@
 import pdb
 import numpy as np
 import time
-import pandas as pd
-import ray
 from ._phase import (_serialcompute,
-                     _parcompute, 
+                     _parcompute, _miscible_compute,
                      makegridnd,
                      is_boundary_point, is_pure_component,
-                    get_max_delaunay_edge_length)
+                    get_max_delaunay_edge_length,
+                    continue_lower_hull, lift_label_planes,
+                    get_plane_equations, _nondegenerate,
+                    get_simplex_mst_weights, label_simplices)
 from scipy.spatial import Delaunay
-from .visuals import TernaryPlot, QuaternaryPlot
-from .tests import TestAngles, TestEpiGraph, TestPhaseSplits, CentralDifference
-import matplotlib.pyplot as plt
+from .utils import FloryHuggins, batch_energy
 import re
 
 FLAT_SIMPLEX_ERROR = 'Initial simplex is flat' 
@@ -35,6 +34,9 @@ class PHASE:
             as_dict      :  Return the attributes of the class as a dictonary
             get_kwargs   :  Return settings of the compute method as kwargs for the private functions in _phase.py
             compute      :  Compute a phase diagram
+            continue_to  :  Update a computed phase diagram to a new energy function reusing its lower convex hull
+            get_num_comps:  Number of connected components of each simplex for one or more threshold scales
+            relabel      :  Label the phase diagram for a new threshold scale without computing the hull
             __call__     :  Once the phase diagram is solved using .compute(), returns the phase splitting 
                             ratios given a composition array
             plot         :  Visualize the phase diagram of 3 and 4 components
@@ -45,12 +47,23 @@ class PHASE:
             grid         :  Grid used to compute the energy surface (array of shape (dim, points))
             energy       :  Free energy computed using self.energy_func (array of shape (points,))
             hull         :  scipy.spatial.ConvexHull instance of computed for energy landscape
+                            (a `LowerHull` with only the lower hull facets when `slim_hull` or `hull_decomposition` is used)
             thresh       :  length scale used to compute adjacency matrix
             upper_hull   :  boolean flagg of each simplex in hull.simplices whether its a upper hull
             simplices    :  simplices of the lower convex hull of the energy landscape
             num_comps    :  connected components of each simplex as a list
             df           :  pandas.DataFrame with volume fractions and labels rows
             coplanar     :  a list of boolean values one for each simplex (True- coplanar, False- not, None- Not computed)
+            point_simplex:  index of the simplex each grid point lies in, -1 if none 
+                            (array of shape (points,), available after `continue_to`)
+            mst_weights  :  sorted edge lengths of the minimum spanning tree of each simplex 
+                            (array of shape (num_simplices, dim-1)) used to label simplices
+            lifted_simplex: index of the simplex whose label is lifted to each point in df, -1 if none
+                            (None when labels are not lifted)
+            is_miscible  :  whether the system is certified to not phase separate when computed with 
+                            `prescreen` (None if not prescreened)
+            is_stitched  :  whether the local lower hulls were stitched into the global one when computed with
+                            `hull_decomposition` (False if it was recomputed from their vertices, None if not used)
         """
         if not callable(energy_func):
             raise ValueError('Vairable energy needs to be a function such as `polyphase.utils.flory_huggins`')
@@ -126,13 +139,47 @@ class PHASE:
                                           normal in the height direction is positive.   
                                               
             thresh_scale        : (float) scaling to be used for the edge length of the reference 
-                                         in thresholding
+                                         in thresholding (default, 0.1*meshsize or 3 when `sampling` is used)
+                                         
+            sampling            : (string or None) How to sample the compositions (default : None)
+                                       1. None -- Uses a uniform grid of `meshsize` points per dimension
+                                       2. 'sobol' or 'halton' -- Draws quasi-random points on the simplex
+                                          (useful for systems with 5 or more components)
+            
+            num_samples         : (int) Number of points to draw when `sampling` is requested 
+                                        (default, number of points in a grid of the same `meshsize`)
+                                        
+            sampling_seed       : (int) Seed of the scrambled quasi-random sequence (default, None)
+            
+            hull_decomposition  : (int or None) Number of divisions of each composition used to split the 
+                                        composition space into sub-simplices whose lower hulls are computed
+                                        separately (in parallel when `use_parallel` is True) and stitched 
+                                        together (default, None i.e. a single convex hull is computed)
+                                        
+            hull_overlap        : (float) Overlap between neighbouring sub-simplices in the units of their 
+                                         width, larger overlaps need less repair at the seams but cost more
+                                         (default, 0.25)
+                                         
+            slim_hull           : (bool) whether to keep only the lower hull simplices and their equations 
+                                        as a `LowerHull` instead of the `scipy.spatial.ConvexHull` (default, False)
+                                        
+            prescreen           : (bool) whether to first certify that the system is miscible using bounds of the
+                                        Hessian on a coarse lattice (see `polyphase.certify_miscibility`).
+                                        Certified systems skip the convex hull and are labelled single phase. 
+                                        Only used when `energy_func` is a `polyphase.FloryHuggins` (default, False)
+                                        
+            prescreen_meshsize  : (int) Number of points per dimension of the coarse lattice used in 
+                                        prescreening (default, 10)
         
         NOTES: 
         ------
         In parallel mode, energy correction is not used, the lower convex hull is computed using the point at 
         infinity method instead.
         
+        When `sampling` or `hull_decomposition` is used, the lower convex hull defaults to the point at infinity method. 
+        With `sampling`, labels are lifted to the sampled points themselves and the reference edge length for 
+        thresholding is the largest gap between the samples (see `polyphase._phase.get_sample_spacing`).
+        
         """
         
         self.use_parallel = kwargs.get('use_parallel', False)
@@ -140,10 +187,26 @@ class PHASE:
         self.pad_energy = kwargs.get('pad_energy', 2)
         self.lift_label = kwargs.get('lift_label',True)
         self.lower_hull_method = kwargs.get('lower_hull_method', None)
-        self.thresh_scale = kwargs.get('thresh_scale', 0.1*self.meshsize)
+        self.sampling = kwargs.get('sampling', None)
+        self.thresh_scale = kwargs.get('thresh_scale', 0.1*self.meshsize if self.sampling is None else 3.0)
+        self.num_samples = kwargs.get('num_samples', None)
+        self.sampling_seed = kwargs.get('sampling_seed', None)
+        self.hull_decomposition = kwargs.get('hull_decomposition', None)
+        self.hull_overlap = kwargs.get('hull_overlap', 0.25)
+        self.slim_hull = kwargs.get('slim_hull', False)
+        self.prescreen = kwargs.get('prescreen', False)
         _kwargs = self.get_kwargs()
         
-        if self.use_parallel:
+        self.is_miscible = None
+        if self.prescreen and isinstance(self.energy_func, FloryHuggins):
+            from .spinodal import certify_miscibility
+            self.is_miscible = certify_miscibility(self.energy_func, 
+                                                   meshsize=kwargs.get('prescreen_meshsize', 10))
+        
+        if self.is_miscible:
+            outdict = _miscible_compute(self.energy_func, self.dimension, self.meshsize, 
+                                        use_parallel=self.use_parallel, **_kwargs)
+        elif self.use_parallel:
             outdict = _parcompute(self.energy_func, self.dimension, self.meshsize,**_kwargs)
         else:
             outdict = _serialcompute(self.energy_func, self.dimension, self.meshsize,**_kwargs)
@@ -157,11 +220,133 @@ class PHASE:
         self.num_comps = outdict['num_comps'] 
         self.df = outdict['output']
         self.coplanar = np.asarray(outdict['coplanar'], dtype=bool)
+        self.point_simplex = None
+        self.mst_weights = outdict['mst_weights']
+        self.lifted_simplex = outdict['lifted_simplex']
+        self.is_stitched = outdict.get('is_stitched', None)
         
         self.is_solved = True
         
         return
 
+    def continue_to(self, energy_func, **kwargs):
+        """ Continue the phase diagram to a new energy function
+        
+        Useful to sweep a parameter (chi, temperature etc.) in small steps. The lower convex hull of the 
+        previous step is reused and only the simplices that are no longer convex are re-computed locally 
+        (see `polyphase._phase.continue_lower_hull`). Labels of the unchanged simplices and points are reused.
+        
+        Arguments:
+        ----------
+            energy_func : (callable) New energy function
+            max_growth  : (int) Number of attempts to repair the lower hull locally before computing it 
+                                entirely (default, 3)
+            verbose     : (bool) whether to print more information (default, self.verbose)
+            
+        returns the dictonary of the new phase diagram (see `as_dict`)
+        
+        Example:
+        --------
+            >>> engine = polyphase.PHASE(lambda x: polyphase.flory_huggins(x, M, [1.0,0.5,0.5]), 100, 3)
+            >>> engine.compute(lower_hull_method='point_at_infinity')
+            >>> family = [engine.continue_to(lambda x: polyphase.flory_huggins(x, M, [c,0.5,0.5]))
+            ...           for c in np.linspace(1.0, 1.5, 50)]
+        
+        NOTES: 
+        ------
+        The continuation maintains the lower convex hull without vertical simplices. If the phase diagram 
+        was computed with lower_hull_method=None, the first step computes it entirely.
+        """
+        if not self.is_solved:
+            raise RuntimeError('Phase diagram is not computed\n'
+                               'Use .compute() before continuing it')
+        if not callable(energy_func):
+            raise ValueError('Vairable energy needs to be a function such as `polyphase.utils.flory_huggins`')
+            
+        verbose = kwargs.get('verbose', self.verbose)
+        since = time.time()
+        points = lambda energy : np.concatenate((self.grid[:-1,:].T,energy.reshape(-1,1)),axis=1)
+        
+        if self.point_simplex is None:
+            # locate grid points in the current non-vertical simplices
+            simplices = self.simplices[_nondegenerate(self.grid, self.simplices)]
+            self.point_simplex, _ = lift_label_planes(self.grid, self.grid, simplices, 
+                                                      get_plane_equations(points(self.energy), simplices))
+        else:
+            simplices = self.simplices
+            
+        energy = batch_energy(energy_func, self.grid.T)
+        new_simplices, hull, point_simplex, info = continue_lower_hull(points(energy), self.grid, simplices, 
+                                                                       self.point_simplex, 
+                                                                       max_growth=kwargs.get('max_growth', 3),
+                                                                       verbose=verbose)
+        
+        if new_simplices is not simplices or len(simplices)!=len(self.simplices):
+            # label the new simplices and lift labels using the located points
+            self.mst_weights = get_simplex_mst_weights(self.grid, new_simplices)
+            num_comps = label_simplices(self.mst_weights, self.thresh).tolist()
+            if self.lift_label:
+                # points that are not located (e.g. vertices of vertical simplices) keep their labels
+                labels = np.array(self.df.loc['label',:], dtype=float)
+                labels[point_simplex>=0] = np.asarray(num_comps)[point_simplex[point_simplex>=0]]
+                self.df = self.df.copy()
+                self.df.loc['label',:] = labels
+                self.lifted_simplex = point_simplex
+            self.num_comps = num_comps
+            
+        self.energy_func = energy_func
+        self.energy = energy
+        self.hull = hull
+        self.simplices = new_simplices
+        self.upper_hull = np.zeros(len(new_simplices), dtype=bool)
+        self.coplanar = np.zeros(len(new_simplices), dtype=bool)
+        self.point_simplex = point_simplex
+        self.continuation_info = info
+        
+        if verbose:
+            print('Continuation took {:.2f}s'.format(time.time()-since))
+        
+        return self.as_dict()
+
+    def get_num_comps(self, thresh_scale):
+        """ Number of connected components of each simplex for given threshold scale(s)
+        
+        Uses the cached spanning tree edge lengths of the simplices (see `polyphase._phase.get_simplex_mst_weights`)
+        and thus does not compute the hull or the labels again.
+        
+        Arguments:
+        ----------
+            thresh_scale : (float or array) scaling of the reference edge length used in thresholding
+            
+        returns an integer array of shape (num_simplices,) or (len(thresh_scale), num_simplices)
+        """
+        if not self.is_solved:
+            raise RuntimeError('Phase diagram is not computed\n'
+                               'Use .compute() before labelling it')
+        spacing = self.thresh/self.thresh_scale
+        
+        return label_simplices(self.mst_weights, np.asarray(thresh_scale)*spacing)
+    
+    def relabel(self, thresh_scale):
+        """ Label the phase diagram for a new threshold scale
+        
+        Updates thresh_scale, thresh, num_comps and the labels in df without computing the hull.
+        
+        returns the dictonary of the relabelled phase diagram (see `as_dict`)
+        """
+        num_comps = self.get_num_comps(thresh_scale)
+        self.thresh = self.thresh/self.thresh_scale*thresh_scale
+        self.thresh_scale = thresh_scale
+        self.num_comps = num_comps.tolist()
+        if self.lifted_simplex is not None:
+            owner = self.lifted_simplex
+            labels = np.zeros(len(owner))
+            labels[owner>=0] = num_comps[owner[owner>=0]]
+            self.df = self.df.copy()
+            self.df.loc['label',:] = labels
+            
+        return self.as_dict()
+        
     def get_phase_compositions(self, point, simplex_id=None):
         """Compute phase contributions given a composition
         
@@ -201,7 +386,7 @@ class PHASE:
             if num_comps==1:
                 # no-phase splits if the simplex is labelled 1-phase
                 continue
-            A = np.vstack((vertices.T[:-1,:], energies, np.ones(self.dimension)))
+            A = np.vstack((vertices[:-1,:], energies, np.ones(self.dimension)))
             B = np.hstack((point[:-1],self.energy_func(point),1))
             lb = np.zeros(self.dimension)
             ub = np.ones(self.dimension)
@@ -248,7 +433,13 @@ class PHASE:
             'pad_energy': self.pad_energy,
             'thresh_scale':self.thresh_scale, 
             'lift_grid_size':self.meshsize,
-            'verbose' : self.verbose
+            'verbose' : self.verbose,
+            'sampling' : self.sampling,
+            'num_samples' : self.num_samples,
+            'sampling_seed' : self.sampling_seed,
+            'hull_decomposition' : self.hull_decomposition,
+            'hull_overlap' : self.hull_overlap,
+            'slim_hull' : self.slim_hull
          }
         
         return out
@@ -257,6 +448,8 @@ class PHASE:
         """A helper function for a quick visualization
         For more details on the plotting, look at `polyphase.visuals`
         """
+        import matplotlib.pyplot as plt
+        from .visuals import TernaryPlot, QuaternaryPlot
         
         if self.dimension==3:
             renderer = TernaryPlot(self)
@@ -269,8 +462,35 @@ class PHASE:
         if show:
             plt.show()
         
-    def test(self):
-        gradient = CentralDifference(self.energy_func) 
+    def test(self, mode='simplex', **kwargs):
+        """ Validate the phase diagram using the tests in `polyphase.tests`
+        
+        Arguments:
+        ----------
+            mode : (string) how to perform the tests
+                        1. 'simplex' -- perform `TestAngles` and `TestPhaseSplits` for each simplex and return 
+                                        a dictonary of simplex id : [dot products, centroid test] (default)
+                        2. 'batch' -- perform the tests on all simplices at once using `TestSimplices`, returns a 
+                                      pandas.DataFrame (kwargs are passed to `TestSimplices`)
+                        3. 'sample' -- estimate the area weighted pass rate of phase splits of random points in 
+                                       simplices drawn per phase label using `TestSampledSplits`, returns a dictonary 
+                                       (kwargs `threshold` and `seed` are passed to `TestSampledSplits`, 
+                                       the rest to its `run` method e.g. time_budget, target_halfwidth)
+        """
+        from .tests import TestAngles, TestPhaseSplits, CentralDifference, TestSimplices, TestSampledSplits
+        
+        if mode=='batch':
+            return TestSimplices(self, **kwargs).run()
+        elif mode=='sample':
+            sampler = TestSampledSplits(self, threshold=kwargs.pop('threshold', 0.05), seed=kwargs.pop('seed', None))
+            return sampler.run(**kwargs)
+        elif mode!='simplex':
+            raise KeyError('Test mode {} is not available, use simplex, batch or sample'.format(mode))
+        
+        if isinstance(self.energy_func, FloryHuggins):
+            gradient = self.energy_func.gradient
+        else:
+            gradient = CentralDifference(self.energy_func) 
         results = {}
         for simplex_id, phaseid in enumerate(self.num_comps):
             # 1. performing tangent normal test
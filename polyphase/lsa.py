@@ -1,9 +1,7 @@
-import autograd.numpy as anp
-from autograd import hessian
-import polyphase
-import matplotlib.pyplot as plt
-from numpy.linalg import eig
+import numpy as np
+from numpy.linalg import eigvalsh
 from math import pi
+from .utils import FloryHuggins, lazy_remote
 
 class LSA:
     """Linear Stability Analysis of Flory-Huggins free enrgy
@@ -16,8 +14,12 @@ class LSA:
     Methods:
     ========
         get_amplification_factor  :  Computes the amplication factor given a composition as a list
+        get_hessian_spectrum : Eigen values of the Hessian of free energy at a composition
+        get_eigen_spectrum : Eigen values of the amplification factor for an array of k values
         evaluate : Evaluates the LSA and stores eigen values
         is_stable : Returns a boolean value whether a given composition is stable under LSA
+        get_hessians : Hessians of free energy for an array of compositions
+        stability_map : Stability and the fastest growing mode for an array of compositions
         plot : Plots the eigen spectrum with in the wavelength values of [0,120]
         
     Attributes:
@@ -50,38 +52,50 @@ class LSA:
     def __init__(self, M,chi,f=None):
         self.M = M
         self.chi = chi
+        self.is_analytic = f is None
         if f is None:
-            f = lambda x: self._flory_huggins(x)
-        
-        self.H = hessian(f)
-        self.k = anp.linspace(0,120, num=50)
+            self.energy = FloryHuggins(M, chi)
+            self.H = lambda x: self.energy.hessian(x, reduced=False)
+        else:
+            from autograd import hessian
+            self.H = hessian(f)
+        self.k = np.linspace(0,120, num=50)
         self.eps = 1e-5
     
-    def _flory_huggins(self,x):
-        CHI = polyphase._utri2mat(self.chi, len(self.M))
-        T1 = 0
-        for xi, mi in zip(x,self.M):
-            T1 += (xi*anp.log(xi))/mi
-        T2 = 0.5*anp.matmul((anp.matmul(x,CHI)),anp.transpose(x)) 
-
-        return T1+T2 
-    
     def get_amplification_factor(self,x0,ki):
         hf = self.H(x0)
-        A = (-(ki*pi)**2)*(hf + (self.eps**2)*((ki*pi)**2)*anp.identity(len(x0)))
+        A = (-(ki*pi)**2)*(hf + (self.eps**2)*((ki*pi)**2)*np.identity(len(x0)))
         return A
     
+    def get_hessian_spectrum(self,x0):
+        """
+        x0 : composiiton as a list of length N
+        
+        returns eigen values of the (symmetric) Hessian in ascending order
+        """
+        return eigvalsh(self.H(np.asarray(x0, dtype=float)))
+    
+    def get_eigen_spectrum(self,x0,k=None):
+        """
+        x0 : composiiton as a list of length N
+        k  : wavelength values (default, self.k)
+        
+        Amplification factor A(k) = -(k*pi)^2 (H + eps^2 (k*pi)^2 I) shares the eigen vectors of H, 
+        thus its eigen values follow from a single eigen decomposition of the Hessian.
+        
+        returns eigen values as an array of shape (len(k), N)
+        """
+        if k is None:
+            k = self.k
+        kpi2 = ((np.asarray(k, dtype=float)*pi)**2).reshape(-1,1)
+        
+        return -kpi2*(self.get_hessian_spectrum(x0).reshape(1,-1) + (self.eps**2)*kpi2)
+    
     def evaluate(self,x0):
         """
         x0 : composiiton as a list of length N
         """
-        eigen_values = []
-        for ki in self.k:
-            A = self.get_amplification_factor(x0,ki)
-            w,v = eig(A)
-            eigen_values.append(w)
-
-        self.eigen_values = anp.asarray(eigen_values)
+        self.eigen_values = self.get_eigen_spectrum(x0)
         
     def is_stable(self,x0):
         """
@@ -90,7 +104,73 @@ class LSA:
         self.evaluate(x0)
         return ~(self.eigen_values[1:]>0).any()
     
+    def get_hessians(self, X):
+        """
+        X : compositions as an array of shape (n_points, N)
+        
+        Hessians are computed in closed form for the default Flory-Huggins free energy 
+        (see `polyphase.FloryHuggins`) and using autograd for a user provided `f`.
+        
+        returns Hessians as an array of shape (n_points, N, N)
+        """
+        X = np.asarray(X, dtype=float)
+        if self.is_analytic:
+            return self.energy.hessian(X, reduced=False)
+        else:
+            return np.asarray([self.H(x) for x in X])
+        
+    def _stability_chunk(self, X):
+        """ stability of a chunk of compositions (see `stability_map`) """
+        spectrum = eigvalsh(self.get_hessians(X))
+        kpi2 = ((np.asarray(self.k, dtype=float)*pi)**2).reshape(1,-1,1)
+        growth = -kpi2*(spectrum[:,np.newaxis,:] + (self.eps**2)*kpi2)
+        growth = growth.max(axis=2)
+        stable = ~(growth[:,1:]>0).any(axis=1)
+        fastest = np.argmax(growth, axis=1)
+        
+        return stable, self.k[fastest], growth[np.arange(len(X)), fastest], spectrum[:,0]
+    
+    def stability_map(self, points, use_parallel=False, chunksize=4096):
+        """
+        Linear stability of an array of compositions using batched Hessians
+        
+        Inputs:
+        =======
+            points       :  compositions as an array of shape (n_points, N) such as `PHASE.grid.T` or
+                            a pandas.DataFrame with volume fraction rows such as `PHASE.df`
+            use_parallel :  whether to distribute chunks of points over ray workers (default, False)
+            chunksize    :  number of points per chunk (default, 4096)
+            
+        Output:
+        =======
+            dictonary with the following keys, each an array of length n_points:
+            'stable'          :  whether the composition is stable i.e. no positive eigen value for k>0
+            'k_max'           :  k value of the fastest growing mode within self.k
+            'growth_rate'     :  largest eigen value of the amplification factor (at 'k_max')
+            'min_eigen_value' :  smallest eigen value of the Hessian (negative inside the spinodal)
+        """
+        if hasattr(points, 'to_numpy'):
+            points = points.loc[[i for i in points.index if str(i).startswith('Phi_')]].to_numpy().T
+        X = np.asarray(points, dtype=float)
+        chunks = [X[i:i+chunksize] for i in range(0, X.shape[0], chunksize)]
+        if use_parallel:
+            import ray
+            # only shut down a ray runtime started here
+            started = not ray.is_initialized()
+            ray.init(ignore_reinit_error=True)
+            lsa_ray = ray.put(self)
+            results = ray.get([ray_stability_chunk.remote(lsa_ray, chunk) for chunk in chunks])
+            del lsa_ray
+            if started:
+                ray.shutdown()
+        else:
+            results = [self._stability_chunk(chunk) for chunk in chunks]
+        keys = ['stable', 'k_max', 'growth_rate', 'min_eigen_value']
+        
+        return {key: np.concatenate([result[i] for result in results]) for i, key in enumerate(keys)}
+    
     def plot(self):
+        import matplotlib.pyplot as plt
         fig,ax = plt.subplots()
         for i in range(self.eigen_values.shape[1]):
             ax.plot(self.k, self.eigen_values[:,i], 
@@ -99,4 +179,9 @@ class LSA:
         ax.set_xlabel('k')
         ax.set_ylabel('eigen value')
         ax.legend(loc='best')
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+@lazy_remote
+def ray_stability_chunk(lsa, X):
+    """ ray version of `LSA._stability_chunk` """
+    return lsa._stability_chunk(X)
@@ -0,0 +1,342 @@
+""" Vectorized distances between phase diagrams computed on the same grid """
+import numpy as np
+
+def get_label_stack(engines):
+    """ Lifted labels of phase diagrams sharing a grid
+
+    Inputs:
+    =======
+        engines  : list of `polyphase.PHASE` instances after .compute(*args,**kwargs) is called
+
+    Outputs:
+    ========
+        labels as an integer array of shape (num_diagrams, num_points) to be used with the metrics below,
+        e.g. hamming_distance(labels) or `get_distance_matrix(labels, hamming_distance, vectorized=True)`
+    """
+    grid = engines[0].grid
+    for engine in engines[1:]:
+        if engine.grid.shape!=grid.shape or not np.array_equal(engine.grid, grid):
+            raise ValueError('Phase diagrams need to be computed on the same grid')
+
+    return np.stack([engine.df.loc['label',:].to_numpy() for engine in engines]).astype(int)
+
+def _one_hot(A, values, weights=None):
+    """ One hot encoding of labels A (array of shape (K, N)) as an array of shape (len(values), K, N) """
+    onehot = (A[np.newaxis,:,:]==np.asarray(values).reshape(-1,1,1)).astype(float)
+    if weights is not None:
+        onehot *= np.asarray(weights, dtype=float)
+
+    return onehot
+
+def _get_weights(N, weights):
+    if weights is None:
+        return np.ones(N)/N
+
+    weights = np.asarray(weights, dtype=float)
+
+    return weights/weights.sum()
+
+def hamming_distance(A, B=None, weights=None):
+    """ Fraction of points with different labels for all pairs of diagrams
+
+    Inputs:
+    =======
+        A, B     : labels as arrays of shape (K, N) and (L, N) (default B, None i.e. A)
+        weights  : area of each point as an array of shape (N,) e.g. for sampled grids (default, None i.e. uniform)
+
+    Outputs:
+    ========
+        distances as an array of shape (K, L) computed as one matrix product per label
+    """
+    A = np.atleast_2d(A)
+    B = A if B is None else np.atleast_2d(B)
+    w = _get_weights(A.shape[1], weights)
+    values = np.union1d(np.unique(A), np.unique(B))
+    agreement = np.sum(_one_hot(A, values, w)@_one_hot(B, values).transpose(0,2,1), axis=0)
+
+    return np.clip(1.0 - agreement, 0.0, None)
+
+def area_distance(A, B=None, weights=None, phases=None):
+    """ Area weighted per-phase distance for all pairs of diagrams
+
+    For each phase label l, the regions A_l and B_l are compared using the Jaccard distance
+    1-|A_l & B_l|/|A_l | B_l| and averaged with weights (|A_l|+|B_l|)/2 given by the areas of the regions.
+    The distance is zero for identical diagrams and one for diagrams whose phase regions do not overlap.
+
+    Inputs:
+    =======
+        A, B     : labels as arrays of shape (K, N) and (L, N) (default B, None i.e. A)
+        weights  : area of each point as an array of shape (N,) (default, None i.e. uniform)
+        phases   : labels to be compared (default, None i.e. all non zero labels)
+
+    Outputs:
+    ========
+        distances as an array of shape (K, L)
+    """
+    A = np.atleast_2d(A)
+    B = A if B is None else np.atleast_2d(B)
+    w = _get_weights(A.shape[1], weights)
+    if phases is None:
+        phases = np.setdiff1d(np.union1d(np.unique(A), np.unique(B)), [0])
+    onehot_A, onehot_B = _one_hot(A, phases, w), _one_hot(B, phases)
+    intersection = onehot_A@onehot_B.transpose(0,2,1)
+    area_A = onehot_A.sum(axis=2)[:,:,np.newaxis]
+    area_B = (onehot_B@w)[:,np.newaxis,:]
+    union = area_A + area_B - intersection
+    jaccard = np.where(union>0, 1.0 - intersection/np.where(union>0, union, 1.0), 0.0)
+    region_weights = 0.5*(area_A + area_B)
+    total = region_weights.sum(axis=0)
+
+    return np.sum(region_weights*jaccard, axis=0)/np.where(total>0, total, 1.0)
+
+def _get_quantiles(labels, projections, order, phases, num_quantiles):
+    """ Quantiles of the projected compositions of each phase region
+
+    returns array of shape (K, len(phases), num_projections, num_quantiles) with nan for empty regions
+    """
+    levels = (np.arange(num_quantiles)+0.5)/num_quantiles
+    K, num_projections = labels.shape[0], projections.shape[1]
+    quantiles = np.full((K, len(phases), num_projections, num_quantiles), np.nan)
+    for p in range(num_projections):
+        values = projections[order[:,p],p]
+        for i, phase in enumerate(phases):
+            # empirical distribution functions of the region along the projection, for all diagrams at once
+            cdf = np.cumsum(labels[:,order[:,p]]==phase, axis=1)
+            counts = cdf[:,-1]
+            # rows of cdf offset by N+1 form a single sorted array searched for all the diagrams at once
+            N = cdf.shape[1]
+            offsets = (N+1)*np.arange(K).reshape(-1,1)
+            ranks = np.searchsorted((cdf+offsets).ravel(), levels*counts.reshape(-1,1)+offsets, side='left')
+            ranks -= N*np.arange(K).reshape(-1,1)
+            nonempty = counts>0
+            quantiles[nonempty,i,p] = values[np.minimum(ranks[nonempty], N-1)]
+
+    return quantiles
+
+def sliced_wasserstein_distance(A, B=None, grid=None, num_projections=32, num_quantiles=32,
+                                phases=None, seed=0):
+    """ Sliced Wasserstein distance between the phase regions for all pairs of diagrams
+
+    The compositions of each phase region are projected onto random directions of the composition
+    hyperplane and the 2-Wasserstein distance of the projected distributions is approximated using
+    `num_quantiles` quantiles. The distances of the regions are averaged using their areas as weights
+    (see `area_distance`) and a region present only in one of the diagrams is at the distance of the
+    projected width of the composition simplex (sqrt(2)).
+
+    Inputs:
+    =======
+        A, B            : labels as arrays of shape (K, N) and (L, N) (default B, None i.e. A)
+        grid            : compositions of the points as an array of shape (dim, N) (e.g. `PHASE.grid`)
+        num_projections : number of random directions
+        num_quantiles   : number of quantiles of each projected distribution
+        phases          : labels to be compared (default, None i.e. all non zero labels)
+        seed            : seed of the random directions
+
+    Use functools.partial to fix the grid when passing it to `get_distance_matrix`.
+
+    Outputs:
+    ========
+        distances as an array of shape (K, L)
+    """
+    if grid is None:
+        raise ValueError('Sliced Wasserstein distance requires the grid of the diagrams')
+    A = np.atleast_2d(A)
+    B = A if B is None else np.atleast_2d(B)
+    if phases is None:
+        phases = np.setdiff1d(np.union1d(np.unique(A), np.unique(B)), [0])
+    grid = np.asarray(grid, dtype=float)
+
+    # random unit directions orthogonal to the normal of the composition hyperplane
+    directions = np.random.default_rng(seed).normal(size=(grid.shape[0], num_projections))
+    directions -= directions.mean(axis=0)
+    directions /= np.linalg.norm(directions, axis=0)
+    projections = grid.T@directions
+    order = np.argsort(projections, axis=0, kind='stable')
+
+    qA = _get_quantiles(A, projections, order, phases, num_quantiles)
+    qB = qA if B is A else _get_quantiles(B, projections, order, phases, num_quantiles)
+
+    # squared distances of the quantile functions as matrix products, per phase
+    fA = qA.reshape(qA.shape[0], len(phases), -1).transpose(1,0,2)
+    fB = qB.reshape(qB.shape[0], len(phases), -1).transpose(1,0,2)
+    emptyA, emptyB = np.isnan(fA[:,:,0]), np.isnan(fB[:,:,0])
+    fA, fB = np.nan_to_num(fA), np.nan_to_num(fB)
+    sq = (fA**2).sum(axis=2)[:,:,np.newaxis] + (fB**2).sum(axis=2)[:,np.newaxis,:] - 2*fA@fB.transpose(0,2,1)
+    sw = np.sqrt(np.clip(sq, 0.0, None)/fA.shape[2])
+    one_empty = emptyA[:,:,np.newaxis]^emptyB[:,np.newaxis,:]
+    sw = np.where(one_empty, np.sqrt(2), sw)
+
+    region_weights = 0.5*(_one_hot(A, phases).mean(axis=2)[:,:,np.newaxis]
+                          + _one_hot(B, phases).mean(axis=2)[:,np.newaxis,:])
+    total = region_weights.sum(axis=0)
+
+    return np.sum(region_weights*sw, axis=0)/np.where(total>0, total, 1.0)
+
+class DiagramIndex:
+    def __init__(self, num_tables=12, bits_per_table=14, num_bits=512, seed=0):
+        """Approximate nearest neighbour index of phase diagrams computed on the same grid
+
+        Each diagram is stored as a compact fingerprint of `num_bits` bits given by the signs of random 
+        projections of its one hot encoded labels. The angle between the one hot encodings of two diagrams 
+        at a Hamming distance h (see `hamming_distance`) is arccos(1-h), and the fraction of differing bits 
+        estimates arccos(1-h)/pi from which h is recovered. The leading bits of the fingerprints are split into `num_tables` 
+        hash keys (locality sensitive hashing) and a query only ranks the diagrams sharing a key with it.
+
+        Inputs:
+        =======
+            num_tables     :  number of hash tables (more tables find more neighbours at a larger query cost)
+            bits_per_table :  number of bits of each hash key, at most 64 (more bits give smaller buckets)
+            num_bits       :  number of bits of the fingerprints used to rank the neighbours, at least 
+                              num_tables*bits_per_table (more bits give more accurate distances)
+            seed           :  seed of the random projections, indices need the same seed to be compared
+
+        Methods:
+        ========
+            add              :  Add diagrams (labels of shape (K, N), see `get_label_stack`) to the index
+            query            :  Approximate k nearest neighbours of diagrams
+            kneighbors_graph :  Sparse k nearest neighbour graph of the indexed diagrams
+            save, load       :  Save (load) the index to (from) a .npz file
+
+        Example:
+        --------
+            >>> index = polyphase.DiagramIndex()
+            >>> index.add(polyphase.get_label_stack(engines))
+            >>> ids, distances = index.query(polyphase.get_label_stack([engine]), k=5)
+
+        A query for which the buckets hold less than `k` diagrams compares all the fingerprints.
+        """
+        if bits_per_table>64:
+            raise ValueError('Hash keys are limited to 64 bits, use more tables instead')
+        if num_tables*bits_per_table>num_bits:
+            raise ValueError('Fingerprints of {} bits are too short for {} tables of {} bits'.format(num_bits, num_tables, bits_per_table))
+        self.num_tables = num_tables
+        self.bits_per_table = bits_per_table
+        self.num_bits = num_bits
+        self.seed = seed
+        self.num_points = None
+        self.codes = np.zeros((0, (self.num_bits+7)//8), dtype=np.uint8)
+        self._projections = {}
+        self._tables = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _get_projection(self, label):
+        """ Random directions of the one hot encoding of `label`, drawn from (seed, label) 
+        so that the fingerprints do not depend on the labels seen before
+        """
+        if label not in self._projections:
+            rng = np.random.default_rng([self.seed, int(label)])
+            self._projections[label] = rng.standard_normal((self.num_points, self.num_bits), dtype=np.float32)
+
+        return self._projections[label]
+
+    def fingerprint(self, labels, chunksize=1024):
+        """ Fingerprints of diagrams (labels of shape (K, N)) as packed bits of shape (K, num_bits/8) """
+        labels = np.atleast_2d(labels)
+        if self.num_points is None:
+            self.num_points = labels.shape[1]
+        elif labels.shape[1]!=self.num_points:
+            raise ValueError('Phase diagrams need to be computed on the grid of the index with {} points'.format(self.num_points))
+        codes = []
+        for start in range(0, len(labels), chunksize):
+            chunk = labels[start:start+chunksize]
+            projected = np.zeros((len(chunk), self.num_bits), dtype=np.float32)
+            for label in np.unique(chunk):
+                projected += (chunk==label).astype(np.float32)@self._get_projection(label)
+            codes.append(np.packbits(projected>0, axis=1))
+
+        return np.concatenate(codes)
+
+    def add(self, labels):
+        """ Add diagrams (labels of shape (K, N)) to the index, returns their ids """
+        codes = self.fingerprint(labels)
+        ids = np.arange(len(self.codes), len(self.codes)+len(codes))
+        self.codes = np.concatenate([self.codes, codes])
+        self._tables = None
+
+        return ids
+
+    def _get_keys(self, codes):
+        """ Hash keys of packed fingerprints as an array of shape (K, num_tables) """
+        count = self.num_tables*self.bits_per_table
+        bits = np.unpackbits(codes, axis=1, count=count).reshape(len(codes), self.num_tables, -1)
+        powers = np.left_shift(np.uint64(1), np.arange(self.bits_per_table, dtype=np.uint64))
+
+        return np.sum(bits.astype(np.uint64)*powers, axis=2, dtype=np.uint64)
+
+    def _get_tables(self):
+        """ Hash tables as sorted keys and the ids of the diagrams in that order, for each table """
+        if self._tables is None:
+            keys = self._get_keys(self.codes)
+            order = np.argsort(keys, axis=0, kind='stable')
+            self._tables = (np.take_along_axis(keys, order, axis=0), order)
+
+        return self._tables
+
+    def _get_distances(self, codes, ids):
+        """ Estimated Hamming distances between fingerprints `codes` (shape (Q, num_bits/8)) and 
+        the indexed diagrams `ids` (shape (Q, M))
+        """
+        differing = np.bitwise_count(codes[:,np.newaxis,:]^self.codes[ids]).sum(axis=2)
+
+        return 1.0 - np.cos(np.pi*differing/self.num_bits)
+
+    def query(self, labels, k=10, return_distance=True):
+        """ Approximate k nearest neighbours of diagrams (labels of shape (Q, N)) in the index
+        
+        returns ids of the neighbours as an array of shape (Q, k) sorted by the estimated Hamming 
+        distances (and the distances of the same shape if return_distance)
+        """
+        return self._query_codes(self.fingerprint(labels), k=k, return_distance=return_distance)
+
+    def _query_codes(self, codes, k=10, return_distance=True):
+        if k>len(self):
+            raise ValueError('Index has only {} diagrams, cannot query {} neighbours'.format(len(self), k))
+        sorted_keys, order = self._get_tables()
+        keys = self._get_keys(codes)
+        left = np.stack([np.searchsorted(sorted_keys[:,t], keys[:,t], side='left') for t in range(self.num_tables)], axis=1)
+        right = np.stack([np.searchsorted(sorted_keys[:,t], keys[:,t], side='right') for t in range(self.num_tables)], axis=1)
+        ids = np.zeros((len(codes), k), dtype=int)
+        distances = np.zeros((len(codes), k))
+        for q in range(len(codes)):
+            candidates = np.unique(np.concatenate([order[left[q,t]:right[q,t],t] for t in range(self.num_tables)]))
+            if len(candidates)<k:
+                candidates = np.arange(len(self))
+            d = self._get_distances(codes[q:q+1], candidates[np.newaxis,:])[0]
+            nearest = np.argsort(d, kind='stable')[:k]
+            ids[q], distances[q] = candidates[nearest], d[nearest]
+        if return_distance:
+            return ids, distances
+
+        return ids
+
+    def kneighbors_graph(self, n_neighbors=10):
+        """ Estimated Hamming distances of each indexed diagram to its n_neighbors approximate nearest 
+        neighbours (excluding itself) as a sparse matrix of shape (len(index), len(index)), 
+        e.g. for the clustering `Pipeline(index, affinity='knn')`. Identical diagrams are stored as explicit zeros.
+        """
+        from scipy.sparse import csr_matrix
+
+        ids, distances = self._query_codes(self.codes, k=n_neighbors+1)
+        is_other = ids!=np.arange(len(self)).reshape(-1,1)
+        # drop the diagram itself, or the last neighbour if the diagram is not among its neighbours
+        keep = is_other & (np.cumsum(is_other, axis=1)<=n_neighbors)
+        rows = np.repeat(np.arange(len(self)), n_neighbors)
+
+        return csr_matrix((distances[keep], (rows, ids[keep])), shape=(len(self), len(self)))
+
+    def save(self, filename):
+        num_points = 0 if self.num_points is None else self.num_points
+        np.savez(filename, codes=self.codes, num_points=num_points, num_tables=self.num_tables,
+                 bits_per_table=self.bits_per_table, num_bits=self.num_bits, seed=self.seed)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        index = cls(num_tables=int(data['num_tables']), bits_per_table=int(data['bits_per_table']), 
+                    num_bits=int(data['num_bits']), seed=int(data['seed']))
+        index.num_points = int(data['num_points']) or None
+        index.codes = data['codes']
+
+        return index
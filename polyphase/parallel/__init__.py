@@ -1 +1 @@
-from .utils import get_distance_matrix
\ No newline at end of file
+from .utils import get_distance_matrix, CondensedDistanceMatrix
@@ -1,88 +1,267 @@
 import pdb
+import os
 import numpy as np
-import ray
-from ..utils import timer
+from ..utils import timer, lazy_remote
 
 from scipy.spatial.distance import squareform
 
-@ray.remote(num_cpus=5)
-def _get_distance_row(data, metric, rowid, triuids):
-    print('Staging {} on {}'.format(rowid, ray.services.get_node_ip_address()))
+def _get_distance_block(data, metric, rows, cols, vectorized=False):
+    """ Distances between samples `rows` and `cols` (start, stop) of the data
+
+    returns array of shape (len(rows), len(cols)), only the entries above the diagonal are computed
+    for a tile on the diagonal (rows==cols)
+    """
     T = timer()
-    rowid_flags = triuids[0]
-    rows = triuids[0][rowid_flags==rowid]
-    cols = triuids[1][rowid_flags==rowid]
-    dist_row = []
-    for r,c in zip(rows, cols):
-        dist_row.append(metric(data[r], data[c]))
+    if vectorized:
+        block = np.asarray(metric(data[rows[0]:rows[1]], data[cols[0]:cols[1]]), dtype=float)
+    else:
+        block = np.zeros((rows[1]-rows[0], cols[1]-cols[0]))
+        for i in range(rows[0], rows[1]):
+            for j in range(max(cols[0], i+1), cols[1]):
+                block[i-rows[0], j-cols[0]] = metric(data[i], data[j])
+
+    return block, rows, cols, T.end()
+
+ray_get_distance_block = lazy_remote(_get_distance_block)
+
+def _get_tiles(n_samples, block_size):
+    """ Square tiles (rows, cols) covering the upper triangle of a n_samples x n_samples matrix """
+    starts = range(0, n_samples, block_size)
+    bounds = [(s, min(s+block_size, n_samples)) for s in starts]
+
+    return [(bounds[i], bounds[j]) for i in range(len(bounds)) for j in range(i, len(bounds))]
+
+def _condensed_indices(n_samples, rows, cols):
+    """ Positions of the entries of a tile in the condensed distance matrix (as in `scipy.spatial.distance.pdist`)
+
+    returns mask of the tile entries above the diagonal and their indices in the condensed matrix
+    """
+    i, j = np.meshgrid(np.arange(*rows), np.arange(*cols), indexing='ij')
+    mask = j>i
+    i, j = i[mask], j[mask]
+
+    return mask, n_samples*i - (i*(i+1))//2 + (j-i-1)
+
+class CondensedDistanceMatrix:
+    def __init__(self, condensed, n_samples=None):
+        """Row access to a condensed distance matrix (as in `scipy.spatial.distance.pdist`) without
+        forming the square matrix, e.g. for a memory mapped output of `get_distance_matrix`
+
+        Inputs:
+        =======
+            condensed  :  condensed distance matrix as an array (or a numpy.memmap) of shape (n*(n-1)/2,)
+            n_samples  :  number of samples n (default, None i.e. inferred from the length of condensed)
+
+        Methods:
+        ========
+            rows          :  Rows of the square matrix between two samples
+            open          :  Open a condensed distance matrix saved as a .npy file (memory mapped)
+            to_squareform :  Square distance matrix (dense)
+
+        Indexing with an integer (or a slice of samples) returns the row(s) of the square matrix
+        and with a pair of integers the distance between two samples. As the matrix is symmetric,
+        rows are also the columns. Attributes `shape` and `std` are those of the square matrix so that it 
+        can be used as a metric, e.g. by `Pipeline(M, affinity='knn')` of the clustering analysis.
+
+        Example:
+        --------
+            >>> M = polyphase.get_distance_matrix(X, cdist, vectorized=True, filename='distance.npy')
+            >>> M[0]        # distances of the first sample to all the samples
+            >>> M[10:20]    # array of shape (10, n_samples)
+            >>> M = polyphase.CondensedDistanceMatrix.open('distance.npy')
+        """
+        self.condensed = condensed
+        if n_samples is None:
+            n_samples = int(np.round((1+np.sqrt(1+8*len(condensed)))/2))
+        if n_samples*(n_samples-1)//2!=len(condensed):
+            raise ValueError('Condensed matrix of length {} does not match {} samples'.format(len(condensed), n_samples))
+        self.n_samples = n_samples
+        self.shape = (n_samples, n_samples)
+
+    @classmethod
+    def open(cls, filename, mode='r'):
+        return cls(np.load(filename, mmap_mode=mode))
+
+    def __len__(self):
+        return self.n_samples
+
+    def rows(self, start, stop):
+        """ Rows start to stop of the square matrix as an array of shape (stop-start, n_samples) """
+        i = np.arange(start, stop).reshape(-1,1)
+        j = np.arange(self.n_samples).reshape(1,-1)
+        a, b = np.minimum(i, j), np.maximum(i, j)
+        ids = self.n_samples*a - (a*(a+1))//2 + (b-a-1)
+        diagonal = a==b
+        block = np.asarray(self.condensed[np.where(diagonal, 0, ids).ravel()]).reshape(ids.shape)
+        block[diagonal] = 0.0
+
+        return block
+
+    def _normalize_index(self, i):
+        """ Integer index i wrapped to [0, n_samples) as for a numpy array """
+        i = int(i)
+        if i<-self.n_samples or i>=self.n_samples:
+            raise IndexError('index {} is out of bounds for {} samples'.format(i, self.n_samples))
+
+        return i % self.n_samples
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            i, j = [self._normalize_index(k) for k in key]
+            if i==j:
+                return 0.0
+            a, b = min(i, j), max(i, j)
+            return self.condensed[self.n_samples*a - (a*(a+1))//2 + (b-a-1)]
+        elif isinstance(key, slice):
+            start, stop, step = key.indices(self.n_samples)
+            return self.rows(start, stop)[::step]
+        else:
+            key = self._normalize_index(key)
+            return self.rows(key, key+1)[0]
 
-    return dist_row, rowid, T.end()
+    def std(self):
+        """ Standard deviation of the entries of the square matrix (including the diagonal) """
+        n = self.n_samples
+        total, total_sq = 0.0, 0.0
+        for start in range(0, len(self.condensed), 2**24):
+            chunk = np.asarray(self.condensed[start:start+2**24], dtype=float)
+            total += chunk.sum()
+            total_sq += (chunk**2).sum()
+        mean = 2*total/n**2
 
-def get_distance_matrix(X, metric):
+        return np.sqrt(2*total_sq/n**2 - mean**2)
+
+    def to_squareform(self):
+        return squareform(np.asarray(self.condensed))
+
+def _open_condensed_memmap(filename, n_samples, num_tiles):
+    """ Memory maps of the condensed distances (filename) and the tiles written (filename.tiles.npy),
+    opened for a resume if they exist and created otherwise
+    """
+    shape = (n_samples*(n_samples-1)//2,)
+    progress_filename = filename + '.tiles.npy'
+    if os.path.exists(filename) and os.path.exists(progress_filename):
+        dist = np.load(filename, mmap_mode='r+')
+        is_done = np.load(progress_filename, mmap_mode='r+')
+        if dist.shape!=shape or is_done.shape!=(num_tiles,):
+            raise ValueError('Existing file {} was computed for different samples or block size'.format(filename))
+    else:
+        dist = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64, shape=shape)
+        is_done = np.lib.format.open_memmap(progress_filename, mode='w+', dtype=bool, shape=(num_tiles,))
+
+    return dist, is_done
+
+def get_distance_matrix(X, metric, **kwargs):
     """ Compute distance matrix in parallel using ray
-    
+
     Computes pairwise distances between samples with arbitrary dimensions.
-    a `metric` needs to be passed as a callable function that takes two samples 
+    a `metric` needs to be passed as a callable function that takes two samples
     of the data `X` and returns a scalar distance.
-    
+
+    The upper triangle of the distance matrix is split into square tiles of `block_size` samples,
+    each being a ray task of roughly equal work. Distances of the tiles are written directly into a
+    preallocated condensed distance matrix as the tasks finish.
+
     Example:
     --------
-    from scipy.spatial.distance import euclidean
+    from scipy.spatial.distance import euclidean, cdist
     import numpy as np
-    
+
     X = np.random.rand(4,3)
-    M = get_distance_matrix(X, euclidean) 
+    M = get_distance_matrix(X, euclidean)
     # M should be of the shape (4,4)
-    
+    M = get_distance_matrix(X, cdist, vectorized=True, condensed=True)
+    # M should be of the shape (6,)
+
     Input:
     ------
         X       :  data matrix where each row is a sample
         metric  :  A metric function that is used to compute distance
-        
+
+        kwargs:
+        -------
+            block_size   :  (int) number of samples along each side of a tile (default, 256)
+            vectorized   :  (bool) whether `metric` takes two blocks of samples (X[a:b], X[c:d]) and returns
+                            their distances as an array of shape (b-a, d-c), e.g. `scipy.spatial.distance.cdist`
+                            (default, False)
+            condensed    :  (bool) whether to return the condensed distance matrix (default, False)
+            progress     :  callable `progress(num_done, num_total)` called after each tile is computed
+                            (default, None i.e. no progress reporting)
+            num_cpus     :  (int) number of CPUs reserved by each ray task (default, 1)
+            use_parallel :  (bool) whether to compute the tiles on ray workers (default, True)
+            filename     :  (str) a .npy file to write the condensed distances into as a memory map
+                            (default, None i.e. in memory). A progress file `filename.tiles.npy` records 
+                            the tiles written so that an interrupted computation is resumed by calling 
+                            the function again with the same arguments. A `CondensedDistanceMatrix` 
+                            of the memory map is returned.
+
     Output:
     -------
-        M    : Distance matrix in squareform
-        
-        
+        M    : Distance matrix in squareform (or condensed form or a `CondensedDistanceMatrix`)
+
+
     Notes:
     ------
-    When you pass large numpy arrays, this function might run into memory issues. One work around is to pass 
+    When you pass large numpy arrays, this function might run into memory issues. One work around is to pass
     a small list that can be used to query samples by calling `__getitem__`
-    
+
     """
-    ray.init(ignore_reinit_error=True)
-    T = timer()
+    block_size = kwargs.get('block_size', 256)
+    vectorized = kwargs.get('vectorized', False)
+    condensed = kwargs.get('condensed', False)
+    progress = kwargs.get('progress', None)
+    num_cpus = kwargs.get('num_cpus', 1)
+    use_parallel = kwargs.get('use_parallel', True)
+    filename = kwargs.get('filename', None)
+
     n_samples = len(X)
-        
-    nC2 = 0.5*(n_samples*(n_samples-1))
-    iu = np.triu_indices(n_samples,1)
-    row_ids = np.unique(iu[0])
-    
-    iu_ray = ray.put(iu)
-    X_ray = ray.put(X)
-    metric_ray = ray.put(metric)
-    
-    remaining_result_ids = [_get_distance_row.remote(X_ray, metric_ray, rowid, iu_ray) for rowid in row_ids]
-    
-    dist = {}
-    while len(remaining_result_ids) > 0:
-        ready_result_ids, remaining_result_ids = ray.wait(remaining_result_ids, num_returns=1)
-        result_id = ready_result_ids[0]
-        dist_result,rowid_result, time_result = ray.get(result_id)
-        dist[rowid_result] = dist_result
-        print('Processed : {} took {} '.format(rowid_result, time_result)) 
-        
-    del remaining_result_ids,result_id, iu_ray, metric_ray, X_ray, dist_result,rowid_result, time_result      
-    
-    reduce_dist = [dist[k] for k in sorted(dist)]
-    dist = np.hstack(reduce_dist)
-
-    assert nC2==len(dist), "Not all the reduced distances are returned. expected {} got {}".format(nC2, len(dist))
-    
-    D = squareform(dist)
-    
-    assert n_samples==np.shape(D)[0] , "Shape of distance matrix is {}, expected {}x{}".format(D.shape, n_samples, n_samples)
-    
-    print('\nComputation took : {}'.format(T.end()))
-
-    return D
+    tiles = _get_tiles(n_samples, block_size)
+    if filename is None:
+        dist = np.zeros(n_samples*(n_samples-1)//2)
+        is_done = np.zeros(len(tiles), dtype=bool)
+    else:
+        dist, is_done = _open_condensed_memmap(filename, n_samples, len(tiles))
+    num_done = int(np.sum(is_done))
+    tile_ids = {tile:k for k, tile in enumerate(tiles)}
+
+    def reduce(block, rows, cols, num_done):
+        mask, ids = _condensed_indices(n_samples, rows, cols)
+        dist[ids] = block[mask]
+        if filename is not None:
+            # distances are flushed before the tile is recorded so that a resume never skips missing tiles
+            dist.flush()
+            is_done[tile_ids[(tuple(rows), tuple(cols))]] = True
+            is_done.flush()
+        if progress is not None:
+            progress(num_done, len(tiles))
+    tiles_todo = [tile for tile, done in zip(tiles, is_done) if not done]
+
+    if use_parallel:
+        import ray
+        # only shut down a ray runtime started here
+        started = not ray.is_initialized()
+        ray.init(ignore_reinit_error=True)
+        X_ray = ray.put(X)
+        metric_ray = ray.put(metric)
+        remote = ray_get_distance_block.options(num_cpus=num_cpus)
+        remaining_result_ids = [remote.remote(X_ray, metric_ray, rows, cols, vectorized) for rows, cols in tiles_todo]
+        while len(remaining_result_ids) > 0:
+            ready_result_ids, remaining_result_ids = ray.wait(remaining_result_ids, num_returns=1)
+            block, rows, cols, _ = ray.get(ready_result_ids[0])
+            num_done += 1
+            reduce(block, rows, cols, num_done)
+        del X_ray, metric_ray
+        if started:
+            ray.shutdown()
+    else:
+        for rows, cols in tiles_todo:
+            block, _, _, _ = _get_distance_block(X, metric, rows, cols, vectorized)
+            num_done += 1
+            reduce(block, rows, cols, num_done)
+
+    if filename is not None:
+        return CondensedDistanceMatrix(dist, n_samples)
+    elif condensed:
+        return dist
+
+    return squareform(dist)
@@ -0,0 +1,199 @@
+""" Rasterize ternary phase diagrams into label images using NumPy (no matplotlib) """
+import numpy as np
+import zlib
+import struct
+from scipy.spatial import cKDTree
+
+# colors of the labels 0 (and outside of the triangle), 1, 2, 3 as in `polyphase.plain_phase_diagram`
+PHASE_COLORS = np.array([[255,255,255],
+                         [255,0,0],
+                         [0,128,0],
+                         [0,0,255]], dtype=np.uint8)
+
+def _to_plane(X):
+    """ Project ternary compositions X (array of shape (num_points, 3)) onto the plane of the image
+    with phi_3 at the top, phi_1 at the bottom left and phi_2 at the bottom right corner (as in mpltern)
+
+    returns array of shape (num_points, 2)
+    """
+    X = np.asarray(X, dtype=float)
+
+    return np.stack((X[:,1] + 0.5*X[:,2], 0.5*np.sqrt(3)*X[:,2]), axis=1)
+
+def get_pixel_compositions(size):
+    """ Compositions at the pixel centers of a ternary image
+
+    Inputs:
+    =======
+        size  :  (int) number of pixels along the width of the image, the height is size*sqrt(3)/2
+
+    Outputs:
+    ========
+        X       : compositions as an array of shape (height, size, 3)
+        inside  : whether the pixel center is inside the triangle as a boolean array of shape (height, size)
+    """
+    height = int(np.ceil(0.5*np.sqrt(3)*size))
+    x = (np.arange(size)+0.5)/size
+    y = 0.5*np.sqrt(3)*(1-(np.arange(height)+0.5)/height)
+    x, y = np.meshgrid(x, y)
+    phi3 = y/(0.5*np.sqrt(3))
+    phi2 = x - 0.5*phi3
+    phi1 = 1 - phi2 - phi3
+    X = np.stack((phi1, phi2, phi3), axis=-1)
+
+    return X, np.all(X>=0, axis=-1)
+
+def rasterize_labels(grid, labels, size=64):
+    """ Rasterize point labels (e.g. the lifted labels of `PHASE.df`) of one or many phase diagrams
+    sharing the same grid by assigning each pixel the label of the nearest grid point
+
+    Inputs:
+    =======
+        grid    : compositions as an array of shape (3, num_points) (e.g. `PHASE.grid`)
+        labels  : labels as an array of shape (num_points,) or (num_diagrams, num_points)
+        size    : (int) width of the image in pixels (default, 64)
+
+    Outputs:
+    ========
+        images as an uint8 array of shape (height, size) or (num_diagrams, height, size)
+        with zero outside of the triangle
+    """
+    X, inside = get_pixel_compositions(size)
+    _, nearest = cKDTree(_to_plane(np.asarray(grid).T)).query(_to_plane(X[inside]))
+    labels = np.asarray(labels)
+    images = np.zeros(labels.shape[:-1]+inside.shape, dtype=np.uint8)
+    images[...,inside] = labels[...,nearest]
+
+    return images
+
+def rasterize_simplices(grid, simplices, num_comps, size=64, chunksize=2**20):
+    """ Rasterize lower hull simplices colored by their number of phases
+
+    Pixels are tested against the barycentric coordinates of the simplices whose bounding box contain them.
+    Simplices are processed in the order of their bounding box size in chunks of about `chunksize`
+    candidate pixels so that a few large simplices (e.g. three phase regions) do not blow up the memory.
+
+    Inputs:
+    =======
+        grid       : compositions as an array of shape (3, num_points) (e.g. `PHASE.grid`)
+        simplices  : simplices as indices into grid (e.g. `PHASE.simplices`)
+        num_comps  : number of phases of each simplex (e.g. `PHASE.num_comps`)
+        size       : (int) width of the image in pixels (default, 64)
+
+    Outputs:
+    ========
+        image as an uint8 array of shape (height, size) with zero outside of the triangle
+        and on pixels not covered by any simplex
+    """
+    _, inside = get_pixel_compositions(size)
+    height = inside.shape[0]
+    image = np.zeros(inside.shape, dtype=np.uint8)
+    simplices = np.asarray(simplices, dtype=int).reshape(-1,3)
+    if len(simplices)==0:
+        return image
+    num_comps = np.asarray(num_comps, dtype=np.uint8)
+
+    # simplex vertices in pixel units
+    scale = np.array([size, height/(0.5*np.sqrt(3))])
+    P = _to_plane(np.asarray(grid).T)*scale
+    P[:,1] = height - P[:,1]
+    V = P[simplices]
+    lower = np.clip(np.floor(V.min(axis=1)-0.5).astype(int), 0, None)
+    upper = np.minimum(np.ceil(V.max(axis=1)-0.5).astype(int), [size-1, height-1])
+    extent = np.maximum(upper-lower+1, 0)
+
+    # barycentric coordinates from the inverse of T = [v1-v0, v2-v0]
+    T = np.stack((V[:,1]-V[:,0], V[:,2]-V[:,0]), axis=2)
+    det = T[:,0,0]*T[:,1,1]-T[:,0,1]*T[:,1,0]
+    valid = np.abs(det)>1e-12
+    Tinv = np.zeros_like(T)
+    Tinv[valid] = np.linalg.inv(T[valid])
+
+    # the square of the longest side of a bounding box bounds the candidate pixels of a chunk
+    sides = np.maximum(extent.max(axis=1), 1)
+    order = np.argsort(sides)
+    areas = sides[order]**2
+    start = 0
+    while start<len(order):
+        # candidate pixels of a chunk grow monotonically with its size as the areas are sorted
+        stop = start + max(1, np.searchsorted(np.arange(1,len(order)-start+1)*areas[start:], chunksize, side='right'))
+        ids = order[start:stop]
+        bw, bh = extent[ids].max(axis=0)
+        dx, dy = np.meshgrid(np.arange(bw), np.arange(bh))
+        px = lower[ids,0:1] + dx.ravel()
+        py = lower[ids,1:2] + dy.ravel()
+        d = (px+0.5-V[ids,0,0:1], py+0.5-V[ids,0,1:2])
+        b1 = Tinv[ids,0,0:1]*d[0] + Tinv[ids,0,1:2]*d[1]
+        b2 = Tinv[ids,1,0:1]*d[0] + Tinv[ids,1,1:2]*d[1]
+        tol = 1e-9
+        hit = (b1>=-tol)*(b2>=-tol)*(b1+b2<=1+tol)
+        hit *= (px<=upper[ids,0:1])*(py<=upper[ids,1:2])*valid[ids,np.newaxis]
+        image[py[hit], px[hit]] = np.broadcast_to(num_comps[ids,np.newaxis], hit.shape)[hit]
+        start = stop
+    image[~inside] = 0
+
+    return image
+
+def rasterize(engines, size=64, mode='labels'):
+    """ Rasterize a batch of solved ternary phase diagrams
+
+    Inputs:
+    =======
+        engines  : list of `polyphase.PHASE` instances after .compute(*args,**kwargs) is called
+        size     : (int) width of the images in pixels (default, 64)
+        mode     : (str) what to rasterize
+                   1. 'labels' -- lifted labels of the points in PHASE.df (default)
+                   2. 'simplices' -- lower hull simplices colored by PHASE.num_comps
+
+    Outputs:
+    ========
+        images as an uint8 array of shape (num_diagrams, height, size)
+    """
+    if mode=='labels':
+        # diagrams sharing a grid share the nearest neighbor look up
+        images, batch, grid = [], [], None
+        for engine in engines:
+            if grid is not None and not (grid.shape==engine.grid.shape and np.array_equal(grid, engine.grid)):
+                images.append(rasterize_labels(grid, np.asarray(batch), size=size))
+                batch = []
+            grid = engine.grid
+            batch.append(engine.df.loc['label',:].to_numpy())
+        if batch:
+            images.append(rasterize_labels(grid, np.asarray(batch), size=size))
+
+        return np.concatenate(images, axis=0)
+    elif mode=='simplices':
+        return np.stack([rasterize_simplices(engine.grid, engine.simplices, engine.num_comps, size=size)
+                         for engine in engines])
+    else:
+        raise KeyError('Mode {} is not available, use labels or simplices'.format(mode))
+
+def to_rgb(images, colors=PHASE_COLORS):
+    """ Color label images (uint8 array of shape (..., height, width)) using a palette indexed by label
+
+    returns uint8 array of shape (..., height, width, 3)
+    """
+    return np.asarray(colors, dtype=np.uint8)[images]
+
+def write_png(fname, image):
+    """ Write an uint8 image of shape (height, width) (grayscale) or (height, width, 3) (RGB) to a PNG file
+
+    Label images should be colored using `to_rgb` before writing them.
+    """
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    color_type = 2 if image.ndim==3 else 0
+    # each scanline is prefixed with the filter type zero (None)
+    raw = np.hstack((np.zeros((height,1), dtype=np.uint8), image.reshape(height,-1))).tobytes()
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag+data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    with open(fname, 'wb') as fh:
+        fh.write(b'\x89PNG\r\n\x1a\n')
+        fh.write(chunk(b'IHDR', header))
+        fh.write(chunk(b'IDAT', zlib.compress(raw, 6)))
+        fh.write(chunk(b'IEND', b''))
+
+    return
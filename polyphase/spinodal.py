@@ -0,0 +1,251 @@
+import numpy as np
+from itertools import combinations, combinations_with_replacement, permutations
+from collections import defaultdict
+
+from ._phase import MIN_POINT_PRECISION
+
+def get_lattice_simplices(meshsize, dimension):
+    """
+    Freudenthal triangulation of the composition lattice with `meshsize` points per dimension
+
+    Lattice points are written in the cumulative coordinates y_k = n_1+...+n_k of their integer
+    compositions n (sum(n)=meshsize-1). The composition simplex then is {0<=y_1<=...<=y_(dim-1)<=meshsize-1},
+    a union of Freudenthal simplices y_b + e_p1 + ... + e_pk of the unit cubes.
+
+    returns integer compositions (array of shape (num_points, dimension)) and
+    simplices as indices into them (array of shape (num_simplices, dimension))
+    """
+    m = meshsize-1
+    y = np.asarray(list(combinations_with_replacement(range(m+1), dimension-1)), dtype=int).reshape(-1,dimension-1)
+    lookup = -1*np.ones((m+2,)*(dimension-1), dtype=int)
+    lookup[tuple(y.T)] = np.arange(len(y))
+
+    simplices = []
+    for perm in permutations(range(dimension-1)):
+        vertices = [y]
+        for axis in perm:
+            step = vertices[-1].copy()
+            step[:,axis] += 1
+            vertices.append(step)
+        vertices = np.stack(vertices, axis=1)
+        inside = np.all(np.diff(vertices, axis=2)>=0, axis=(1,2))*np.all(vertices[:,:,-1]<=m, axis=1)
+        simplices.append(lookup[tuple(np.transpose(vertices[inside], (2,0,1)))])
+    simplices = np.vstack(simplices)
+
+    counts = np.diff(np.hstack((np.zeros((len(y),1), dtype=int), y, m*np.ones((len(y),1), dtype=int))), axis=1)
+
+    return counts, simplices
+
+def certify_miscibility(energy, meshsize=10):
+    """
+    Certify that a Flory-Huggins free energy is convex on the whole composition simplex, 
+    i.e. the system does not phase separate, using lower bounds of its reduced Hessian.
+    
+    With P the Jacobian of the volume fractions with respect to the first dim-1 of them, the reduced 
+    Hessian is P^T (diag(1/(M*x) + 2*beta/x^3) + CHI) P. Since the diagonal term decreases with x, 
+    replacing x by an upper bound of it gives a lower bound of the Hessian:
+        1. x <= 1 gives a single matrix for the entire simplex
+        2. x <= largest composition on the vertices of a cell of a coarse lattice of `meshsize` points 
+           gives one matrix for each cell
+    The energy is convex if all of the lower bounds in either of the steps are positive definite. 
+    A False return value does not imply a phase separation. The diagonal term does not decrease with x 
+    when beta < 0, such energies are never certified.
+    
+    energy : `polyphase.FloryHuggins` instance (or any object with M, CHI and beta attributes)
+    
+    returns True if the energy is certified to be convex
+    """
+    M = np.asarray(energy.M, dtype=float)
+    dimension = len(M)
+    beta = getattr(energy, 'beta', 0.0)
+    if beta<0:
+        return False
+    P = np.vstack((np.identity(dimension-1), -np.ones((1,dimension-1))))
+    lower_bound = lambda x: P.T@((1/(M*x) + 2*beta/x**3)[...,np.newaxis]*np.identity(dimension) + energy.CHI)@P
+    
+    if np.linalg.eigvalsh(lower_bound(np.ones(dimension)))[0]>0:
+        return True
+    
+    counts, simplices = get_lattice_simplices(meshsize, dimension)
+    xmax = np.clip(counts[simplices].max(axis=1)/(meshsize-1), MIN_POINT_PRECISION, 1)
+    
+    return bool(np.all(np.linalg.eigvalsh(lower_bound(xmax))[:,0]>0))
+
+class Spinodal:
+    def __init__(self, energy, meshsize, dimension):
+        """Spinodal of a free energy as the zero level set of the stability of its reduced Hessian
+
+        Parameters:
+        -----------
+            energy     :  Free energy with a vectorized `hessian(X, reduced=True)` method
+                          such as `polyphase.FloryHuggins`
+            meshsize   :  (int) Number of points to be sampled per dimension
+            dimension  :  (int) Dimension of the the system (3 or 4)
+
+        Methods:
+        --------
+            compute  :  Evaluate the stability on the lattice and trace the spinodal
+            plot     :  Plot the spinodal curves of a ternary system
+
+        Attributes:
+        -----------
+            grid       :  lattice compositions (array of shape (dim, points))
+            values     :  stability criterion at the lattice points, negative inside the spinodal
+            simplices  :  simplices of the lattice triangulation
+            polylines  :  (ternary) list of spinodal curves as arrays of shape (num_points, dim)
+            vertices   :  (quaternary) vertices of the spinodal surface as an array of shape (num_vertices, dim)
+            faces      :  (quaternary) triangles of the spinodal surface as indices into `vertices`
+
+        Example:
+        --------
+            >>> fh = polyphase.FloryHuggins([5,5,1], [1,0.5,0.5])
+            >>> spinodal = polyphase.Spinodal(fh, 100, 3)
+            >>> spinodal.compute()
+            >>> engine = polyphase.PHASE(fh, 100, 3)
+            >>> engine.compute()
+            >>> ax = polyphase.TernaryPlot(engine).plot_points()
+            >>> spinodal.plot(ax=ax)
+        """
+        if not hasattr(energy, 'hessian'):
+            raise ValueError('Variable energy needs to provide a hessian such as `polyphase.FloryHuggins`')
+        if dimension not in [3,4]:
+            raise ValueError('Spinodals are only traced for 3 or 4 components, {} given'.format(dimension))
+        self.energy = energy
+        self.meshsize = meshsize
+        self.dimension = dimension
+        self.method = 'eigenvalue'
+        self.is_solved = False
+
+    def _to_compositions(self, X):
+        X = np.clip(np.asarray(X, dtype=float), MIN_POINT_PRECISION, None)
+
+        return X/X.sum(axis=-1, keepdims=True)
+
+    def criterion(self, X):
+        """ Stability criterion of compositions X (array of shape (num_points, dim)), negative when unstable """
+        hessians = self.energy.hessian(self._to_compositions(X), reduced=True)
+        if self.method=='eigenvalue':
+            return np.linalg.eigvalsh(hessians)[...,0]
+        elif self.method=='determinant':
+            return np.linalg.det(hessians)
+
+    def compute(self, **kwargs):
+        """ Compute the spinodal
+
+        Arguments:
+        ----------
+            method   : (string) stability criterion of the reduced Hessian
+                                1. 'eigenvalue' -- smallest eigen value (default)
+                                2. 'determinant' -- determinant, changes sign only once per unstable mode
+            polish   : (bool) whether to locate the zero crossing on each lattice edge using
+                              brentq instead of a linear interpolation (default, False)
+            xtol     : (float) tolerance of the root polishing (default, 1e-12)
+        """
+        self.method = kwargs.get('method', 'eigenvalue')
+        if self.method not in ['eigenvalue', 'determinant']:
+            raise KeyError('Method {} is not available, use eigenvalue or determinant'.format(self.method))
+        self.polish = kwargs.get('polish', False)
+        xtol = kwargs.get('xtol', 1e-12)
+
+        counts, self.simplices = get_lattice_simplices(self.meshsize, self.dimension)
+        points = counts/(self.meshsize-1)
+        self.grid = self._to_compositions(points).T
+        self.values = self.criterion(points)
+
+        # edges of the triangulation across which the criterion changes sign
+        unstable = self.values<0
+        pairs = np.asarray(list(combinations(range(self.dimension), 2)))
+        edges = np.sort(self.simplices[:,pairs], axis=2)
+        crossing = unstable[edges[...,0]]!=unstable[edges[...,1]]
+        cut = np.any(crossing, axis=1)
+
+        crossing_edges, edge_ids = np.unique(edges[crossing].reshape(-1,2), axis=0, return_inverse=True)
+        a, b = points[crossing_edges[:,0]], points[crossing_edges[:,1]]
+        fa, fb = self.values[crossing_edges[:,0]], self.values[crossing_edges[:,1]]
+        if self.polish:
+            from scipy.optimize import brentq
+            t = np.asarray([brentq(lambda s: self.criterion((1-s)*ai+s*bi), 0, 1, xtol=xtol)
+                            for ai, bi in zip(a,b)])
+        else:
+            t = fa/(fa-fb)
+        crossing_points = self._to_compositions((1-t.reshape(-1,1))*a + t.reshape(-1,1)*b)
+
+        # index of the crossing point on each crossing edge of the simplices that are cut
+        point_ids = -1*np.ones(crossing.shape, dtype=int)
+        point_ids[crossing] = edge_ids.ravel()
+        point_ids = point_ids[cut]
+
+        if self.dimension==3:
+            segments = np.sort(point_ids, axis=1)[:,1:]
+            self.polylines = [crossing_points[line] for line in _join_segments(segments)]
+        else:
+            self.vertices = crossing_points
+            self.faces = _march_tetrahedra(point_ids, unstable[self.simplices[cut]], pairs)
+
+        self.is_solved = True
+
+        return
+
+    def plot(self, ax=None, **kwargs):
+        """ Plot the spinodal curves of a ternary system on a mpltern axis (kwargs are passed to `ax.plot`) """
+        import matplotlib.pyplot as plt
+        from .visuals import _set_axislabels_mpltern
+        if not self.is_solved:
+            raise RuntimeError('Spinodal is not computed\n'
+                               'Use .compute() before plotting it')
+        if self.dimension!=3:
+            raise Exception('Only spinodals of ternary systems can be plotted')
+        if ax is None:
+            fig, ax = plt.subplots(subplot_kw={'projection':'ternary'})
+        kwargs.setdefault('color', 'k')
+        kwargs.setdefault('ls', '--')
+        for i, line in enumerate(self.polylines):
+            ax.plot(line[:,2], line[:,0], line[:,1], label='spinodal' if i==0 else None, **kwargs)
+        _set_axislabels_mpltern(ax)
+
+        return ax
+
+def _join_segments(segments):
+    """ Join segments (array of shape (num_segments, 2)) sharing end points into chains of point indices """
+    neighbors = defaultdict(list)
+    for i, j in segments:
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+    # open chains start at points with a single neighbor, the rest are closed loops
+    starts = [p for p in neighbors if len(neighbors[p])==1] + list(neighbors)
+    visited = set()
+    lines = []
+    for start in starts:
+        if start in visited:
+            continue
+        line = [start]
+        visited.add(start)
+        while True:
+            following = [p for p in neighbors[line[-1]] if p not in visited]
+            if not following:
+                break
+            line.append(following[0])
+            visited.add(following[0])
+        if len(neighbors[start])>1 and start in neighbors[line[-1]] and len(line)>2:
+            line.append(start)
+        lines.append(np.asarray(line))
+
+    return lines
+
+def _march_tetrahedra(point_ids, unstable, pairs):
+    """ Triangles of the zero level set in tetrahedra given the crossing point ids on their six edges """
+    edge_index = {tuple(p):k for k,p in enumerate(pairs)}
+    faces = []
+    for ids, flags in zip(point_ids, unstable):
+        cut_edges = np.where(ids>=0)[0]
+        if len(cut_edges)==3:
+            faces.append(ids[cut_edges])
+        else:
+            # two vertices on either side: the four crossings form a quadrilateral whose 
+            # consecutive edges share a vertex of the tetrahedra
+            (g0, g1), (l0, l1) = np.where(flags==flags[0])[0], np.where(flags!=flags[0])[0]
+            quad = [ids[edge_index[tuple(sorted(e))]] for e in [(g0,l0), (g1,l0), (g1,l1), (g0,l1)]]
+            faces.append([quad[0], quad[1], quad[2]])
+            faces.append([quad[0], quad[2], quad[3]])
+
+    return np.asarray(faces, dtype=int).reshape(-1,3)
@@ -3,15 +3,19 @@ from matplotlib.cm import ScalarMappable
 from matplotlib import colors
 from collections import Counter
 import pdb
-import polyphase as phase
 
 import matplotlib.pyplot as plt
 import mpltern
 import numpy as np
 from scipy.spatial.distance import pdist, cdist
-from itertools import combinations
+from itertools import combinations, product
 from .visuals import _set_axislabels_mpltern
+from .utils import batch_energy, lazy_remote
+from ._phase import is_boundary_point
 from scipy.spatial import Delaunay
+import pandas as pd
+import time
+from collections import defaultdict
 
 import re
 FLAT_SIMPLEX_ERROR = 'Initial simplex is flat' 
@@ -34,8 +38,8 @@ def inpolyhedron(ph,points):
      
 class CentralDifference:
     """Compute central difference gradinet of energy
-    Works only for a 3-dimensional grid or a ternary system
-    given the energy function
+    with respect to the first dim-1 volume fractions of a system of any dimension 
+    (the last one being 1-sum(others)) given the energy function
     """
     def __init__(self, energy):
         if callable(energy):
@@ -45,20 +49,43 @@ class CentralDifference:
 
     def __call__(self,phi, h = 1e-3):
         """
-        x,y : coordinates (float)
+        phi : composition (list or array of length dim) or compositions as an array of shape (num_points, dim)
         h   : gridspacing (float)
-
+        
+        returns gradient as a list of length dim-1 for a single composition and 
+        an array of shape (num_points, dim-1) otherwise
+        """
+        phi = np.asarray(phi, dtype=float)
+        if phi.ndim==1:
+            return list(self.batch(phi.reshape(1,-1), h=h)[0])
+        
+        return self.batch(phi, h=h)
+    
+    def get_stencil(self, X, h = 1e-3):
+        """Central difference stencil of compositions X (array of shape (num_points, dim))
+        
+        Each of the dim-1 directions moves a volume fraction by +/-h and the last one by -/+h
+        to stay on the simplex.
+        
+        returns array of shape (num_points*2*(dim-1), dim) ordered by points, directions and then signs
         """
-        p1,p2,p3 = phi
-        f_right = self.func([p1+h,p2,1-p1-h-p2])
-        f_left = self.func([p1-h,p2,1-p1+h-p2])
-        df_dx = (f_right - f_left)/(2*h)
+        X = np.asarray(X, dtype=float)
+        dim = X.shape[1]
+        steps = np.hstack((h*np.identity(dim-1), -h*np.ones((dim-1,1))))
+        steps = np.stack((steps, -steps), axis=1)
         
-        f_right = self.func([p1,p2+h,1-p1-h-p2])
-        f_left = self.func([p1,p2-h,1-p1+h-p2])
-        df_dy = (f_right - f_left)/(2*h)
+        return (X[:,np.newaxis,np.newaxis,:] + steps).reshape(-1, dim)
+    
+    def batch(self, X, h = 1e-3):
+        """Gradients at compositions X (array of shape (num_points, dim)) using a single 
+        batched energy evaluation of the stencil (see `get_stencil`)
+        
+        returns an array of shape (num_points, dim-1)
+        """
+        X = np.asarray(X, dtype=float)
+        f = batch_energy(self.func, self.get_stencil(X, h=h)).reshape(X.shape[0], X.shape[1]-1, 2)
         
-        return [df_dx, df_dy]
+        return (f[...,0] - f[...,1])/(2*h)
 
 class base:
     def __init__(self,engine, phase=2,simplex_id= None):
@@ -117,7 +144,7 @@ class base:
         """
         
         fig, ax = plt.subplots(subplot_kw={'projection':'3d'})
-        self.boundary_points= np.asarray([phase.is_boundary_point(x) for x in self.grid.T])
+        self.boundary_points= np.asarray([is_boundary_point(x) for x in self.grid.T])
 
         poly = Poly3DCollection(self.parametric_points,  alpha=1.0, lw=1.0, 
                                 facecolors=['tab:gray'], edgecolors=['k'])
@@ -257,23 +284,38 @@ class TestEpiGraph(base):
         super().__init__(engine,phase=phase,simplex_id=simplex_id,**kwargs)
         self.f = engine.energy_func
         
-    def is_epigraph(self):
-        self.ABC = self._get_plane_equation()
-        results = []
-        for point in self.interval.T:
-            f_actual = self.f(point)
-            f_convex = self._get_convex_energy(point)
+    def is_epigraph(self, all_simplices=False, rtol=1e-5, atol=1e-8):
+        """ Whether the energy at the points lies above the plane of the simplex (the epigraph)
+        
+        Inputs:
+        -------
+            all_simplices : whether to check every point of the grid against planes of all the lower hull 
+                            simplices (see `get_epigraph_violations`) instead of the points inside the 
+                            chosen simplex. Passing this test certifies that the lower hull is convex 
+                            and supports the energy landscape everywhere (default, False)
+            rtol, atol    : tolerances of the violation relative to the energy (as in `numpy.isclose`)
             
-            is_lower_envelope = np.greater_equal(f_actual,f_convex)
-            if not is_lower_envelope:
-                if np.isclose(f_actual, f_convex):
-                    is_lower_envelope = True
-                else:
-                    print(point, f_actual, f_convex)
-                
-            results.append(is_lower_envelope)
+        Attributes:
+        -----------
+            violations_ : magnitude of points below the plane(s) (zero if above) as an array of shape (num_points,)
+        """
+        if all_simplices:
+            self.violations_, f_actual = get_epigraph_violations(self.engine, return_energy=True)
+        else:
+            self.violations_, f_actual = self.get_violations()
+        
+        return bool(np.all(self.violations_<=atol+rtol*np.abs(f_actual)))
+    
+    def get_violations(self):
+        """ Violations of the epigraph for the points inside the simplex
+        
+        returns violations and energies of the points inside the simplex as arrays of shape (num_points,)
+        """
+        self.ABC = self._get_plane_equation()
+        f_actual = batch_energy(self.f, self.interval.T)
+        f_convex = self._get_convex_energy(self.interval)
         
-        return np.asarray(results).all()
+        return np.maximum(f_convex-f_actual, 0.0), f_actual
 
     def _get_plane_equation(self):
         A = np.asarray(self.parametric_points)
@@ -284,7 +326,7 @@ class TestEpiGraph(base):
     
     def _get_convex_energy(self, point):
         """Return energy approximated by the convex hull 
-        at a given composition
+        at a given composition (or compositions as an array of shape (dim, num_points))
         
         """
         return (1/self.ABC[2])*(1-self.ABC[0]*point[0]-self.ABC[1]*point[1])
@@ -298,8 +340,9 @@ class TestEpiGraph(base):
         
         fig, ax = self.base_visualize()
         
-        f_actual = [self.f(p) for p in self.interval.T]
-        f_convex = [self._get_convex_energy(p) for p in self.interval.T]
+        self.ABC = self._get_plane_equation()
+        f_actual = batch_energy(self.f, self.interval.T)
+        f_convex = self._get_convex_energy(self.interval)
         ax.plot_trisurf(self.interval[0,:], self.interval[1,:], f_actual,
                                  linewidth=0.01, antialiased=True, fc = 'tab:blue')
         #ax.scatter(self.interval[0,:], self.interval[1,:], f_actual, label='Energy function')
@@ -308,6 +351,48 @@ class TestEpiGraph(base):
         
         return fig, ax
     
+def get_epigraph_violations(engine, points=None, chunksize=2**22, return_energy=False):
+    """Violations of the epigraph for the planes of all the lower hull simplices at once
+    
+    Every plane of a lower convex hull is a supporting plane of the energy landscape, thus no point of the 
+    landscape can lie below any of them. Heights of all the planes at all the points are computed using 
+    matrix products (in chunks of `chunksize` entries) and the largest one is compared to the energy.
+    
+    Inputs:
+    -------
+        engine     : a polyphase.PHASE instance solved for phase diagram
+        points     : compositions to be tested as an array of shape (dim, num_points) whose energy is computed 
+                     using engine.energy_func (default, None i.e. grid points with the energy used to compute the hull)
+        chunksize  : maximum number of plane heights computed at once
+        return_energy : whether to also return the energy of the points (default, False)
+        
+    returns violations (height of the highest plane above the energy, zero if below) as an array of 
+    shape (num_points,)
+    """
+    from ._phase import _nondegenerate, get_plane_equations
+    
+    simplices = np.asarray(engine.simplices, dtype=int).reshape(-1, engine.dimension)
+    simplices = simplices[_nondegenerate(engine.grid, simplices)]
+    landscape = np.concatenate((engine.grid[:-1,:].T, engine.energy.reshape(-1,1)), axis=1)
+    equations = get_plane_equations(landscape, simplices)
+    normals = equations[:,:-2]/(-equations[:,-2:-1])
+    offsets = equations[:,-1]/(-equations[:,-2])
+    
+    if points is None:
+        X, energy = engine.grid[:-1,:].T, engine.energy
+    else:
+        X, energy = points[:-1,:].T, batch_energy(engine.energy_func, points.T)
+    violations = np.zeros(len(X))
+    step = max(1, chunksize//max(len(simplices),1))
+    for start in range(0, len(X), step):
+        heights = X[start:start+step]@normals.T + offsets
+        violations[start:start+step] = np.max(heights, axis=1, initial=-np.inf) - energy[start:start+step]
+    violations = np.maximum(violations, 0.0)
+    
+    if return_energy:
+        return violations, energy
+    
+    return violations
 
 class TestPhaseSplits(base):
     """Test if a simplex splits the points according to its labels
@@ -400,9 +485,15 @@ class TestPhaseSplits(base):
         
         return np.isclose(a,b, atol=1e-2), a,b
 
-    def run(self):
+    def run(self, sample_size=None, seed=None):
         """Check if a simplex phase splits all points inside correctlty
         
+        Inputs:
+        -------
+            sample_size : number of points inside the simplex drawn at random to be tested 
+                          (default, None i.e. all the points)
+            seed        : seed of the random selection of points (default, None)
+        
         Attributes:
         -----------
             results              : boolean list indexed by points inside the simplex if 
@@ -413,6 +504,9 @@ class TestPhaseSplits(base):
         results = []
         self.non_matching_splits_ = []
         self.matching_splits_ = []
+        if sample_size is not None and sample_size<self.interval.shape[1]:
+            rng = np.random.default_rng(seed)
+            self.interval = self.interval[:,rng.choice(self.interval.shape[1], sample_size, replace=False)]
         for p in self.interval.T:
             x, _, _ = self.engine(p)
             is_match = self.is_correct_phasesplit(x)
@@ -477,4 +571,350 @@ class TestPhaseSplits(base):
     
     
     
-    
\ No newline at end of file
+    
+def get_phase_splits(energy_func, vertices, points):
+    """Least squares phase splits (bounded to [0,1]) of points in simplices as in `PHASE.get_phase_compositions`
+    
+    Inputs:
+    -------
+        energy_func : energy function of the phase diagram
+        vertices    : compositions of simplex vertices as an array of shape (num_points, dim, dim)
+        points      : compositions to be split one per simplex as an array of shape (num_points, dim)
+        
+    returns splits as an array of shape (num_points, dim)
+    """
+    from scipy.optimize import lsq_linear
+    
+    num_points, dim = points.shape
+    energies = batch_energy(energy_func, vertices.reshape(-1,dim)).reshape(-1,dim)
+    A = np.concatenate((np.transpose(vertices[:,:,:-1], (0,2,1)), energies[:,np.newaxis,:], 
+                        np.ones((num_points,1,dim))), axis=1)
+    B = np.hstack((points[:,:-1], batch_energy(energy_func, points).reshape(-1,1), np.ones((num_points,1))))
+    splits = np.einsum('sij,sj->si', np.linalg.pinv(A), B)
+    
+    # only the solutions out of bounds need a bounded least squares
+    out_of_bounds = np.where(np.logical_or(splits<0, splits>1).any(axis=1))[0]
+    if len(out_of_bounds)>0 and 3**dim<=729:
+        splits[out_of_bounds] = _bounded_lstsq(A[out_of_bounds], B[out_of_bounds])
+    else:
+        for i in out_of_bounds:
+            splits[i] = lsq_linear(A[i], B[i], bounds=(np.zeros(dim), np.ones(dim)), lsmr_tol='auto').x
+    
+    return splits
+
+def _bounded_lstsq(A, B, tol=1e-12):
+    """ Least squares solutions of A x = B with 0<=x<=1 for a stack of small systems
+    
+    The solution of a bounded least squares is the unconstrained solution on one of the faces of the box 
+    where each variable is either free, 0 or 1. All the 3^n faces are solved at once and the feasible 
+    solution with the smallest residual is chosen.
+    """
+    num_systems, _, n = A.shape
+    best = np.zeros((num_systems, n))
+    best_residual = np.full(num_systems, np.inf)
+    for face in product([None, 0.0, 1.0], repeat=n):
+        free = np.asarray([f is None for f in face])
+        fixed = np.asarray([0.0 if f is None else f for f in face])
+        rhs = B - A@fixed
+        x = np.einsum('sij,sj->si', np.linalg.pinv(A*free), rhs)*free + fixed
+        residual = np.linalg.norm(np.einsum('sij,sj->si', A, x)-B, axis=1)
+        feasible = np.logical_and(x>=-tol, x<=1+tol).all(axis=1)
+        better = np.logical_and(feasible, residual<best_residual)
+        best[better] = x[better]
+        best_residual[better] = residual[better]
+        
+    return np.clip(best, 0, 1)
+
+def is_correct_phasesplit(splits, num_comps, threshold):
+    """Array version of `TestPhaseSplits.is_correct_phasesplit`
+    
+    Two-phase splits need at least one insignificant split ratio, three or more phases need all 
+    the split ratios to be significant. Single phase splits are not tested (False).
+    
+    returns boolean array of shape (num_points, )
+    """
+    num_comps = np.asarray(num_comps)
+    match = np.zeros(len(splits), dtype=bool)
+    two_phase = num_comps==2
+    match[two_phase] = (splits[two_phase]<threshold).any(axis=1)
+    many_phase = num_comps>2
+    match[many_phase] = (splits[many_phase]>threshold).all(axis=1)
+    
+    return match
+    
+class TestSimplices:
+    """Perform the tangent plane and phase splitting tests on all the simplices at once
+    
+    Array version of `TestAngles` and `TestPhaseSplits.check_centroid` applied to every simplex of a 
+    solved `polyphase.PHASE` in any dimension.
+    
+    Inputs:
+    -------
+        engine    : a polyphase.PHASE instance solved for phase diagram
+        gradient  : (callable) gradient of the energy with respect to the first dim-1 volume fractions 
+                    for an array of compositions of shape (num_points, dim) 
+                    (default, `FloryHuggins.gradient` if available or central differences)
+        threshold : Threshold value to consider any phase split ratio to be insignificant (default, 0.05)
+        
+    Methods:
+    --------
+        get_dot_products : absolute cosines between the facet normal and tangent plane normals at simplex vertices
+        get_centroid_splits : phase splits of the simplex centroids
+        run : returns both the tests as a pandas.DataFrame, one row per simplex (empty for diagrams certified 
+              miscible with `prescreen`, which do not have a hull)
+    """
+    def __init__(self, engine, gradient=None, threshold=0.05):
+        self.engine = engine
+        self.threshold = threshold
+        if gradient is None:
+            if hasattr(engine.energy_func, 'gradient'):
+                gradient = engine.energy_func.gradient
+            else:
+                gradient = CentralDifference(engine.energy_func).batch
+        self.gradient = gradient
+        self.simplices = np.asarray(engine.simplices, dtype=int).reshape(-1, engine.dimension)
+        self.num_comps = np.asarray(engine.num_comps, dtype=int)
+        # compositions of simplex vertices as an array of shape (num_simplices, dim, dim)
+        self.vertices = np.transpose(engine.grid[:,self.simplices], (1,2,0))
+        
+    def get_dot_products(self):
+        """ returns array of shape (num_simplices, dim) """
+        if len(self.simplices)==0:
+            # diagrams certified miscible do not have a hull
+            return np.zeros((0, self.engine.dimension))
+        facet_equations = self.engine.hull.equations[~np.asarray(self.engine.upper_hull, dtype=bool)]
+        facet_normals = facet_equations[:,:-1]/np.linalg.norm(facet_equations[:,:-1], axis=1, keepdims=True)
+        
+        unique_vertices, inverse = np.unique(self.simplices, return_inverse=True)
+        gradients = np.asarray(self.gradient(self.engine.grid[:,unique_vertices].T))
+        tangent_normals = np.hstack((-gradients, np.ones((len(unique_vertices),1))))
+        tangent_normals /= np.linalg.norm(tangent_normals, axis=1, keepdims=True)
+        tangent_normals = tangent_normals[inverse.reshape(self.simplices.shape)]
+        
+        return np.abs(np.einsum('sj,svj->sv', facet_normals, tangent_normals))
+    
+    def get_centroid_splits(self):
+        """ Least squares phase splits of the simplex centroids (see `get_phase_splits`)
+        
+        returns array of shape (num_simplices, dim) 
+        """
+        if len(self.simplices)==0:
+            return np.zeros((0, self.engine.dimension))
+        return get_phase_splits(self.engine.energy_func, self.vertices, self.vertices.mean(axis=1))
+    
+    def _min_edge_lengths_equal(self):
+        """ whether the centroid is equidistant to the vertices of the shortest edge (see `TestPhaseSplits`) """
+        pairs = np.asarray(list(combinations(range(self.engine.dimension), 2)))
+        v = self.vertices[:,:,:-1]
+        edge_lengths = np.linalg.norm(v[:,pairs[:,0],:]-v[:,pairs[:,1],:], axis=2)
+        shortest = pairs[np.argmin(edge_lengths, axis=1)]
+        centroids = v.mean(axis=1)
+        rows = np.arange(len(v))
+        a = np.linalg.norm(v[rows,shortest[:,0],:]-centroids, axis=1)
+        b = np.linalg.norm(v[rows,shortest[:,1],:]-centroids, axis=1)
+        
+        return np.isclose(a, b, atol=1e-2)
+    
+    def run(self):
+        """
+        returns pandas.DataFrame indexed by simplex id with columns:
+            'num_comps'          : label of the simplex
+            'flat'               : whether the simplex is flat in the composition space (tests are not valid)
+            'dot_product_<i>'    : absolute cosine between facet normal and tangent plane normal at vertex i
+            'min_dot_product'    : smallest of the above
+            'split_<i>'          : phase split of the centroid to the vertex i
+            'centroid_match'     : whether the centroid splits match the label (2-phase simplices need at least
+                                   one insignificant split, 3 or more phases need all the splits to be significant)
+        """
+        from ._phase import _simplex_volumes
+        
+        dim = self.engine.dimension
+        volumes = _simplex_volumes(self.engine.grid, self.simplices)
+        dot_products = self.get_dot_products()
+        splits = self.get_centroid_splits()
+        
+        match = is_correct_phasesplit(splits, self.num_comps, self.threshold)
+        two_phase = self.num_comps==2
+        match[two_phase] = np.logical_or(match[two_phase], self._min_edge_lengths_equal()[two_phase])
+        
+        results = {'num_comps' : self.num_comps, 
+                   'flat' : volumes<=1e-10*max(np.max(volumes, initial=0), 1e-300)}
+        for i in range(dim):
+            results['dot_product_{}'.format(i)] = dot_products[:,i]
+        results['min_dot_product'] = dot_products.min(axis=1, initial=1.0)
+        for i in range(dim):
+            results['split_{}'.format(i)] = splits[:,i]
+        results['centroid_match'] = np.where(self.num_comps>1, match, None)
+        self.results_ = pd.DataFrame(results)
+        
+        return self.results_
+
+def wilson_interval(num_passed, num_samples, confidence=0.95):
+    """ Wilson score interval of a pass rate, returns (lower, upper) """
+    from scipy.stats import norm
+    
+    if num_samples==0:
+        return 0.0, 1.0
+    z = norm.ppf(0.5+0.5*confidence)
+    p = num_passed/num_samples
+    center = (p + z**2/(2*num_samples))/(1 + z**2/num_samples)
+    halfwidth = (z/(1 + z**2/num_samples))*np.sqrt(p*(1-p)/num_samples + z**2/(4*num_samples**2))
+    
+    return max(center-halfwidth, 0.0), min(center+halfwidth, 1.0)
+
+def stratified_wilson_interval(num_passed, num_samples, weights, confidence=0.95):
+    """ Wilson score interval of a stratified pass rate sum_l weights[l]*num_passed[l]/num_samples[l]
+    
+    Uses the effective number of samples p(1-p)/variance of the stratified estimate (equal to the number 
+    of samples for a single stratum), with a continuity correction of the pass rates of the strata so 
+    that strata with all samples passed (or failed) still have a variance. returns (lower, upper)
+    """
+    num_passed, num_samples = np.asarray(num_passed, dtype=float), np.asarray(num_samples, dtype=float)
+    weights = np.asarray(weights, dtype=float)/np.sum(weights)
+    if np.any(num_samples==0):
+        return 0.0, 1.0
+    p = np.sum(weights*num_passed/num_samples)
+    p_corrected = (num_passed+0.5)/(num_samples+1)
+    variance = np.sum(weights**2*p_corrected*(1-p_corrected)/num_samples)
+    p_mean = np.sum(weights*p_corrected)
+    num_effective = p_mean*(1-p_mean)/variance
+    
+    return wilson_interval(p*num_effective, num_effective, confidence)
+
+class TestSampledSplits:
+    """Statistical version of `TestPhaseSplits.run` over the whole phase diagram
+    
+    Draws simplices stratified by their phase labels (two or more phases) and uniformly random points 
+    inside them, and checks whether the simplex splits the points according to its label, until a time 
+    budget is spent or the confidence interval of the pass rate is narrow enough.
+    
+    Each label gets an equal share of the samples and its simplices are drawn proportional to their volume, 
+    so that points are uniform within the region of the label. The pass rate of the diagram, i.e. the 
+    fraction of the multi-phase region passing, weights the pass rate of each label by its share of the area.
+    
+    Inputs:
+    -------
+        engine    : a polyphase.PHASE instance solved for phase diagram
+        threshold : Threshold value to consider any phase split ratio to be insignificant (default, 0.05)
+        seed      : seed of the random sampling (default, None)
+        
+    Methods:
+    --------
+        draw : draw random simplices and points inside them
+        run  : test batches of samples and report the pass rate
+    """
+    def __init__(self, engine, threshold=0.05, seed=None):
+        from ._phase import _simplex_volumes
+        
+        self.engine = engine
+        self.threshold = threshold
+        self.rng = np.random.default_rng(seed)
+        self.simplices = np.asarray(engine.simplices, dtype=int).reshape(-1, engine.dimension)
+        self.num_comps = np.asarray(engine.num_comps, dtype=int)
+        volumes = _simplex_volumes(engine.grid, self.simplices)
+        valid = np.logical_and(volumes>1e-10*np.max(volumes, initial=0), self.num_comps>1)
+        self.strata = {label: np.where(np.logical_and(valid, self.num_comps==label))[0] 
+                       for label in np.unique(self.num_comps[valid])}
+        if len(self.strata)==0:
+            raise RuntimeError('No multi-phase simplices to test')
+        self.probabilities = {label : volumes[ids]/volumes[ids].sum() for label, ids in self.strata.items()}
+        areas = np.array([volumes[ids].sum() for ids in self.strata.values()])
+        self.weights = dict(zip(self.strata.keys(), areas/areas.sum()))
+        
+    def draw(self, size):
+        """ returns simplex ids (size, ) and points (size, dim) drawn equally from each phase label """
+        labels = list(self.strata.keys())
+        per_label = np.full(len(labels), size//len(labels))
+        per_label[:size%len(labels)] += 1
+        simplex_ids = np.concatenate([self.rng.choice(self.strata[l], n, p=self.probabilities[l]) 
+                                      for l,n in zip(labels, per_label)])
+        weights = self.rng.dirichlet(np.ones(self.engine.dimension), size=size)
+        vertices = np.transpose(self.engine.grid[:,self.simplices[simplex_ids]], (1,2,0))
+        
+        return simplex_ids, np.einsum('sv,svd->sd', weights, vertices)
+    
+    def run(self, time_budget=10.0, target_halfwidth=0.01, confidence=0.95, batch_size=256, 
+            use_parallel=False, max_samples=None):
+        """
+        Inputs:
+        -------
+            time_budget      : wall-clock time in seconds after which the sampling is stopped (default, 10)
+            target_halfwidth : sampling stops when the confidence interval is narrower than twice this (default, 0.01)
+            confidence       : confidence level of the (stratified) Wilson interval of the pass rate (default, 0.95)
+            batch_size       : number of samples tested at once (per worker) (default, 256)
+            use_parallel     : whether to test batches on ray workers (default, False)
+            max_samples      : maximum number of samples (default, None)
+            
+        returns a dictonary with keys:
+            'pass_rate' (area weighted over the labels), 'interval' (lower, upper), 'num_samples', 'num_passed',
+            'per_label' (dictonary of label : (num_samples, pass_rate)), 'weights' (dictonary of label : 
+            share of the area), 'elapsed' (s), 'throughput' (samples per second)
+        """
+        if use_parallel:
+            import ray
+            # only shut down a ray runtime started here
+            started = not ray.is_initialized()
+            ray.init(ignore_reinit_error=True)
+            num_workers = max(1, int(ray.available_resources().get('CPU', 1)))
+            energy_func_ray = ray.put(self.engine.energy_func)
+        since = time.time()
+            
+        passed = defaultdict(int)
+        counts = defaultdict(int)
+        while True:
+            if use_parallel:
+                draws = [self.draw(batch_size) for _ in range(num_workers)]
+                futures = [ray_check_phase_splits.remote(energy_func_ray, self._vertices(ids), points, 
+                                                         self.num_comps[ids], self.threshold) for ids, points in draws]
+                results = zip([ids for ids,_ in draws], ray.get(futures))
+            else:
+                ids, points = self.draw(batch_size)
+                results = [(ids, check_phase_splits(self.engine.energy_func, self._vertices(ids), points, 
+                                                    self.num_comps[ids], self.threshold))]
+            for ids, match in results:
+                for label in self.strata:
+                    in_label = self.num_comps[ids]==label
+                    counts[label] += int(np.sum(in_label))
+                    passed[label] += int(np.sum(match[in_label]))
+            
+            labels = list(self.strata.keys())
+            num_samples, num_passed = sum(counts.values()), sum(passed.values())
+            lower, upper = stratified_wilson_interval([passed[l] for l in labels], [counts[l] for l in labels], 
+                                                      [self.weights[l] for l in labels], confidence)
+            elapsed = time.time()-since
+            if elapsed>time_budget or 0.5*(upper-lower)<=target_halfwidth:
+                break
+            if max_samples is not None and num_samples>=max_samples:
+                break
+        if use_parallel:
+            del energy_func_ray
+            if started:
+                ray.shutdown()
+        
+        per_label = {label : (counts[label], passed[label]/max(counts[label],1)) for label in labels}
+        self.results_ = {'pass_rate' : sum(self.weights[l]*per_label[l][1] for l in labels), 
+                         'interval' : (lower, upper),
+                         'num_samples' : num_samples, 
+                         'num_passed' : num_passed,
+                         'per_label' : per_label,
+                         'weights' : self.weights,
+                         'elapsed' : elapsed, 
+                         'throughput' : num_samples/max(elapsed, 1e-12)}
+        
+        return self.results_
+    
+    def _vertices(self, simplex_ids):
+        return np.transpose(self.engine.grid[:,self.simplices[simplex_ids]], (1,2,0))
+    
+def check_phase_splits(energy_func, vertices, points, num_comps, threshold):
+    """ whether simplices with vertices (num_points, dim, dim) split the points (num_points, dim) according 
+    to their labels `num_comps` (see `get_phase_splits` and `is_correct_phasesplit`)
+    """
+    splits = get_phase_splits(energy_func, vertices, points)
+    
+    return is_correct_phasesplit(splits, num_comps, threshold)
+
+@lazy_remote
+def ray_check_phase_splits(energy_func, vertices, points, num_comps, threshold):
+    return check_phase_splits(energy_func, vertices, points, num_comps, threshold)
+
@@ -1,8 +1,6 @@
 import numpy as np
 import pdb
 from itertools import combinations
-from scipy.spatial import Delaunay
-from scipy.constants import gas_constant
 
 import time
 
@@ -16,6 +14,38 @@ class timer:
 
         return "{:0>2} Hr:{:0>2} min:{:05.2f} sec".format(int(hours),int(minutes),seconds)
 
+class LazyRemoteFunction:
+    """ A `ray.remote` function that imports ray and registers the function only on its first use 
+    so that importing a module with remote functions does not import ray
+    
+    Attributes (such as `.remote` and `.options`) are those of the ray remote function.
+    """
+    def __init__(self, func, **options):
+        self.func = func
+        self.options_ = options
+        self._remote_function = None
+        self.__doc__ = func.__doc__
+        self.__name__ = func.__name__
+        
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ['func', 'options_', '_remote_function']:
+            raise AttributeError(name)
+        if self._remote_function is None:
+            import ray
+            if self.options_:
+                self._remote_function = ray.remote(**self.options_)(self.func)
+            else:
+                self._remote_function = ray.remote(self.func)
+        
+        return getattr(self._remote_function, name)
+    
+def lazy_remote(*args, **options):
+    """ Decorator used as `ray.remote` (with or without options) returning a `LazyRemoteFunction` """
+    if len(args)==1 and callable(args[0]) and not options:
+        return LazyRemoteFunction(args[0])
+    
+    return lambda func : LazyRemoteFunction(func, **options)
+
 def _utri2mat(utri, dimension):
     """ convert list of chi values to a matrix form """
     inds = np.triu_indices(dimension,1)
@@ -58,6 +88,89 @@ def flory_huggins(x, M,chi,beta=0.0, logapprox=False):
     
     return T1+T2  
         
+class FloryHuggins:
+    """ Flory-Huggins free energy with closed form derivatives evaluated on arrays of compositions
+    
+    parameters:
+    -----------
+        M    :  Degree of polymerization
+        chi  :  flory-huggins interaction parameters as a list of (nCdim)
+        beta :  Coefficients the beta correction term (default, 0.0)
+        
+    Methods:
+    --------
+        __call__  :  Energy of a composition as a list (dim, ) same as `flory_huggins`
+        batch     :  Energies of compositions as an array of shape (num_points, dim)
+        gradient  :  Gradient of the energy 
+        hessian   :  Hessian of the energy
+        
+    Derivatives are taken either with respect to all the volume fractions (reduced=False) or 
+    to the first dim-1 of them with the last one given by 1-sum(others) (reduced=True). 
+    The reduced gradient is the one approximated by `polyphase.CentralDifference`.
+    
+    Example:
+    --------
+        >>> fh = polyphase.FloryHuggins([5,5,1], [1,0.5,0.5])
+        >>> engine = polyphase.PHASE(fh, 100, 3)
+        >>> dx, dy = fh.gradient([0.45,0.45,0.1])
+    """
+    def __init__(self, M, chi, beta=0.0):
+        self.M = np.asarray(M, dtype=float)
+        self.chi = chi
+        self.beta = beta
+        self.CHI = _utri2mat(chi, len(M))
+        
+    def __call__(self, x):
+        return self.batch(np.asarray(x, dtype=float).reshape(1,-1))[0]
+    
+    def batch(self, X):
+        X = np.asarray(X, dtype=float)
+        T1 = np.sum(X*np.log(X)/self.M + self.beta/X, axis=-1)
+        T2 = 0.5*np.sum((X@self.CHI)*X, axis=-1)
+        
+        return T1+T2
+    
+    def _reduce(self, dim):
+        """ Jacobian of the volume fractions with respect to the first dim-1 of them """
+        return np.vstack((np.identity(dim-1), -np.ones((1,dim-1))))
+        
+    def gradient(self, X, reduced=True):
+        """
+        X : compositions as a list (dim, ) or an array of shape (num_points, dim)
+        
+        returns gradient of shape (dim, ) or (num_points, dim) ((dim-1) when reduced=True)
+        """
+        X = np.asarray(X, dtype=float)
+        grad = (np.log(X)+1)/self.M - self.beta/X**2 + X@self.CHI
+        if reduced:
+            grad = grad@self._reduce(X.shape[-1])
+            
+        return grad
+        
+    def hessian(self, X, reduced=True):
+        """
+        X : compositions as a list (dim, ) or an array of shape (num_points, dim)
+        
+        returns Hessian of shape (dim, dim) or (num_points, dim, dim) ((dim-1) when reduced=True)
+        """
+        X = np.asarray(X, dtype=float)
+        diagonal = 1/(self.M*X) + 2*self.beta/X**3
+        hess = diagonal[...,np.newaxis]*np.identity(X.shape[-1]) + self.CHI
+        if reduced:
+            P = self._reduce(X.shape[-1])
+            hess = P.T@hess@P
+            
+        return hess
+    
+def batch_energy(f, X):
+    """ Energies of compositions X (array of shape (num_points, dim)) using the vectorized 
+    `batch` method of the energy function `f` when it provides one (e.g. `FloryHuggins`) 
+    """
+    if hasattr(f, 'batch'):
+        return np.asarray(f.batch(X), dtype=float)
+    else:
+        return np.asarray([f(x) for x in X])
+        
 def polynomial_energy(x):
     """ Free energy using a polynomial function for ternary """
     
@@ -83,12 +196,14 @@ def _compute_chi(delta_i,delta_j,V):
     returns a scalar chi value
     
     """
+    from scipy.constants import gas_constant
     constant = 1.0 #4.184*(2.045**2)/(8.314)
     chi_ij =  0.34+(constant)*(V/(gas_constant*300)*( np.asarray(delta_i) - np.asarray(delta_j) )**2)
         
     return chi_ij
 
 def _compute_weighted_chi(vec1,vec2,V, W):
+    from scipy.constants import gas_constant
     value = 0.0
     for i,w  in enumerate(W):
         value += w*(vec1[i]-vec2[i])**2
@@ -118,7 +233,45 @@ def get_chi_vector(deltas, V0, approach=1):
         raise KeyError
         
     return chi, inds
-    
+
+def get_chi_table(solvents, polymer, small_molecule, V0, approach=1):
+    """
+    Computes binary interactions of chis for a library of ternary systems (polymer, small molecule, solvent)
+
+    Inputs:
+    =======
+        solvents       :  Hansen solubility parameters of the solvents as an array of shape (S, 3)
+        polymer        :  Hansen solubility parameters of the polymer as an array of shape (3,)
+        small_molecule :  Hansen solubility parameters of the small molecule as an array of shape (3,)
+        V0             :  Reference molar volume as a scalar or an array of shape (S,) e.g. solvent molar volumes
+        approach       :  approach used to compute chi (see `get_chi_vector`)
+
+    Outputs:
+    ========
+        chi values as an array of shape (S, 3) where each row is [(p,sm), (p, solv), (sm, solv)]
+        i.e. the row s equals `get_chi_vector([polymer, small_molecule, solvents[s]], V0[s], approach)[0]`
+    """
+    from scipy.constants import gas_constant
+    solvents = np.atleast_2d(np.asarray(solvents, dtype=float))
+    S = len(solvents)
+    deltas = np.stack([np.broadcast_to(np.asarray(polymer, dtype=float), (S,3)),
+                       np.broadcast_to(np.asarray(small_molecule, dtype=float), (S,3)),
+                       solvents], axis=1)
+    i, j = np.array(list(combinations(range(3), 2))).T
+
+    if approach==1:
+        norms = np.linalg.norm(deltas, axis=2)
+        value = (norms[:,i] - norms[:,j])**2
+    elif approach==2:
+        value = np.sum((deltas[:,i,:] - deltas[:,j,:])**2, axis=2)
+    elif approach==3:
+        value = np.sum(np.array([1.0,0.25,0.25])*(deltas[:,i,:] - deltas[:,j,:])**2, axis=2)
+    else:
+        raise KeyError
+    V = np.broadcast_to(np.asarray(V0, dtype=float), (S,)).reshape(-1,1)
+
+    return 0.34 + value*(V/(gas_constant*300))
+
 def get_sample_data(ind):
     if ind==0:
         M = [5,5,1]
@@ -6,9 +6,10 @@ import numpy as np
 import mpltern
 from matplotlib.cm import ScalarMappable
 from matplotlib import colors
-from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+from matplotlib.collections import PolyCollection
+from mpl_toolkits.mplot3d.art3d import Poly3DCollection, Line3DCollection
 
-from ._phase import is_boundary_point
+from ._phase import MIN_POINT_PRECISION
 
 def _set_axislabels_mpltern(ax):
     """ 
@@ -22,23 +23,32 @@ def _set_axislabels_mpltern(ax):
     ax.laxis.set_label_position('tick1')
     ax.raxis.set_label_position('tick1')   
 
-def plot_energy_landscape(outdict,mode='full', ax = None):
+def plot_energy_landscape(outdict,mode='full', ax = None, max_triangles=None, coplanar_tol=1e-6):
     """ Plots a convex hull of a energy landscape 
     
     parameters:
     -----------
-        outdict     :  polyphase.PHASE.as_dict()
+        outdict       :  polyphase.PHASE.as_dict()
+        max_triangles :  (int) level of detail as a budget of triangles to be plotted (default, None i.e. all).
+                         The surface is plotted on a coarse lattice with about max_triangles triangles:
+                         the landscape using the grid points nearest to the coarse lattice points (mode='full') and 
+                         the lower envelope of the convex hull planes at the coarse lattice points (mode='convex_hull')
+        coplanar_tol  :  tolerance on the unit plane equations used to merge connected coplanar facets 
+                         of the convex hull into polygons (mode='convex_hull')
     
     This function takes an optional argument in mode which can be used to 
     visualize the just the convex hull (mode='convex_hull') approximation instead
     By default it plots the triangulated energy landscape (mode='full')
     This function plots the energy landscape with a thin boundary 
     cut around the two phase composotions
+    
+    In the convex_hull mode, connected coplanar facets (e.g. of a three phase simplex split into many or 
+    a planar two phase region) are drawn as a single polygon with its outline.
     """
     grid = outdict['grid']
     assert grid.shape[0]==3, 'Expected a ternary system but got {}'.format(grid.shape[0])
 
-    boundary_points= np.asarray([is_boundary_point(x) for x in grid.T])
+    boundary_points = np.isclose(grid, MIN_POINT_PRECISION).any(axis=0)
     energy = outdict['energy']
  
     if ax is None:
@@ -47,19 +57,153 @@ def plot_energy_landscape(outdict,mode='full', ax = None):
     else:
         fig = plt.gcf()
         
-    if mode=='full':    
-        ax.plot_trisurf(grid[0,~boundary_points], grid[1,~boundary_points], 
-                        energy[~boundary_points], linewidth=0.01, antialiased=True)
+    if mode=='full':
+        if max_triangles is None:
+            ax.plot_trisurf(grid[0,~boundary_points], grid[1,~boundary_points], 
+                            energy[~boundary_points], linewidth=0.01, antialiased=True)
+        else:
+            # coarse lattice points snapped to the nearest grid points keep the energies of the landscape
+            from scipy.spatial import cKDTree
+            X, triangles = _get_lod_lattice(grid, max_triangles)
+            _, nearest = cKDTree(grid.T).query(X)
+            triangles = triangles[~np.any(boundary_points[nearest[triangles]], axis=1)]
+            ax.plot_trisurf(grid[0,nearest], grid[1,nearest], energy[nearest], triangles=triangles,
+                            linewidth=0.01, antialiased=True)
     elif mode=='convex_hull':
-        ax.plot_trisurf(grid[0,:], grid[1,:], 
-                        energy, triangles=outdict['simplices'], 
-                        linewidth=1.0,edgecolor='k', antialiased=False,facecolor='grey',alpha=0.05)
+        points = np.concatenate((grid[:-1,:].T,energy.reshape(-1,1)),axis=1)
+        triangles = np.asarray(outdict['simplices'], dtype=int).reshape(-1,3)
+        if max_triangles is not None and len(triangles)>max_triangles:
+            points, triangles = _get_lod_envelope(points, triangles, grid, max_triangles)
+        polygons, edges = _merge_coplanar_facets(points, triangles, tol=coplanar_tol)
+        ax.add_collection3d(Poly3DCollection([points[p] for p in polygons], facecolor='grey', edgecolor='none', alpha=0.05))
+        ax.add_collection3d(Line3DCollection(points[edges], colors='k', linewidths=1.0, alpha=0.05))
+        ax.auto_scale_xyz(points[:,0], points[:,1], points[:,2])
     ax.set_xlabel(r'$\phi_{1}$')
     ax.set_ylabel(r'$\phi_{2}$')
     ax.set_zlabel('Energy')
     
     return ax, fig    
+
+def _get_lod_lattice(grid, max_triangles):
+    """ Coarse lattice compositions (array of shape (num_points, 3)) and its triangles with at most
+    max_triangles triangles and no more points per dimension than the grid
+    """
+    from .spinodal import get_lattice_simplices
+    
+    meshsize = len(np.unique(grid[0,:].round(12)))
+    meshsize = max(2, min(meshsize, int(np.sqrt(max_triangles))+1))
+    counts, triangles = get_lattice_simplices(meshsize, 3)
+    
+    return counts/(meshsize-1), triangles
+
+def _get_lod_envelope(points, simplices, grid, max_triangles, chunksize=2**22):
+    """ Lower envelope of the planes of the hull simplices (i.e. the lower convex hull) evaluated on a coarse lattice
+    
+    returns points (array of shape (num_points, 3)) and triangles of the coarse lattice
+    """
+    from ._phase import get_plane_equations
+    
+    areas = np.abs(np.linalg.det(np.concatenate((points[simplices][:,:,:-1], 
+                                                 np.ones(simplices.shape+(1,))), axis=2)))
+    simplices = simplices[areas>1e-10*areas.max(initial=0)]
+    equations = get_plane_equations(points, simplices)
+    normals = equations[:,:-2]/(-equations[:,-2:-1])
+    offsets = equations[:,-1]/(-equations[:,-2])
+    X, triangles = _get_lod_lattice(grid, max_triangles)
+    X = np.clip(X, MIN_POINT_PRECISION, None)[:,:-1]
+    height = np.zeros(len(X))
+    step = max(1, chunksize//max(len(simplices),1))
+    for start in range(0, len(X), step):
+        height[start:start+step] = np.max(X[start:start+step]@normals.T + offsets, axis=1)
     
+    return np.concatenate((X, height.reshape(-1,1)), axis=1), triangles
+
+def _get_planes(points, triangles):
+    """ Unit plane equations (array of shape (num_triangles, 4)) of triangles with a consistent orientation
+
+    The normals are oriented by the sign of their last non zero component so that vertical triangles 
+    are also compared, returns a mask of the degenerate triangles (zero length normals) whose planes are nan
+    """
+    verts = points[triangles]
+    normals = np.cross(verts[:,1]-verts[:,0], verts[:,2]-verts[:,0])
+    lengths = np.linalg.norm(normals, axis=1)
+    degenerate = lengths<=1e-12*max(lengths.max(initial=0), 1e-300)
+    normals[~degenerate] /= lengths[~degenerate].reshape(-1,1)
+    normals[degenerate] = np.nan
+    nonzero = np.abs(normals)>1e-8
+    last = normals.shape[1]-1-np.argmax(nonzero[:,::-1], axis=1)
+    normals *= np.sign(normals[np.arange(len(normals)), last]).reshape(-1,1)
+    planes = np.hstack((normals, -np.sum(normals*verts[:,0], axis=1, keepdims=True)))
+
+    return planes, degenerate
+
+def _get_boundary_loop(edges):
+    """ Vertices of a single closed loop formed by edges (array of shape (num_edges, 2)) in order, 
+    None if the edges form more than one loop or a vertex is shared by more than two edges
+    """
+    vertices, degree = np.unique(edges, return_counts=True)
+    if np.any(degree!=2):
+        return None
+    neighbors = {v:[] for v in vertices}
+    for a, b in edges:
+        neighbors[a].append(b)
+        neighbors[b].append(a)
+    loop = [edges[0,0], edges[0,1]]
+    while len(loop)<len(edges):
+        a, b = neighbors[loop[-1]]
+        loop.append(b if a==loop[-2] else a)
+    if neighbors[loop[-1]][0]!=loop[0] and neighbors[loop[-1]][1]!=loop[0]:
+        return None
+
+    return np.asarray(loop)
+
+def _merge_coplanar_facets(points, triangles, tol=1e-6):
+    """ Merge connected coplanar triangles (indices into points of shape (num_points, 3)) into polygons
+
+    Triangles sharing an edge and whose unit plane equations agree within tol are merged. 
+    A merged region bounded by a single loop of edges is returned as one polygon and otherwise 
+    as its triangles (e.g. a region with a hole). Degenerate triangles are never merged.
+
+    returns list of polygons (arrays of vertex indices) and the edges not shared by merged triangles 
+    i.e. the outline of the polygons, as an array of shape (num_edges, 2)
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    planes, degenerate = _get_planes(points, triangles)
+    edges = np.sort(triangles[:,[[0,1],[1,2],[0,2]]].reshape(-1,2), axis=1)
+    unique_edges, inverse, counts = np.unique(edges, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    owners = np.argsort(inverse, kind='stable')//3
+    first = np.cumsum(counts)-counts
+    shared = np.where(counts==2)[0]
+    a, b = owners[first[shared]], owners[first[shared]+1]
+    coplanar = np.all(np.abs(planes[a]-planes[b])<=tol, axis=1) & ~degenerate[a] & ~degenerate[b]
+
+    num_triangles = len(triangles)
+    graph = csr_matrix((np.ones(coplanar.sum()), (a[coplanar], b[coplanar])), shape=(num_triangles, num_triangles))
+    _, component = connected_components(graph, directed=False)
+    # an edge is inside a merged region if both its triangles are in the same region
+    keep = np.ones(len(unique_edges), dtype=bool)
+    keep[shared[component[a]==component[b]]] = False
+
+    sizes = np.bincount(component)
+    polygons = list(triangles[sizes[component]==1])
+    merged = np.where(sizes>1)[0]
+    order = np.argsort(component, kind='stable')
+    bounds = np.cumsum(sizes)
+    edge_ids = inverse.reshape(-1,3)
+    for c in merged:
+        members = order[bounds[c]-sizes[c]:bounds[c]]
+        ids, num = np.unique(edge_ids[members].ravel(), return_counts=True)
+        loop = _get_boundary_loop(unique_edges[ids[num==1]])
+        if loop is None:
+            polygons.extend(triangles[members])
+        else:
+            polygons.append(loop)
+
+    return polygons, unique_edges[keep]
+
 def plain_phase_diagram(df, ax = None):
     """ 
     Plot phase diagrams as points without any labels or stuff
@@ -116,10 +260,16 @@ class TernaryPlot:
         
         phase_colors =['tab:red','tab:olive','tab:cyan']
         cmap = colors.ListedColormap(phase_colors)
-        for l,s in zip(self.engine.num_comps, self.engine.simplices):
-            simplex_points = np.asarray([self.engine.grid[:,x] for x in s])
-            ax.fill(simplex_points[:,2], simplex_points[:,0], simplex_points[:,1], 
-                    facecolor=phase_colors[int(l-1)])
+        # one collection per phase from the simplex vertices projected onto the axis in the order (x3, x1, x2)
+        simplices = np.asarray(self.engine.simplices, dtype=int).reshape(-1, 3)
+        num_comps = np.asarray(self.engine.num_comps, dtype=int)
+        tlr = self.engine.grid[[2,0,1],:].T
+        verts = ax.transProjection.transform(tlr)[simplices]
+        for l in np.unique(num_comps):
+            collection = PolyCollection(verts[num_comps==l], facecolors=phase_colors[l-1], 
+                                        edgecolors='face', linewidths=0.2, transform=ax.transData, 
+                                        label='{}-Phase'.format(l))
+            ax.add_collection(collection, autolim=False)
         if label:
             _set_axislabels_mpltern(ax)
         boundaries = np.linspace(1,4,4)
@@ -195,8 +345,8 @@ class QuaternaryPlot:
         ===========
             phase_colors     : colors used (and indexed) for each phase label 
             vertices         : Vertices of the tetrahedron outline
-            threed_coords    : Three dimensional embedding coordinates. 
-                               Avalaible only if the `.plot_points(*args,**kwargs)` method is called
+            threed_coords    : Three dimensional embedding coordinates of the points in engine.df
+            faces            : Faces of the simplices embedded in 3D as an array of shape (num_simplices, 4, 3, 3)
                                
         Examples:
         =========
@@ -228,11 +378,17 @@ class QuaternaryPlot:
                                 )
         self.phase_colors =['tab:red','tab:olive','tab:cyan','tab:purple']
         
-        self.threed_coords = []
-        for i,row in self.engine.df.T.iterrows():
-            self.threed_coords.append(self.from4d23d(row[:-1].to_list()))
-            
-        self.threed_coords = np.asarray(self.threed_coords)
+        df = self.engine.df.T
+        self.labels = df['label'].to_numpy()
+        self.phi4 = df['Phi_4'].to_numpy()
+        self.threed_coords = self.from4d23d(df.iloc[:,:4].to_numpy())
+        
+        # faces of all the simplices are embedded once and sliced using masks
+        simplices = np.asarray(self.engine.simplices, dtype=int).reshape(-1,4)
+        self.num_comps = np.asarray(self.engine.num_comps, dtype=int)
+        self.faces = self._get_convex_faces(self.from4d23d(self.engine.grid.T)[simplices])
+        self.simplex_phi4 = self.engine.grid[3,simplices].max(axis=1, initial=0)
+        self._slice_cache = {}
         
     
     def from4d23d(self,fourd_coords):
@@ -240,34 +396,46 @@ class QuaternaryPlot:
         
         Inputs:
         =======
-        fourd_coords  :  Four component composition as a list
+        fourd_coords  :  Four component composition as a list or compositions as an array of shape (num_points, 4)
         
         Outputs:
         ========
-            [u,v,w]   : 3D coordinates
+            [u,v,w]   : 3D coordinates (an array of shape (num_points, 3) for an array input)
             
         """
-        x,y,z,w = fourd_coords
-        u = y+0.5*(z+w)
-        v = np.sqrt(3)*(z/2 + w/6) 
-        w = np.sqrt(6)*(w/3)
+        fourd_coords = np.asarray(fourd_coords, dtype=float)
+        threed_coords = fourd_coords@self.vertices
+        if fourd_coords.ndim==1:
+            return threed_coords.tolist()
 
-        return [u,v,w]
+        return threed_coords
     
     def _get_convex_faces(self,v):
         """Return set of faces of tetrahedron simplex
         Inputs:
         =======
-            v.  :  Vertices of the simplex
+            v.  :  Vertices of the simplex (or simplices as an array of shape (num_simplices, 4, 3))
             
         Outputs:
         ========
-            verts  :  list of face vertices
+            verts  :  array of face vertices of shape (4, 3, 3) (or (num_simplices, 4, 3, 3))
             
         """
-        verts = [ [v[0],v[1],v[3]], [v[1],v[2],v[3]],\
-                 [v[0],v[2],v[3]], [v[0],v[1],v[2]]]
-        return verts
+        faces = np.array([[0,1,3], [1,2,3], [0,2,3], [0,1,2]])
+        
+        return np.asarray(v)[...,faces,:]
+    
+    def get_slice_faces(self, cluster, sliceat):
+        """Faces of the simplices with phase label `cluster` below z=`sliceat` (cached)
+        
+        returns an array of shape (num_faces, 3, 3)
+        """
+        key = (cluster, sliceat)
+        if key not in self._slice_cache:
+            mask = (self.num_comps==cluster)*(self.simplex_phi4<sliceat)
+            self._slice_cache[key] = self.faces[mask].reshape(-1,3,3)
+        
+        return self._slice_cache[key]
 
     def add_outline(self,ax):
         """Add tetrahedron outline to the axis
@@ -290,17 +458,12 @@ class QuaternaryPlot:
         sliceat : (float, 0.5) Where to slice the tetraehdron in z-direction
         
         """
-        flag_targets = np.asarray(self.engine.num_comps)==cluster
-        
-        for i,simplex in zip(np.asarray(self.engine.num_comps)[flag_targets],self.engine.simplices[flag_targets]):
-            simplex_vertices = [self.engine.grid[:,x] for x in simplex]
-            v = np.asarray([self.from4d23d(vertex) for vertex in simplex_vertices])
-            if np.all(np.asarray(simplex_vertices)[:,3]<sliceat):
-                verts = self._get_convex_faces(v)
-                ax.add_collection3d(
-                    Poly3DCollection(verts,facecolors=self.phase_colors[int(i-1)],
-                                     edgecolors=None)
-                )
+        verts = self.get_slice_faces(cluster, sliceat)
+        if len(verts)>0:
+            ax.add_collection3d(
+                Poly3DCollection(verts,facecolors=self.phase_colors[int(cluster-1)],
+                                 edgecolors=None)
+            )
                 
     def add_scatter(self,ax,cluster,sliceat=0.5):
         """
@@ -309,9 +472,7 @@ class QuaternaryPlot:
         
         """
         
-        cluster_ids = np.where(self.engine.df.T['label']==cluster)
-        slice_ids = np.where(self.threed_coords[:,2]<sliceat)
-        ids = np.intersect1d(slice_ids,cluster_ids)
+        ids = (self.labels==cluster)*(self.threed_coords[:,2]<sliceat)
         ax.scatter(self.threed_coords[ids,0], self.threed_coords[ids,1],
                    self.threed_coords[ids,2], color=self.phase_colors[int(cluster-1)])
     
@@ -320,8 +481,6 @@ class QuaternaryPlot:
         sliceat : (float, 0.5) Where to slice the tetraehdron in z-direction
         """
 
-        self.threed_coords = np.asarray(self.threed_coords)
-        
         fig, axs = plt.subplots(2,2,subplot_kw={'projection': '3d'}, figsize=(8,8))
         axs = axs.flatten()
         for i,ax in enumerate(axs):
@@ -368,21 +527,12 @@ class QuaternaryPlot:
             ax._axis3don = False
             self.add_outline(ax)
             if mode=='simplices':
-                for i,simplex in zip(np.asarray(self.engine.num_comps),self.engine.simplices):
-                    simplex_vertices = [self.engine.grid[:,x] for x in simplex]
-                    v = np.asarray([self.from4d23d(vertex) for vertex in simplex_vertices])
-                    if np.all(np.asarray(simplex_vertices)[:,3]<t):
-                        verts = self._get_convex_faces(v)
-                        ax.add_collection3d(
-                            Poly3DCollection(verts,facecolors=self.phase_colors[int(i-1)],
-                                             edgecolors=None)
-                        )
+                for cluster in np.unique(self.num_comps):
+                    self.add_colored_simplices(ax, cluster, sliceat=t)
                         
             elif mode=='points':
                 for cluster in [1,2,3,4]:
-                    cluster_ids = np.where(self.engine.df.T['label']==cluster)
-                    slice_ids = np.where(self.engine.df.T['Phi_4']<t)
-                    ids = np.intersect1d(slice_ids,cluster_ids)
+                    ids = (self.labels==cluster)*(self.phi4<t)
                     ax.scatter(self.threed_coords[ids,0], self.threed_coords[ids,1],
                                self.threed_coords[ids,2], color=self.phase_colors[int(cluster-1)])
                 
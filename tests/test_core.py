@@ -61,5 +61,151 @@ class TestCore(unittest.TestCase):
         np.testing.assert_array_equal(serial['thresh'], parallel['thresh'])
         pd._testing.assert_frame_equal(serial['output'], parallel['output'])
         
+    def test_sampling(self):
+        grid = polyphase.makegridsample(256, 3, method='halton', seed=0)
+        self.assertEqual(grid.shape, (3,256))
+        np.testing.assert_allclose(grid.sum(axis=0), 1.0)
+        self.engine.compute(sampling='sobol', num_samples=1024, sampling_seed=0)
+        self.assertEqual(self.engine.grid.shape[1], 1024)
+        self.assertEqual(self.engine.df.shape[1], 1024)
+        self.assertTrue(2 in self.engine.df.T['label'].unique())
+        self.assertTrue(np.isin(self.engine.df.T['label'].unique(), [0,1,2,3]).all())
+        self.assertEqual(self.engine.thresh_scale, 3.0)
+        
+    def test_sampling_labels(self):
+        from scipy.spatial import cKDTree
+        # labels of the samples agree with the labels of the nearest (labelled) grid points
+        for M, chi, meshsize, dimension, num_samples, agreement in [([5,5,1], [1,0.5,0.5], 100, 3, 2000, 0.97), 
+                                                                    ([5,5,1,1], [1,0.5,0.5,0.5,0.5,0.5], 30, 4, 4096, 0.9)]:
+            f = polyphase.FloryHuggins(M, chi)
+            grid_engine = polyphase.PHASE(f, meshsize, dimension)
+            grid_engine.compute()
+            grid_labels = grid_engine.df.loc['label',:].to_numpy()
+            engine = polyphase.PHASE(f, meshsize, dimension)
+            engine.compute(sampling='sobol', num_samples=num_samples, sampling_seed=0)
+            labels = engine.df.loc['label',:].to_numpy()
+            labelled = grid_labels>0
+            _, nearest = cKDTree(grid_engine.grid[:,labelled].T).query(engine.grid.T)
+            self.assertGreater(np.mean(labels==grid_labels[labelled][nearest]), agreement)
+            self.assertLessEqual(labels.max(), grid_labels.max()+1)
+        
+    def test_hull_decomposition(self):
+        from polyphase._phase import decomposed_lower_hull, negative_znorm_convexhull
+        # miscible and phase separating landscapes are stitched after repairing the seams, a three phase facet 
+        # spans several patches and the hull is recomputed from the vertices of the local hulls instead
+        for M, chi, meshsize, stitched in [([1,1,1], [0.5,0.5,0.5], 30, True), ([5,5,1], [1,0.5,0.5], 100, True), 
+                                           ([1,1,1], [2.5,2.5,0.5], 100, True), ([1,1,1], [3,3,3], 30, False)]:
+            fm = lambda x : polyphase.flory_huggins(x, M, chi)
+            grid = polyphase.makegridnd(meshsize, 3)
+            energy = np.asarray([fm(x) for x in grid.T])
+            points = np.concatenate((grid[:-1,:].T,energy.reshape(-1,1)),axis=1) 
+            _, full_hull, upper_hull = negative_znorm_convexhull(points)
+            envelope = lambda eq : np.max(-(points[:,:-1]@(eq[:,:-2]/eq[:,-2:-1]).T + eq[:,-1]/eq[:,-2]),axis=1)
+            lower = full_hull.equations[full_hull.equations[:,-2]<-1e-10]
+            for divisions in [2,3]:
+                simplices, hull, is_stitched = decomposed_lower_hull(points, grid, divisions=divisions)
+                self.assertEqual(is_stitched, stitched)
+                np.testing.assert_allclose(envelope(hull.equations), envelope(lower), atol=1e-6)
+        
+        self.engine.compute(hull_decomposition=2)
+        np.testing.assert_array_equal(np.unique(self.engine.num_comps), np.array([1,2]))
+        self.assertEqual(len(self.engine.hull.equations), len(self.engine.simplices))
+        self.assertTrue(self.engine.is_stitched)
+        
+        # the decomposed path is used on a finer grid and labels the same phases as a single hull
+        engine = polyphase.PHASE(f, 100, 3)
+        engine.compute(hull_decomposition=2)
+        self.assertTrue(engine.is_stitched)
+        self.assertEqual(len(engine.hull.equations), len(engine.simplices))
+        num_comps = np.unique(engine.num_comps)
+        engine.compute()
+        self.assertIsNone(engine.is_stitched)
+        np.testing.assert_array_equal(num_comps, np.unique(engine.num_comps))
+        
+    def test_continue_to(self):
+        from polyphase._phase import negative_znorm_convexhull
+        def assert_lower_envelope(engine):
+            points = np.concatenate((engine.grid[:-1,:].T,engine.energy.reshape(-1,1)),axis=1) 
+            _, full_hull, _ = negative_znorm_convexhull(points)
+            envelope = lambda eq : np.max(-(points[:,:-1]@(eq[:,:-2]/eq[:,-2:-1]).T + eq[:,-1]/eq[:,-2]),axis=1)
+            lower = full_hull.equations[full_hull.equations[:,-2]<-1e-10]
+            np.testing.assert_allclose(envelope(engine.hull.equations), envelope(lower), atol=1e-6)
+            
+        fm = lambda c : (lambda x : polyphase.flory_huggins(x, [5,5,1], [c,0.5,0.5]))
+        engine = polyphase.PHASE(fm(1.0), 40, 3)
+        engine.compute(lower_hull_method='point_at_infinity')
+        for c in [1.05, 1.1]:
+            out = engine.continue_to(fm(c))
+            self.assertEqual(engine.point_simplex.shape, (engine.grid.shape[1],))
+            self.assertFalse(engine.continuation_info['recomputed'])
+            # returns the dictonary of the continued diagram
+            np.testing.assert_array_equal(out['simplices'], engine.simplices)
+            self.assertEqual(len(out['num_comps']), len(engine.simplices))
+        assert_lower_envelope(engine)
+        np.testing.assert_array_equal(np.unique(engine.df.loc['label',:]), np.array([1,2]))
+        # a large change of the landscape can not be repaired locally
+        engine.continue_to(fm(2.0))
+        self.assertTrue(engine.continuation_info['recomputed'])
+        assert_lower_envelope(engine)
+        
+        # quaternary landscapes with coplanar points (identical components) and vertical simplices 
+        fm = lambda c : polyphase.FloryHuggins([5,5,1,1], [c,0.5,0.5,0.5,0.5,0.5])
+        engine = polyphase.PHASE(fm(1.0), 20, 4)
+        engine.compute()
+        for c in [1.2, 1.4]:
+            engine.continue_to(fm(c))
+            assert_lower_envelope(engine)
+        fm = lambda c : polyphase.FloryHuggins([5,4,1,2], [c,0.4,0.6,0.7,0.3,0.5])
+        engine = polyphase.PHASE(fm(1.0), 20, 4)
+        engine.compute(lower_hull_method='point_at_infinity')
+        for c in [1.02, 1.04]:
+            engine.continue_to(fm(c))
+            self.assertGreater(engine.continuation_info['repaired'], 0)
+            self.assertFalse(engine.continuation_info['recomputed'])
+            assert_lower_envelope(engine)
+        
+    def test_relabel(self):
+        from polyphase._phase import label_simplex
+        self.engine.compute()
+        labels = self.engine.df.loc['label',:].to_numpy().copy()
+        num_comps = self.engine.get_num_comps([0.5*50, 0.1*50])
+        self.assertEqual(num_comps.shape, (2, len(self.engine.simplices)))
+        np.testing.assert_array_equal(num_comps[1], self.engine.num_comps)
+        self.engine.relabel(0.5*50)
+        expected = [label_simplex(self.engine.grid, s, self.engine.thresh) for s in self.engine.simplices]
+        np.testing.assert_array_equal(self.engine.num_comps, expected)
+        self.engine.relabel(0.1*50)
+        np.testing.assert_array_equal(self.engine.df.loc['label',:].to_numpy(), labels)
+        
+    def test_slim_hull(self):
+        self.engine.compute(lower_hull_method='negative_znorm')
+        full = self.engine.as_dict()
+        self.engine.compute(lower_hull_method='negative_znorm', slim_hull=True)
+        self.assertIsInstance(self.engine.hull, polyphase.LowerHull)
+        self.assertEqual(np.sum(self.engine.upper_hull), 0)
+        np.testing.assert_array_equal(self.engine.hull.simplices, self.engine.simplices)
+        np.testing.assert_array_equal(self.engine.hull.equations, 
+                                      full['hull'].equations[~full['upper_hull']])
+        pd._testing.assert_frame_equal(full['output'], self.engine.df)
+        
+    def test_prescreen(self):
+        fh = polyphase.FloryHuggins([1,1,1], [0.5,0.5,0.5])
+        engine = polyphase.PHASE(fh, 50, 3)
+        engine.compute(prescreen=True)
+        self.assertTrue(engine.is_miscible)
+        self.assertEqual(len(engine.simplices), 0)
+        # boundary points are not labelled as in the regular computation
+        regular = polyphase.PHASE(fh, 50, 3)
+        regular.compute()
+        np.testing.assert_array_equal(engine.df.loc['label',:], regular.df.loc['label',:])
+        engine.compute(prescreen=True, lower_hull_method='point_at_infinity')
+        np.testing.assert_array_equal(engine.df.loc['label',:].unique(), [1])
+        self.engine.compute(prescreen=True)
+        self.assertIsNone(self.engine.is_miscible)
+        engine = polyphase.PHASE(polyphase.FloryHuggins([5,5,1], [1,0.5,0.5]), 50, 3)
+        engine.compute(prescreen=True)
+        self.assertFalse(engine.is_miscible)
+        np.testing.assert_array_equal(np.unique(engine.num_comps), np.array([1,2]))
+        
 if __name__ == '__main__':
     unittest.main()        
\ No newline at end of file
@@ -33,8 +33,30 @@ class TestLSA(unittest.TestCase):
         self.assertEqual(num_k, 50)
         self.assertEqual(num_eigs, 2)
         self.assertFalse(lsa.is_stable(self.point))
+        A = lsa.get_amplification_factor(self.point, lsa.k[10])
+        np.testing.assert_allclose(np.sort(np.linalg.eigvals(A).real), np.sort(lsa.eigen_values[10]))
+        k = np.linspace(0, 120, 1000)
+        self.assertEqual(lsa.get_eigen_spectrum(self.point, k).shape, (1000, 2))
         lsa.plot()
         
         print('class LSA passed')
         
+    def test_stability_map(self):
+        lsa = polyphase.LSA(M,chi)
+        out = lsa.stability_map(self.engine.df)
+        self.assertEqual(len(out['stable']), self.engine.grid.shape[1])
+        for i in range(0, self.engine.grid.shape[1], 500):
+            self.assertEqual(out['stable'][i], lsa.is_stable(self.engine.grid[:,i]))
+        lsa = polyphase.LSA(M,chi,f=f)
+        points = self.engine.grid[:2,::500].T
+        out = lsa.stability_map(points, chunksize=3)
+        np.testing.assert_array_equal(out['stable'], [lsa.is_stable(x) for x in points])
+        self.assertTrue((out['growth_rate'][~out['stable']]>0).all())
+        # ray started for the map is shut down afterwards, a running one is left as is
+        import ray
+        initialized = ray.is_initialized()
+        parallel = lsa.stability_map(points, chunksize=3, use_parallel=True)
+        np.testing.assert_array_equal(parallel['stable'], out['stable'])
+        self.assertEqual(ray.is_initialized(), initialized)
+        
         
\ No newline at end of file
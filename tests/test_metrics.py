@@ -0,0 +1,92 @@
+import numpy as np
+import polyphase
+import unittest
+import os
+import tempfile
+from functools import partial
+from scipy.spatial.distance import squareform
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        engines = []
+        for chi in [0.9, 1.0, 1.3]:
+            engine = polyphase.PHASE(polyphase.FloryHuggins([5,5,1], [chi,0.5,0.5]), 40, 3)
+            engine.compute()
+            engines.append(engine)
+        self.grid = engines[0].grid
+        self.labels = polyphase.get_label_stack(engines)
+
+    def test_get_label_stack(self):
+        self.assertEqual(self.labels.shape, (3, self.grid.shape[1]))
+        engine = polyphase.PHASE(polyphase.FloryHuggins([5,5,1], [1,0.5,0.5]), 30, 3)
+        engine.compute()
+        self.assertRaises(ValueError, lambda : polyphase.get_label_stack([engine, engine,
+                                                                         polyphase.PHASE(engine.energy, 40, 3)]))
+
+    def test_hamming_distance(self):
+        D = polyphase.hamming_distance(self.labels)
+        expected = [[np.mean(a!=b) for b in self.labels] for a in self.labels]
+        np.testing.assert_allclose(D, expected, atol=1e-12)
+        np.testing.assert_allclose(polyphase.hamming_distance(self.labels[:1], self.labels[1:]), D[:1,1:])
+        M = polyphase.get_distance_matrix(self.labels, polyphase.hamming_distance, vectorized=True,
+                                          condensed=True, use_parallel=False, block_size=2)
+        np.testing.assert_allclose(M, squareform(D, checks=False), atol=1e-12)
+
+    def test_area_distance(self):
+        D = polyphase.area_distance(self.labels)
+        np.testing.assert_allclose(np.diag(D), 0, atol=1e-12)
+        np.testing.assert_allclose(D, D.T)
+        self.assertTrue((D[~np.eye(3, dtype=bool)]>0).all())
+        # diagrams moving away from the first one as chi increases
+        self.assertLess(D[0,1], D[0,2])
+        # disjoint regions are at the maximum distance
+        a = np.array([[1,1,2,2]])
+        np.testing.assert_allclose(polyphase.area_distance(a, 3-a), 1.0)
+
+    def test_sliced_wasserstein_distance(self):
+        metric = partial(polyphase.sliced_wasserstein_distance, grid=self.grid)
+        D = metric(self.labels)
+        # squared distances are expanded as matrix products, exact up to cancellation
+        np.testing.assert_allclose(np.diag(D), 0, atol=1e-6)
+        np.testing.assert_allclose(D, D.T, atol=1e-12)
+        self.assertLess(D[0,1], D[0,2])
+        M = polyphase.get_distance_matrix(self.labels, metric, vectorized=True, use_parallel=False, block_size=2)
+        np.testing.assert_allclose(M, D - np.diag(np.diag(D)), atol=1e-6)
+        self.assertRaises(ValueError, lambda : polyphase.sliced_wasserstein_distance(self.labels))
+
+    def test_DiagramIndex(self):
+        rng = np.random.default_rng(0)
+        # noisy copies of the diagrams, the ones of the first diagram being the closest to it
+        noise = rng.random((30, self.labels.shape[1]))<np.linspace(0.0, 0.3, 10).repeat(3).reshape(-1,1)
+        library = np.where(noise, rng.integers(1, 4, noise.shape), np.tile(self.labels, (10,1)))
+        index = polyphase.DiagramIndex(num_tables=4, bits_per_table=8, num_bits=256)
+        np.testing.assert_array_equal(index.add(library[:20]), np.arange(20))
+        np.testing.assert_array_equal(index.add(library[20:]), np.arange(20,30))
+        self.assertEqual(len(index), 30)
+        self.assertEqual(index.codes.shape, (30, 32))
+
+        ids, distances = index.query(self.labels, k=3)
+        np.testing.assert_array_equal(ids[:,0], [0,1,2])
+        np.testing.assert_allclose(distances[:,0], 0)
+        self.assertTrue((np.diff(distances, axis=1)>=0).all())
+        ids = index.query(self.labels[:1], k=5, return_distance=False)[0]
+        self.assertLess(np.mean(library[ids]!=self.labels[0]), np.mean(library!=self.labels[0]))
+        # estimated distances are close to the Hamming distances
+        _, distances = index.query(library, k=30)
+        H = np.sort(polyphase.hamming_distance(library), axis=1)
+        self.assertLess(np.abs(distances-H).mean(), 0.05)
+
+        G = index.kneighbors_graph(n_neighbors=4)
+        self.assertEqual(G.shape, (30,30))
+        self.assertEqual(G.nnz, 120)
+        self.assertTrue((G.diagonal()==0).all())
+        self.assertRaises(ValueError, lambda : index.add(library[:,:-1]))
+        self.assertRaises(ValueError, lambda : index.query(self.labels, k=31))
+        with tempfile.TemporaryDirectory() as dirname:
+            fname = os.path.join(dirname, 'index.npz')
+            index.save(fname)
+            loaded = polyphase.DiagramIndex.load(fname)
+        np.testing.assert_array_equal(loaded.query(library[5:9], k=4)[0], index.query(library[5:9], k=4)[0])
+
+if __name__ == '__main__':
+    unittest.main()
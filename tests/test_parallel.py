@@ -0,0 +1,66 @@
+import numpy as np
+import polyphase
+import unittest
+import os
+import tempfile
+from scipy.spatial.distance import pdist, cdist, euclidean, squareform
+
+# ignore the ray warnings
+import warnings
+warnings.filterwarnings("ignore")
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.X = np.random.default_rng(0).random((23,3))
+
+    def test_get_distance_matrix(self):
+        expected = pdist(self.X)
+        calls = []
+        M = polyphase.get_distance_matrix(self.X, euclidean, block_size=5, use_parallel=False,
+                                          progress=lambda done, total : calls.append((done, total)))
+        np.testing.assert_allclose(M, squareform(expected))
+        # 5 blocks per side give 15 tiles of the upper triangle
+        self.assertEqual(calls[-1], (15,15))
+        M = polyphase.get_distance_matrix(self.X, cdist, block_size=7, vectorized=True,
+                                          condensed=True, use_parallel=False)
+        np.testing.assert_allclose(M, expected)
+        import ray
+        initialized = ray.is_initialized()
+        M = polyphase.get_distance_matrix(self.X, cdist, block_size=7, vectorized=True, condensed=True)
+        np.testing.assert_allclose(M, expected)
+        self.assertEqual(ray.is_initialized(), initialized)
+        
+    def test_memmap(self):
+        expected = squareform(pdist(self.X))
+        with tempfile.TemporaryDirectory() as dirname:
+            fname = os.path.join(dirname, 'distance.npy')
+            calls = []
+            kwargs = dict(block_size=5, vectorized=True, use_parallel=False, filename=fname, 
+                          progress=lambda done, total : calls.append(done))
+            M = polyphase.get_distance_matrix(self.X, cdist, **kwargs)
+            self.assertIsInstance(M, polyphase.CondensedDistanceMatrix)
+            self.assertEqual(M.shape, (23,23))
+            np.testing.assert_allclose(M[3], expected[3])
+            np.testing.assert_allclose(M[4:11], expected[4:11])
+            self.assertAlmostEqual(M[2,7], expected[2,7])
+            np.testing.assert_allclose(M[-1], expected[-1])
+            self.assertAlmostEqual(M[2,-1], expected[2,-1])
+            self.assertAlmostEqual(M[-1,-1], 0.0)
+            self.assertRaises(IndexError, lambda : M[23])
+            self.assertRaises(IndexError, lambda : M[0,-24])
+            self.assertAlmostEqual(M.std(), expected.std())
+            np.testing.assert_allclose(M.to_squareform(), expected)
+            # resume after an interruption of the last five tiles
+            is_done = np.load(fname+'.tiles.npy', mmap_mode='r+')
+            is_done[-5:] = False
+            is_done.flush()
+            del M, is_done
+            calls.clear()
+            M = polyphase.get_distance_matrix(self.X, cdist, **kwargs)
+            self.assertEqual(calls, [11,12,13,14,15])
+            np.testing.assert_allclose(polyphase.CondensedDistanceMatrix.open(fname).to_squareform(), expected)
+            self.assertRaises(ValueError, lambda : polyphase.get_distance_matrix(self.X, cdist, 
+                                                                                 **dict(kwargs, block_size=7)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import numpy as np
+import polyphase
+import unittest
+import os
+import tempfile
+
+import matplotlib.pyplot as plt
+
+class TestRaster(unittest.TestCase):
+    def setUp(self):
+        self.engine = polyphase.PHASE(polyphase.FloryHuggins([5,5,1], [1,0.5,0.5]), 50, 3)
+        self.engine.compute()
+
+    def test_rasterize(self):
+        labels = polyphase.rasterize([self.engine]*3, size=64)
+        self.assertEqual(labels.shape, (3, 56, 64))
+        self.assertEqual(labels.dtype, np.uint8)
+        np.testing.assert_array_equal(labels[0], labels[2])
+        image = polyphase.rasterize_labels(self.engine.grid, self.engine.df.loc['label',:].to_numpy(), size=64)
+        np.testing.assert_array_equal(image, labels[0])
+        # the top corner is the 1-phase solvent rich region and the bottom corners are outside of the triangle
+        self.assertEqual(image[5,32], 1)
+        self.assertEqual(image[-1,0], 0)
+
+        simplices = polyphase.rasterize([self.engine], size=64, mode='simplices')[0]
+        self.assertTrue(np.isin(simplices, [0,1,2]).all())
+        inside = (image>0)*(simplices>0)
+        self.assertGreater(np.mean(image[inside]==simplices[inside]), 0.95)
+
+    def test_write_png(self):
+        image = polyphase.to_rgb(polyphase.rasterize([self.engine], size=64)[0])
+        with tempfile.TemporaryDirectory() as dirname:
+            fname = os.path.join(dirname, 'diagram.png')
+            polyphase.write_png(fname, image)
+            loaded = plt.imread(fname)
+        np.testing.assert_array_equal((loaded*255).round().astype(np.uint8), image)
+
+if __name__ == '__main__':
+    unittest.main()
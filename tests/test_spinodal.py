@@ -0,0 +1,47 @@
+import numpy as np
+import polyphase
+import unittest
+from collections import Counter
+from polyphase.spinodal import get_lattice_simplices
+
+class TestSpinodal(unittest.TestCase):
+    def test_lattice(self):
+        counts, simplices = get_lattice_simplices(5, 4)
+        self.assertEqual(len(counts), 35)
+        np.testing.assert_array_equal(counts.sum(axis=1), 4)
+        # the lattice of (meshsize-1)^(dim-1) unit simplices
+        self.assertEqual(len(simplices), 4**3)
+        self.assertEqual(len(np.unique(np.sort(simplices, axis=1), axis=0)), 4**3)
+        
+    def test_ternary(self):
+        fh = polyphase.FloryHuggins([5,5,1], [1.5,0.5,0.5])
+        spinodal = polyphase.Spinodal(fh, 50, 3)
+        spinodal.compute(polish=True)
+        self.assertEqual(spinodal.grid.shape[1], 50*51//2)
+        points = np.vstack(spinodal.polylines)
+        np.testing.assert_allclose(points.sum(axis=1), 1.0)
+        np.testing.assert_allclose(spinodal.criterion(points), 0.0, atol=1e-6)
+        spinodal.plot()
+        
+    def test_quaternary(self):
+        fh = polyphase.FloryHuggins([5,5,1,1], [1.5,0.5,0.5,0.5,0.5,0.5])
+        spinodal = polyphase.Spinodal(fh, 20, 4)
+        spinodal.compute(method='determinant')
+        self.assertEqual(spinodal.faces.shape[1], 3)
+        self.assertTrue(spinodal.faces.max()<len(spinodal.vertices))
+        # every edge of the surface is shared by at most two triangles
+        edges = Counter(tuple(sorted(e)) for f in spinodal.faces for e in [(f[0],f[1]),(f[1],f[2]),(f[0],f[2])])
+        self.assertTrue(max(edges.values())<=2)
+        self.assertRaises(ValueError, lambda : polyphase.Spinodal(lambda x: 0, 20, 3))
+        
+    def test_certify_miscibility(self):
+        self.assertTrue(polyphase.certify_miscibility(polyphase.FloryHuggins([1,1,1], [0.5,0.5,0.5])))
+        self.assertFalse(polyphase.certify_miscibility(polyphase.FloryHuggins([5,5,1], [1,0.5,0.5])))
+        # needs the cell-wise bounds of the coarse lattice
+        fh = polyphase.FloryHuggins([1,1,1,1], [1.5,1.5,1.5,1.5,1.5,1.5])
+        spinodal = polyphase.Spinodal(fh, 20, 4)
+        spinodal.compute()
+        self.assertTrue((spinodal.values>0).all())
+        self.assertTrue(polyphase.certify_miscibility(fh))
+        # the bounds do not hold for negative beta
+        self.assertFalse(polyphase.certify_miscibility(polyphase.FloryHuggins([1,1,1], [0.5,0.5,0.5], beta=-1e-3)))
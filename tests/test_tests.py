@@ -34,6 +34,16 @@ class TestTests(unittest.TestCase):
         
         print('class CentralDifferences passed')
         
+        X = 0.1 + 0.6*np.random.default_rng(0).dirichlet(np.ones(4), size=20)
+        X /= X.sum(axis=1, keepdims=True)
+        fh = polyphase.FloryHuggins([5,5,1,2], [1,0.5,0.5,0.2,0.3,0.4])
+        cd = polyphase.CentralDifference(fh)
+        self.assertEqual(cd.get_stencil(X).shape, (20*2*3, 4))
+        gradient = cd(X)
+        self.assertEqual(gradient.shape, (20,3))
+        np.testing.assert_allclose(gradient, fh.gradient(X), rtol=1e-4)
+        np.testing.assert_allclose(cd(X[0]), gradient[0])
+        
     def test_TestAngles(self):
         gradient = polyphase.CentralDifference(self.fh)
         TEST = polyphase.TestAngles(self.engine, simplex_id=0)
@@ -62,13 +72,77 @@ class TestTests(unittest.TestCase):
         self.assertTrue(np.all(x_obtained>0))
         phasesplits.visualize_centroid()
         
+    def test_TestSimplices(self):
+        engine = polyphase.PHASE(self.fh, 30, 3)
+        engine.compute()
+        df = engine.test(mode='batch')
+        self.assertEqual(len(df), len(engine.simplices))
+        self.assertTrue((df['min_dot_product']<=1.0+1e-12).all())
+        two_phase = np.where(df['num_comps']==2)[0]
+        for simplex_id in two_phase[:5]:
+            centroid = engine.grid[:,engine.simplices[simplex_id]].mean(axis=1)
+            x, _, _ = engine(centroid, simplex_id=simplex_id)
+            splits = df.loc[simplex_id, ['split_0','split_1','split_2']].to_numpy(dtype=float)
+            np.testing.assert_allclose(splits, x, atol=1e-6)
+            phasesplits = polyphase.TestPhaseSplits(engine, phase=2, simplex_id=simplex_id, threshold=0.05)
+            self.assertEqual(phasesplits.check_centroid(), df.loc[simplex_id, 'centroid_match'])
+        self.assertTrue(df.loc[df['num_comps']==1, 'centroid_match'].isnull().all())
+        # certified miscible diagrams do not have a hull to test
+        engine = polyphase.PHASE(polyphase.FloryHuggins([1,1,1], [0.5,0.5,0.5]), 30, 3)
+        engine.compute(prescreen=True)
+        df = engine.test(mode='batch')
+        self.assertEqual(len(df), 0)
+        self.assertIn('min_dot_product', df.columns)
         
+    def test_TestSampledSplits(self):
+        out = self.engine.test(mode='sample', time_budget=30, target_halfwidth=0.0, 
+                               max_samples=1000, batch_size=250, seed=0)
+        self.assertEqual(out['num_samples'], 1000)
+        lower, upper = out['interval']
+        self.assertTrue(lower<=out['pass_rate']<=upper)
+        self.assertEqual(list(out['per_label'].keys()), [2])
+        self.assertAlmostEqual(out['pass_rate'], out['per_label'][2][1])
+        # ray started for the sampling is shut down afterwards, a running one is left as is
+        import ray
+        initialized = ray.is_initialized()
+        out = self.engine.test(mode='sample', time_budget=30, target_halfwidth=0.0, 
+                               max_samples=500, batch_size=250, seed=0, use_parallel=True)
+        self.assertGreaterEqual(out['num_samples'], 500)
+        self.assertEqual(ray.is_initialized(), initialized)
+        # a single stratum gives the Wilson interval
+        np.testing.assert_allclose(polyphase.tests.stratified_wilson_interval([90], [100], [1.0]), 
+                         polyphase.tests.wilson_interval(90, 100))
+        # strata are weighted by their share of the area and not by their number of samples
+        p = 0.9*0.2 + 0.5*0.8
+        lower, upper = polyphase.tests.stratified_wilson_interval([450, 250], [500, 500], [0.2, 0.8])
+        self.assertTrue(lower<p<upper)
+        self.assertTrue(upper<0.7)
         
+        sampler = polyphase.TestSampledSplits(self.engine, seed=0)
+        simplex_ids, points = sampler.draw(100)
+        vertices = sampler._vertices(simplex_ids)
+        # sampled points are inside their simplices
+        T = np.concatenate((np.transpose(vertices[:,:,:-1], (0,2,1)), np.ones((100,1,3))), axis=1)
+        b = np.linalg.solve(T, np.hstack((points[:,:-1], np.ones((100,1))))[:,:,np.newaxis])
+        self.assertTrue((b>-1e-10).all())
         
+        simplex_id = np.where(np.asarray(self.engine.num_comps)==2)[0][0]
+        phasesplits = polyphase.TestPhaseSplits(self.engine, phase=2, simplex_id=simplex_id)
+        phasesplits.run(sample_size=2, seed=0)
+        self.assertEqual(len(phasesplits.results), min(2, phasesplits.interval.shape[1]))
         
-        
-        
-        
-        
-        
-        
\ No newline at end of file
+    def test_TestEpiGraph(self):
+        simplex_id = np.where(np.asarray(self.engine.num_comps)==2)[0][0]
+        epigraph = polyphase.TestEpiGraph(self.engine, simplex_id=simplex_id)
+        self.assertTrue(epigraph.is_epigraph())
+        self.assertEqual(epigraph.violations_.shape, (epigraph.interval.shape[1],))
+        f_plane = epigraph._get_convex_energy(epigraph.interval)
+        f_loop = [epigraph._get_convex_energy(x) for x in epigraph.interval.T]
+        np.testing.assert_allclose(f_plane, f_loop)
+        self.assertTrue(epigraph.is_epigraph(all_simplices=True))
+        violations = polyphase.get_epigraph_violations(self.engine)
+        self.assertEqual(violations.shape, (self.engine.grid.shape[1],))
+        # a point pushed below the hull violates the planes of its neighboring simplices
+        self.engine.energy[np.argmin(self.engine.energy)] -= 0.1
+        self.assertGreater(polyphase.get_epigraph_violations(self.engine).max(), 0.0)
+
@@ -1,6 +1,8 @@
 import numpy as np
 import unittest
 import polyphase
+import subprocess
+import sys
 
 class TestUtils(unittest.TestCase):
     def test_utri2mat(self):
@@ -35,4 +37,56 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(inds,[(0,1),(0,2),(1,2)])
         
         print('function polyphase.get_chi_vector passed' )
-        
\ No newline at end of file
+
+    def test_get_chi_table(self):
+        rng = np.random.default_rng(0)
+        solvents = rng.uniform(10, 25, (7,3))
+        polymer, small_molecule = [18.0, 5.0, 4.0], [20.0, 4.5, 4.5]
+        V = rng.uniform(50, 150, 7)
+        for approach in [1,2,3]:
+            table = polyphase.get_chi_table(solvents, polymer, small_molecule, V, approach=approach)
+            self.assertEqual(table.shape, (7,3))
+            expected = [polyphase.get_chi_vector([polymer, small_molecule, s], v, approach=approach)[0]
+                        for s, v in zip(solvents, V)]
+            np.testing.assert_allclose(table, expected)
+        table = polyphase.get_chi_table(solvents, polymer, small_molecule, 100.0)
+        np.testing.assert_allclose(table[:,0], table[0,0])
+        self.assertRaises(KeyError, lambda : polyphase.get_chi_table(solvents, polymer, small_molecule, V, approach=4))
+
+        print('function polyphase.get_chi_table passed' )
+        
+    def test_FloryHuggins(self):
+        M = [5,5,1,10]
+        chi = [1,0.5,0.5,0.8,0.2,0.3]
+        fh = polyphase.FloryHuggins(M, chi, beta=1e-3)
+        X = 0.1 + 0.6*np.random.default_rng(0).dirichlet(np.ones(4), size=10)
+        energy = [polyphase.flory_huggins(x, M, chi, beta=1e-3) for x in X]
+        np.testing.assert_allclose(fh.batch(X), energy)
+        self.assertAlmostEqual(fh(X[0]), energy[0])
+        
+        # finite differences along the reduced coordinates
+        h = 1e-6
+        P = np.vstack((np.identity(3), -np.ones((1,3))))
+        grad = np.asarray([(fh.batch(X+h*P[:,i])-fh.batch(X-h*P[:,i]))/(2*h) for i in range(3)]).T
+        np.testing.assert_allclose(fh.gradient(X), grad, rtol=1e-5)
+        hess = np.asarray([(fh.gradient(X+h*P[:,i])-fh.gradient(X-h*P[:,i]))/(2*h) for i in range(3)])
+        np.testing.assert_allclose(fh.hessian(X), np.transpose(hess, (1,0,2)), rtol=1e-4)
+        self.assertEqual(fh.hessian(X, reduced=False).shape, (10,4,4))
+        
+        cd = polyphase.CentralDifference(lambda x : polyphase.flory_huggins(x, [5,5,1], [1,0.5,0.5]))
+        np.testing.assert_allclose(polyphase.FloryHuggins([5,5,1], [1,0.5,0.5]).gradient([0.45,0.45,0.1]), 
+                                   cd([0.45,0.45,0.1]), rtol=1e-4)
+        
+    def test_lazy_imports(self):
+        script = ("import sys, polyphase; polyphase.makegridnd(10, 3); "
+                  "print(' '.join(m for m in ['ray','matplotlib','mpltern','pandas','autograd'] if m in sys.modules))")
+        out = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip(), '')
+        self.assertIs(polyphase.TernaryPlot, polyphase.visuals.TernaryPlot)
+        self.assertIn('PHASE', dir(polyphase))
+        self.assertRaises(AttributeError, lambda : polyphase.not_an_attribute)
+        namespace = {}
+        exec('from polyphase import *', namespace)
+        for name in ['PHASE', 'makegridnd', 'TernaryPlot', 'flory_huggins', 'get_distance_matrix']:
+            self.assertIn(name, namespace)
+        self.assertNotIn('_utri2mat', namespace)
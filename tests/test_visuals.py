@@ -16,6 +16,29 @@ class TestVisuals(unittest.TestCase):
     def test_plot_energy_landscape(self):
         polyphase.plot_energy_landscape(self.engine.as_dict(), mode='full')
         polyphase.plot_energy_landscape(self.engine.as_dict(), mode='convex_hull')
+        for mode in ['full', 'convex_hull']:
+            ax, fig = polyphase.plot_energy_landscape(self.engine.as_dict(), mode=mode, max_triangles=200)
+            self.assertLessEqual(len(ax.collections[0].get_paths()), 200)
+        
+        from polyphase.visuals import _merge_coplanar_facets
+        points = np.array([[0,0,0],[1,0,0],[1,1,0],[0,1,0]], dtype=float)
+        triangles = np.array([[0,1,2],[0,2,3]])
+        polygons, edges = _merge_coplanar_facets(points, triangles)
+        self.assertEqual(len(polygons), 1)
+        self.assertEqual(sorted(polygons[0]), [0,1,2,3])
+        self.assertEqual(len(edges), 4)
+        # vertical facets are merged and degenerate ones are kept as they are
+        polygons, edges = _merge_coplanar_facets(points[:,[0,2,1]], triangles)
+        self.assertEqual((len(polygons), len(edges)), (1, 4))
+        points[2,2] = 1.0
+        polygons, edges = _merge_coplanar_facets(points, triangles)
+        self.assertEqual((len(polygons), len(edges)), (2, 5))
+        points = np.array([[0,0,0],[1,0,0],[2,0,0],[0,1,0]], dtype=float)
+        polygons, edges = _merge_coplanar_facets(points, np.array([[0,1,2],[0,1,3]]))
+        self.assertEqual((len(polygons), len(edges)), (2, 5))
+        # the three phase region and other planar regions of the hull are drawn as polygons
+        ax, _ = polyphase.plot_energy_landscape(self.engine.as_dict(), mode='convex_hull')
+        self.assertLess(len(ax.collections[0].get_paths()), len(self.engine.simplices))
         
         print('function plot_energy_landscape passed')
         
@@ -25,7 +48,10 @@ class TestVisuals(unittest.TestCase):
         
     def test_TernaryPlot(self):
         ternplot = polyphase.TernaryPlot(self.engine)
-        ternplot.plot_simplices()
+        ax, _ = ternplot.plot_simplices()
+        num_phases = len(np.unique(self.engine.num_comps))
+        self.assertEqual(len(ax.collections), num_phases)
+        self.assertEqual(sum(len(c.get_paths()) for c in ax.collections), len(self.engine.simplices))
         ternplot.plot_points()
         print('class TernaryPlot passed')
         
@@ -40,8 +66,15 @@ class TestVisuals(unittest.TestCase):
         qtplot = polyphase.QuaternaryPlot(engine)
         verts = qtplot.from4d23d([1,0,0,0])
         self.assertEqual(verts,[0,0,0])
+        self.assertEqual(qtplot.faces.shape, (len(engine.simplices),4,3,3))
+        self.assertEqual(qtplot.threed_coords.shape, (engine.grid.shape[1],3))
+        faces = qtplot.get_slice_faces(2, 0.5)
+        self.assertIs(qtplot.get_slice_faces(2, 0.5), faces)
+        mask = (np.asarray(engine.num_comps)==2)*np.all(engine.grid[3,engine.simplices]<0.5, axis=1)
+        self.assertEqual(len(faces), 4*np.sum(mask))
         qtplot.plot_points()
         qtplot.plot_simplices()
+        qtplot.show()
         print('class QuaternaryPlot passed')
         
         